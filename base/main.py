@@ -1,9 +1,9 @@
 # 1. Import needed libraries
 
 import os
+import sys
 from PIL import Image
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from glob import glob
@@ -16,7 +16,15 @@ from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense, Dropout, Flatten
 from tensorflow.keras.optimizers import Adamax
 from tensorflow.keras.metrics import Precision, Recall
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
+#---------------------------------------
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.manifest import load_dataset_df
+from common.augmentation import BatchAugmentation
+from common.data_pipeline import flow_from_split
+from common.decode import read_image
+from common.hashing import audit_splits, drop_flagged
+from common.precision import set_precision
+from common.progressive import fit_progressive, resize_schedule
 #---------------------------------------
 import warnings
 warnings.filterwarnings("ignore")
@@ -26,21 +34,13 @@ warnings.filterwarnings("ignore")
 # 2.1 Load data
 
 def train_df(tr_path):
-    classes, class_paths = zip(*[(label, os.path.join(tr_path, label, image))
-                                 for label in os.listdir(tr_path) if os.path.isdir(os.path.join(tr_path, label))
-                                 for image in os.listdir(os.path.join(tr_path, label))])
-
-    tr_df = pd.DataFrame({'Class Path': class_paths, 'Class': classes})
-    return tr_df
+    # Served from the persistent manifest; only changed class folders are rescanned
+    return load_dataset_df(tr_path)
 
 
 def test_df(ts_path):
-    classes, class_paths = zip(*[(label, os.path.join(ts_path, label, image))
-                                 for label in os.listdir(ts_path) if os.path.isdir(os.path.join(ts_path, label))
-                                 for image in os.listdir(os.path.join(ts_path, label))])
-
-    ts_df = pd.DataFrame({'Class Path': class_paths, 'Class': classes})
-    return ts_df
+    # Served from the persistent manifest; only changed class folders are rescanned
+    return load_dataset_df(ts_path)
 
 
 tr_df = train_df('brain-tumor-mri-dataset/Training')
@@ -71,6 +71,11 @@ plt.show()
 # 2.2 Split data into train, test, valid
 
 valid_df, ts_df = train_test_split(ts_df, train_size=0.5, random_state=20, stratify=ts_df['Class'])
+
+# Flag corrupt, duplicated and leaked images before they reach a model;
+# corrupt files are dropped, duplicates and leaks only reported
+audit = audit_splits({'train': tr_df, 'valid': valid_df, 'test': ts_df})
+tr_df, valid_df, ts_df = (drop_flagged(df, audit) for df in (tr_df, valid_df, ts_df))
 valid_df
 
 # 2.3 Data preprocessing
@@ -81,30 +86,34 @@ img_size = (299, 299)
 batch_size = 32
 img_size = (299, 299)
 
-_gen = ImageDataGenerator(rescale=1/255,
-                          brightness_range=(0.8, 1.2))
-
-ts_gen = ImageDataGenerator(rescale=1/255)
+_gen = BatchAugmentation(brightness_range=(0.8, 1.2))
 
+# Storage the loaders read from:
+#   'records' - sequential TFRecord shards, exported once per split
+#   'cache'   - pre-decoded uint8 rows, memory-mapped per split and img_size
+#   'files'   - one image file read per sample
+DATA_SOURCE = 'records'
 
-tr_gen = _gen.flow_from_dataframe(tr_df, x_col='Class Path',
-                                  y_col='Class', batch_size=batch_size,
-                                  target_size=img_size)
+tr_gen = flow_from_split(tr_df, 'train', source=DATA_SOURCE,
+                         batch_size=batch_size, target_size=img_size,
+                         augmentation=_gen)
 
-valid_gen = _gen.flow_from_dataframe(valid_df, x_col='Class Path',
-                                     y_col='Class', batch_size=batch_size,
-                                     target_size=img_size)
+# Validation is decoded once into memory and never augmented, so the
+# val_* metrics the callbacks watch are the same images every epoch
+valid_gen = flow_from_split(valid_df, 'valid', source='memory',
+                            batch_size=batch_size, target_size=img_size,
+                            shuffle=False, class_indices=tr_gen.class_indices)
 
-ts_gen = ts_gen.flow_from_dataframe(ts_df, x_col='Class Path',
-                                  y_col='Class', batch_size=16,
-                                  target_size=img_size, shuffle=False)
+ts_gen = flow_from_split(ts_df, 'test', source=DATA_SOURCE,
+                         batch_size=16, target_size=img_size,
+                         shuffle=False)
 
 
 # 2.4 Getting samples from data
 
 class_dict = tr_gen.class_indices
 classes = list(class_dict.keys())
-images, labels = next(ts_gen)
+images, labels = next(iter(ts_gen))
 
 plt.figure(figsize=(20, 20))
 
@@ -120,26 +129,37 @@ plt.show()
 # 3. Building Deep Learning Model
 
 img_shape=(299,299,3)
-base_model = tf.keras.applications.Xception(include_top= False, weights= "imagenet",
-                            input_shape= img_shape, pooling= 'max')
-
-# for layer in base_model.layers:
-#     layer.trainable = False
-    
-model = Sequential([
-    base_model,
-    Flatten(),
-    Dropout(rate= 0.3),
-    Dense(128, activation= 'relu'),
-    Dropout(rate= 0.25),
-    Dense(4, activation= 'softmax')
-])
-
-model.compile(Adamax(learning_rate= 0.001),
-              loss= 'categorical_crossentropy',
-              metrics= ['accuracy',
-                        Precision(),
-                        Recall()])
+# Keras dtype policy: 'float32', 'mixed_bfloat16' (CPUs with BF16/AMX, TPUs)
+# or 'mixed_float16' (GPUs, with automatic loss scaling); see common/precision.py
+PRECISION = 'float32'
+set_precision(PRECISION)
+
+def build_model(img_shape):
+    # Also builds the smaller-input models of progressive resizing (section 4)
+    base_model = tf.keras.applications.Xception(include_top= False, weights= "imagenet",
+                                input_shape= img_shape, pooling= 'max')
+
+    # for layer in base_model.layers:
+    #     layer.trainable = False
+
+    model = Sequential([
+        base_model,
+        Flatten(),
+        Dropout(rate= 0.3),
+        Dense(128, activation= 'relu'),
+        Dropout(rate= 0.25),
+        Dense(4, activation= 'softmax', dtype= 'float32')  # float32 under a mixed policy
+    ])
+
+    model.compile(Adamax(learning_rate= 0.001),
+                  loss= 'categorical_crossentropy',
+                  metrics= ['accuracy',
+                            Precision(name= 'precision'),
+                            Recall(name= 'recall')])
+    return model
+
+
+model = build_model(img_shape)
 
 model.summary()
 
@@ -149,10 +169,23 @@ tf.keras.utils.plot_model(model, show_shapes=True)
 
 # 4. Training
 
-hist = model.fit(tr_gen,
-                 epochs=10,
-                 validation_data=valid_gen,
-                 shuffle=False)
+# Progressive resizing (common/progressive.py): the first epochs train at
+# PROGRESSIVE_START_SIZE and the size steps up to img_size over
+# PROGRESSIVE_STAGES sizes, with one pre-built model per size sharing the
+# weights; None trains at img_size throughout
+PROGRESSIVE_START_SIZE = None
+PROGRESSIVE_STAGES = 3
+
+if PROGRESSIVE_START_SIZE is None:
+    hist = model.fit(tr_gen,
+                     epochs=10,
+                     validation_data=valid_gen,
+                     shuffle=False)
+else:
+    schedule = resize_schedule(img_size[0], 10, PROGRESSIVE_START_SIZE, PROGRESSIVE_STAGES)
+    model, hist = fit_progressive(
+        lambda size: model if size == img_size[0] else build_model((size, size, 3)),
+        schedule, tr_gen, validation_data=valid_gen, shuffle=False)
 
 hist.history.keys()
 
@@ -272,9 +305,9 @@ def predict(img_path):
     from PIL import Image
     label = list(class_dict.keys())
     plt.figure(figsize=(12, 12))
-    img = Image.open(img_path)
-    resized_img = img.resize((299, 299))
-    img = np.asarray(resized_img)
+    # Decodes at a reduced JPEG scale before the final (bicubic) resize
+    resized_img = read_image(img_path, img_size, Image.BICUBIC)
+    img = resized_img
     img = np.expand_dims(img, axis=0)
     img = img / 255
     predictions = model.predict(img)
@@ -0,0 +1,125 @@
+# benchmarks/accumulation.py
+#
+# Throughput and peak memory of model.fit() against fit_accumulated()
+# (common/training.py) at one effective batch size: fit runs whole batches,
+# the accumulating loop splits each into N micro-batches. The model is the
+# script's AS_Net with random weights (weights=None) on random images,
+# compiled with the scripts' Precision/Recall/AUC metrics and trained with
+# class weights, so both engines do the same bookkeeping. Each run is a fresh
+# process, because peak memory can only be read once per process; the time
+# is that of the second epoch, after tracing.
+#
+#   python benchmarks/accumulation.py --script vgg16 --batch-size 64 --accumulation-steps 1 2 4 8
+#   python benchmarks/accumulation.py --script mobilenet_v3_large --jit-compile --no-fit
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.blocks import AS_NET_SCRIPTS, as_net  # noqa: E402
+from common.training import fit_accumulated  # noqa: E402
+
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    def on_train_begin(self, logs=None):
+        self.times = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.times.append(time.perf_counter() - self.start)
+
+
+def peak_memory():
+    if tf.config.list_physical_devices('GPU'):
+        return tf.config.experimental.get_memory_info('GPU:0')['peak']
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run(args):
+    tf.keras.utils.set_random_seed(0)
+    build = as_net(args.script)
+    model = build(input_size=(args.image_size, args.image_size, 3),
+                  fine_tune_at=args.fine_tune_at, jit_compile=args.jit_compile,
+                  weights=None)
+    model.compile(optimizer=tf.keras.optimizers.Adam(1e-4), loss='categorical_crossentropy',
+                  jit_compile=model.jit_compile,
+                  metrics=['accuracy', tf.keras.metrics.Precision(name='precision'),
+                           tf.keras.metrics.Recall(name='recall'), tf.keras.metrics.AUC(name='auc')])
+
+    rng = np.random.default_rng(0)
+    images = args.batch_size * args.steps
+    x = rng.random((images, args.image_size, args.image_size, 3), dtype=np.float32)
+    y = np.eye(4, dtype=np.float32)[rng.integers(0, 4, images)]
+    class_weight = {0: 1.0, 1: 1.2, 2: 0.8, 3: 1.0}
+    timer = EpochTimer()
+    if args.run == 'fit':
+        data = tf.data.Dataset.from_tensor_slices((x, y)).batch(args.batch_size)
+        hist = model.fit(data, epochs=2, class_weight=class_weight, callbacks=[timer], verbose=0)
+    else:
+        steps = int(args.run)
+        data = tf.data.Dataset.from_tensor_slices((x, y)).batch(args.batch_size // steps)
+        hist = fit_accumulated(model, data, epochs=2, accumulation_steps=steps,
+                               class_weight=class_weight, callbacks=[timer], verbose=0)
+    return {'run': args.run, 'throughput': images / timer.times[-1], 'memory': peak_memory(),
+            'loss': float(hist.history['loss'][-1])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare fit() with gradient-accumulated training.')
+    parser.add_argument('--script', default='vgg16', choices=AS_NET_SCRIPTS)
+    parser.add_argument('--batch-size', type=int, default=32, help='Effective batch size')
+    parser.add_argument('--accumulation-steps', type=int, nargs='+', default=[1, 2, 4],
+                        help='Micro-batches per update; each must divide the batch size')
+    parser.add_argument('--no-fit', action='store_true',
+                        help='Skip the fit() run, e.g. when the whole batch does not fit in memory')
+    parser.add_argument('--steps', type=int, default=3, help='Optimizer updates per epoch')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--fine-tune-at', type=int, default=12,
+                        help='First trainable encoder layer; the scripts fine-tune VGG16 from 12')
+    parser.add_argument('--jit-compile', action='store_true')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        # Child process: one engine, result as the last stdout line
+        print(json.dumps(run(args)))
+        return
+
+    runs = ([] if args.no_fit else ['fit']) + [str(steps) for steps in args.accumulation_steps]
+    results = []
+    for name in runs:
+        command = [sys.executable, os.path.abspath(__file__), '--run', name,
+                   '--script', args.script, '--batch-size', str(args.batch_size),
+                   '--steps', str(args.steps), '--image-size', str(args.image_size),
+                   '--fine-tune-at', str(args.fine_tune_at)]
+        if args.jit_compile:
+            command.append('--jit-compile')
+        process = subprocess.run(command, capture_output=True, text=True)
+        if process.returncode:
+            # Out of memory shows up here as a killed child
+            print(f'{name} failed (exit {process.returncode}):\n{process.stderr[-1000:]}')
+            continue
+        results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    print(f'{args.script}, effective batch {args.batch_size}, fine_tune_at={args.fine_tune_at}, '
+          f'jit_compile={args.jit_compile}')
+    base = results[0]['throughput'] if results else None
+    for result in results:
+        label = ('fit' if result['run'] == 'fit'
+                 else f'{result["run"]} x {args.batch_size // int(result["run"])} accumulated')
+        print(f'{label:<22} {result["throughput"]:8.1f} img/s ({result["throughput"] / base:4.2f}x)  '
+              f'peak {result["memory"] / 2**20:8.1f} MiB  loss {result["loss"]:.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# benchmarks/attention.py
+#
+# Two-trunk SAM + CAM against the FusedAttention block, where one conv trunk
+# feeds both attention branches. The blocks are the script's own (see
+# common/blocks.py) and are measured in the same head: FLOPs per forward
+# pass and training-step time on random features of the encoder output shape.
+#
+# With --data (a directory of one sub-directory per class) both heads are also
+# trained on stored features of the pretrained encoder's deepest tap, with the
+# same seed, split and epochs, and their validation accuracy is compared.
+#
+#   python benchmarks/attention.py --script vgg16 --batch-size 32 --steps 20
+#   python benchmarks/attention.py --script mobilenet_v3_large --data /data/Training --epochs 10
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from encoder import ENCODERS
+from xla import FEATURE_SHAPES, build_head, step_time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.blocks import load_blocks  # noqa: E402
+from common.evaluation import count_flops  # noqa: E402
+from common.feature_store import build_feature_store, flow_from_feature_store  # noqa: E402
+
+# Encoder in benchmarks/encoder.py each script builds its AS_Net on
+SCRIPT_ENCODERS = {
+    'vgg16': 'vgg16',
+    'efficientnet_v2': 'efficientnetv2b0',
+    'mobilenet_v3_large': 'mobilenetv3',
+}
+VARIANTS = (('two trunks', False), ('fused', True))
+
+
+def directory_split(data_dir, valid_every=5):
+    # Every valid_every-th file of each class (sorted) goes to validation
+    rows = [(os.path.join(data_dir, label, name), label)
+            for label in sorted(os.listdir(data_dir)) if os.path.isdir(os.path.join(data_dir, label))
+            for name in sorted(os.listdir(os.path.join(data_dir, label)))]
+    df = pd.DataFrame(rows, columns=['Class Path', 'Class'])
+    valid = df.groupby('Class').cumcount() % valid_every == 0
+    return df[~valid].reset_index(drop=True), df[valid].reset_index(drop=True)
+
+
+def head_accuracy(blocks, script, data_dir, image_size, epochs, batch_size):
+    build, layers = ENCODERS[SCRIPT_ENCODERS[script]]
+    encoder = build((image_size, image_size, 3), weights='imagenet')
+    encoder.trainable = False
+    tr_df, valid_df = directory_split(data_dir)
+    class_indices = {name: i for i, name in enumerate(sorted(tr_df['Class'].unique()))}
+    stores = [build_feature_store(encoder, df, split, SCRIPT_ENCODERS[script], layers[-1:],
+                                  class_indices=class_indices)
+              for df, split in ((tr_df, 'train'), (valid_df, 'valid'))]
+    feature_shape = tuple(encoder.output_shape[1:])
+    # One tap: unpack the one-element tuple of feature maps for the head
+    train, valid = (flow_from_feature_store(store, batch_size, shuffle=shuffle, seed=0)
+                    .map(lambda maps, labels: (maps[0], labels))
+                    for store, shuffle in zip(stores, (True, False)))
+
+    results = []
+    for _, fused in VARIANTS:
+        tf.keras.utils.set_random_seed(0)
+        model = build_head(blocks, feature_shape, len(class_indices), fused=fused)
+        model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+        history = model.fit(train, epochs=epochs, validation_data=valid, verbose=0)
+        results.append((max(history.history['val_accuracy']), history.history['val_accuracy'][-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two-trunk and fused SAM/CAM attention heads.')
+    parser.add_argument('--script', default='vgg16', choices=list(FEATURE_SHAPES))
+    parser.add_argument('--feature-shape', type=int, nargs=3)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--jit-compile', action='store_true')
+    parser.add_argument('--data', help='Image directory with one sub-directory per class')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--epochs', type=int, default=5)
+    args = parser.parse_args()
+
+    blocks = load_blocks(args.script)
+    feature_shape = tuple(args.feature_shape or FEATURE_SHAPES[args.script])
+    rng = np.random.default_rng(0)
+    x = rng.random((args.batch_size,) + feature_shape, dtype=np.float32)
+    y = np.eye(4, dtype=np.float32)[rng.integers(0, 4, args.batch_size)]
+
+    rows = []
+    for label, fused in VARIANTS:
+        flops = count_flops(build_head(blocks, feature_shape, fused=fused), args.batch_size)
+        rows.append((label, flops, step_time(blocks, feature_shape, args.jit_compile, x, y,
+                                             args.steps, fused=fused)))
+    print(f'{args.script} head, batch {args.batch_size}, features {feature_shape}')
+    base_flops, base_time = rows[0][1], rows[0][2]
+    for label, flops, elapsed in rows:
+        print(f'{label:<11} {flops / 1e9:8.2f} GFLOPs/step ({base_flops / flops:4.2f}x)  '
+              f'{elapsed * 1000:8.1f} ms/step ({base_time / elapsed:4.2f}x)')
+
+    if args.data:
+        accuracies = head_accuracy(blocks, args.script, args.data, args.image_size,
+                                   args.epochs, args.batch_size)
+        for (label, _), (best, last) in zip(VARIANTS, accuracies):
+            print(f'{label:<11} val accuracy best {best:.4f}  last {last:.4f}')
+
+
+if __name__ == '__main__':
+    main()
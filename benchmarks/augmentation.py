@@ -0,0 +1,76 @@
+# benchmarks/augmentation.py
+#
+# Images/sec of the per-image ImageDataGenerator augmentation used by the
+# scripts before, against BatchAugmentation applied to whole batches.
+#
+#   python benchmarks/augmentation.py --batch-size 32 --batches 20
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.augmentation import BatchAugmentation  # noqa: E402
+
+
+PARAMS = dict(
+    brightness_range=(0.9, 1.1),
+    rotation_range=15,
+    width_shift_range=0.1,
+    height_shift_range=0.1,
+    shear_range=0.1,
+    zoom_range=0.1,
+    horizontal_flip=True,
+    fill_mode='reflect'
+)
+
+
+def time_it(fn, batches):
+    fn()  # warm-up / tracing
+    start = time.perf_counter()
+    for _ in range(batches):
+        fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare augmentation throughput.')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    images = rng.integers(0, 256, (args.batch_size, args.image_size, args.image_size, 3)).astype(np.float32)
+
+    generator = ImageDataGenerator(**PARAMS)
+
+    def per_image():
+        return np.stack([generator.random_transform(image) for image in images])
+
+    augment = BatchAugmentation(seed=args.seed, **PARAMS)
+    images_tensor = tf.constant(images)
+    graph_augment = tf.function(lambda x: augment(x))
+
+    def batched():
+        return graph_augment(images_tensor).numpy()
+
+    n_images = args.batch_size * args.batches
+    results = [
+        ('ImageDataGenerator.random_transform', time_it(per_image, args.batches)),
+        ('BatchAugmentation (tf.function)', time_it(batched, args.batches)),
+    ]
+    baseline = results[0][1]
+    print(f'{args.batches} batches of {args.batch_size} at {args.image_size}x{args.image_size}')
+    for name, elapsed in results:
+        print(f'{name:<40} {n_images / elapsed:10.1f} img/s  {baseline / elapsed:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/decode.py
+#
+# Per-image decode + resize time of full-resolution JPEG decoding against
+# decoding at a reduced DCT scale, for both the PIL path (prepare_data, image
+# caches) and the tf.data path (file and record loaders).
+#
+#   python benchmarks/decode.py --data /path/to/dataset --images 200
+#   python benchmarks/decode.py --source-size 2048 --images 50
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.decode import decode_image, read_image  # noqa: E402
+
+
+def synthetic_jpegs(directory, count, size, seed):
+    # Smooth gradients plus noise compress like photographs, unlike pure noise
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size]
+    paths = []
+    for i in range(count):
+        base = (xx * rng.uniform(0.05, 0.2) + yy * rng.uniform(0.05, 0.2)) % 256
+        image = np.clip(base[..., None] + rng.normal(0, 8, (size, size, 3)), 0, 255).astype(np.uint8)
+        path = os.path.join(directory, f'{i:04d}.jpg')
+        Image.fromarray(image).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def time_per_image(fn, items):
+    fn(items[0])  # warm-up / tracing
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - start) / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare full and reduced-scale JPEG decoding.')
+    parser.add_argument('--data', help='Dataset directory; synthetic JPEGs are used if omitted')
+    parser.add_argument('--images', type=int, default=100)
+    parser.add_argument('--source-size', type=int, default=1024)
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    target = (args.image_size, args.image_size)
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.data:
+            paths = sorted(glob.glob(os.path.join(args.data, '*', '*.jp*g')))[:args.images]
+        else:
+            paths = synthetic_jpegs(tmp, args.images, args.source_size, args.seed)
+        encoded = [tf.constant(open(path, 'rb').read()) for path in paths]
+
+        full_tf = tf.function(lambda data: decode_image(data, target, 'bilinear', scaled_jpeg=False))
+        scaled_tf = tf.function(lambda data: decode_image(data, target, 'bilinear', scaled_jpeg=True))
+
+        results = [
+            ('PIL full decode', time_per_image(
+                lambda p: read_image(p, target, Image.BICUBIC, draft=False), paths)),
+            ('PIL draft()', time_per_image(
+                lambda p: read_image(p, target, Image.BICUBIC, draft=True), paths)),
+            ('tf.io.decode_image', time_per_image(lambda d: full_tf(d).numpy(), encoded)),
+            ('tf.io.decode_jpeg(ratio=)', time_per_image(lambda d: scaled_tf(d).numpy(), encoded)),
+        ]
+
+        # How far the reduced-scale result drifts from decoding at full size
+        drift = np.mean([np.abs(read_image(p, target, Image.BICUBIC, draft=True).astype(np.int16)
+                                - read_image(p, target, Image.BICUBIC, draft=False)).mean()
+                         for p in paths])
+
+    print(f'{len(paths)} images to {target[0]}x{target[1]}')
+    for name, per_image in results:
+        print(f'{name:<30} {per_image * 1000:8.2f} ms/img  {1 / per_image:8.1f} img/s')
+    print(f'Mean abs pixel difference, PIL draft vs full: {drift:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/encoder.py
+#
+# FLOPs and latency per step of AS_Net's encoder feature extraction: one
+# Model(ENCODER.inputs, layer) per tapped layer (the old graph) against a
+# single multi-output encoder. Both graphs consume every tap through global
+# pooling so nothing can be pruned away. Weights are random (weights=None);
+# they do not affect either number.
+#
+#   python benchmarks/encoder.py --batch-size 32 --steps 10
+#   python benchmarks/encoder.py --encoders vgg16
+
+import argparse
+import os
+import sys
+import time
+
+import tensorflow as tf
+from tensorflow.keras import Input
+from tensorflow.keras.layers import GlobalAveragePooling2D, concatenate
+from tensorflow.keras.models import Model
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.encoders import ENCODERS as ENCODER_REGISTRY, build_encoder, multi_output_encoder  # noqa: E402
+from common.evaluation import count_flops  # noqa: E402
+
+
+# Same taps as AS_Net in the scripts, as (constructor(shape, weights=None), taps)
+ENCODERS = {name: (lambda shape, weights=None, name=name: build_encoder(name, shape, weights),
+                   spec['layers'])
+            for name, spec in ENCODER_REGISTRY.items()}
+
+
+def per_tap_graph(encoder, layers, shape):
+    inputs = Input(shape)
+    taps = [encoder.get_layer(index=layer).output if isinstance(layer, int)
+            else encoder.get_layer(layer).output for layer in layers]
+    outputs = [Model(inputs=encoder.inputs, outputs=tap)(inputs) for tap in taps]
+    return Model(inputs, concatenate([GlobalAveragePooling2D()(x) for x in outputs]))
+
+
+def single_pass_graph(encoder, layers, shape):
+    inputs = Input(shape)
+    outputs = multi_output_encoder(encoder, layers)(inputs)
+    return Model(inputs, concatenate([GlobalAveragePooling2D()(x) for x in outputs]))
+
+
+def step_latency(model, images, steps):
+    forward = tf.function(lambda x: model(x, training=False))
+    forward(images)  # warm-up / tracing
+    start = time.perf_counter()
+    for _ in range(steps):
+        forward(images).numpy()
+    return (time.perf_counter() - start) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-tap and single-pass encoder graphs.')
+    parser.add_argument('--encoders', nargs='+', default=list(ENCODERS), choices=list(ENCODERS))
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--steps', type=int, default=5)
+    args = parser.parse_args()
+
+    shape = (args.image_size, args.image_size, 3)
+    images = tf.random.uniform((args.batch_size,) + shape)
+    print(f'Batch of {args.batch_size} at {args.image_size}x{args.image_size}')
+    for name in args.encoders:
+        build, layers = ENCODERS[name]
+        encoder = build(shape)
+        rows = []
+        for label, graph in (('per-tap models', per_tap_graph), ('single pass', single_pass_graph)):
+            model = graph(encoder, layers, shape)
+            rows.append((label, count_flops(model, args.batch_size),
+                         step_latency(model, images, args.steps)))
+        base_flops, base_latency = rows[0][1], rows[0][2]
+        for label, flops, latency in rows:
+            print(f'{name:<18} {label:<15} {flops / 1e9:9.2f} GFLOPs/step ({base_flops / flops:4.2f}x)  '
+                  f'{latency * 1000:9.1f} ms/step ({base_latency / latency:4.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# benchmarks/materialize.py
+#
+# Scaling of materialize_images with the number of decode processes. Each
+# run decodes the same paths into a shared in-memory buffer; speedup is
+# relative to the first worker count tried (1 by default).
+#
+#   python benchmarks/materialize.py --data /path/to/dataset --images 2000
+#   python benchmarks/materialize.py --images 400 --workers 1 2 4 8
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.materialize import default_workers, materialize_images  # noqa: E402
+
+
+def synthetic_jpegs(directory, count, size, seed):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        image = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+        path = os.path.join(directory, f'{i:05d}.jpg')
+        Image.fromarray(image).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure decode-pool scaling.')
+    parser.add_argument('--data', help='Dataset directory; synthetic JPEGs are used if omitted')
+    parser.add_argument('--images', type=int, default=400)
+    parser.add_argument('--source-size', type=int, default=512)
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        help='Worker counts to try, defaults to powers of two up to the core count')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    cores = default_workers()
+    counts = args.workers or sorted({min(2 ** k, cores) for k in range(cores.bit_length() + 1)})
+    target = (args.image_size, args.image_size)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.data:
+            paths = sorted(glob.glob(os.path.join(args.data, '*', '*')))[:args.images]
+        else:
+            paths = synthetic_jpegs(tmp, args.images, args.source_size, args.seed)
+
+        print(f'{len(paths)} images to {target[0]}x{target[1]}, {cores} cores available')
+        baseline = None
+        for workers in counts:
+            start = time.perf_counter()
+            materialize_images(paths, target, resample=Image.BICUBIC, workers=workers, verbose=False)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            speedup = baseline / elapsed
+            print(f'{workers:>3} workers {len(paths) / elapsed:10.1f} img/s  {speedup:6.2f}x  '
+                  f'({speedup / workers:.0%} of linear)')
+
+
+if __name__ == '__main__':
+    main()
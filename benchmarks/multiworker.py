@@ -0,0 +1,149 @@
+# benchmarks/multiworker.py
+#
+# Scaling efficiency of multi-worker CPU data parallelism (common/distributed.py)
+# on one machine: a script's AS_Net is trained by 1, 2, 4, ... local worker
+# processes, each with an equal share of the cores, its own manifest shard of
+# the training split and a fixed per-worker batch (so the global batch grows
+# with the workers, as it would on more machines). Prints training images per
+# second, the speed-up over the first run and the scaling efficiency, i.e.
+# speed-up / relative worker count, with the validation accuracy reached.
+# Times are of the training steps of every epoch after the first (which
+# traces), without validation.
+#
+#   python benchmarks/multiworker.py --script mobilenet_v3_large --workers 1 2 4
+#   python benchmarks/multiworker.py --script vgg16 --workers 1 2 --fine-tune-at 12 --epochs 3
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.blocks import AS_NET_SCRIPTS, as_net  # noqa: E402
+from common.distributed import cluster_strategy, join, launch_local, shard_split  # noqa: E402
+
+
+def run_worker(args):
+    # Worker process: the strategy must exist before any other TensorFlow op
+    strategy = cluster_strategy()
+    import tensorflow as tf
+    from common.data_pipeline import flow_from_split
+    from common.evaluation import split_dataset
+    from common.training import fit_accumulated
+
+    class StepTimer(tf.keras.callbacks.Callback):
+        """Seconds from the start of every epoch to its last update."""
+
+        def on_train_begin(self, logs=None):
+            self.times = []
+
+        def on_epoch_begin(self, epoch, logs=None):
+            self.start = self.last = time.perf_counter()
+
+        def on_train_batch_end(self, batch, logs=None):
+            self.last = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            self.times.append(self.last - self.start)
+
+    tf.keras.utils.set_random_seed(0)
+    build = as_net(args.script)
+    tr_df, valid_df, _ = split_dataset(args.data_dir)
+    target_size = (args.image_size, args.image_size)
+    train_df, train_split = shard_split(tr_df, 'train', strategy)
+    train = flow_from_split(train_df, train_split, source=args.source, target_size=target_size,
+                            shuffle=True, seed=0, batch_size=args.batch_size)
+    valid = flow_from_split(*shard_split(valid_df, 'valid', strategy, even=False),
+                            source='memory', target_size=target_size, shuffle=False,
+                            batch_size=args.batch_size, class_indices=train.class_indices)
+    with strategy.scope():
+        model = build(input_size=target_size + (3,), fine_tune_at=args.fine_tune_at,
+                      weights=None if args.weights == 'none' else args.weights)
+        model.compile(optimizer=tf.keras.optimizers.Adam(args.learning_rate),
+                      loss='categorical_crossentropy', metrics=['accuracy'])
+    timer = StepTimer()
+    hist = fit_accumulated(model, train, epochs=args.epochs, validation_data=valid,
+                           callbacks=[timer], verbose=0)
+    workers = strategy.num_replicas_in_sync
+    return {'workers': workers, 'images': len(train_df) * workers,
+            'epoch': float(np.mean(timer.times[1:] or timer.times)),
+            'val_accuracy': float(hist.history['val_accuracy'][-1])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure multi-worker CPU training scaling on one machine.')
+    parser.add_argument('--script', default='mobilenet_v3_large', choices=AS_NET_SCRIPTS)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--data-dir', default='/brain-tumor-mri-dataset',
+                        help='Dataset root with Training/ and Testing/')
+    parser.add_argument('--source', default='cache', choices=['records', 'cache', 'files'],
+                        help='Storage the training shards are read from')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=32, help='Batch per worker')
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--fine-tune-at', type=int,
+                        help='First trainable encoder layer; None keeps the encoder frozen')
+    parser.add_argument('--weights', default='imagenet', choices=['imagenet', 'none'],
+                        help="Encoder weights; 'none' skips the download, for smoke tests")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_worker(args)
+        # Every worker reports the same; the chief's line is the one read
+        print(json.dumps(result))
+        return
+
+    cores = os.cpu_count() or 1
+    results = []
+    for workers in args.workers:
+        threads = max(1, cores // workers)
+        command = [sys.executable, os.path.abspath(__file__), '--worker', '--script', args.script,
+                   '--data-dir', args.data_dir, '--source', args.source,
+                   '--image-size', str(args.image_size), '--epochs', str(args.epochs),
+                   '--batch-size', str(args.batch_size), '--learning-rate', str(args.learning_rate),
+                   '--weights', args.weights]
+        if args.fine_tune_at is not None:
+            command += ['--fine-tune-at', str(args.fine_tune_at)]
+        processes = launch_local(command, workers, threads, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT, text=True)
+        # Drained while the workers run, so that none blocks on a full pipe
+        output = [[] for _ in processes]
+        readers = [threading.Thread(target=lambda process, lines: lines.extend(process.stdout),
+                                    args=(process, lines))
+                   for process, lines in zip(processes, output)]
+        for reader in readers:
+            reader.start()
+        codes = join(processes)
+        for reader in readers:
+            reader.join()
+        output = [''.join(lines) for lines in output]
+        print(f'{workers} workers x {threads} threads: exit codes {codes}')
+        if any(codes):
+            failed = next(index for index, code in enumerate(codes) if code)
+            print(output[failed][-2000:])
+            continue
+        result = json.loads(output[0].strip().splitlines()[-1])
+        result['threads'] = threads
+        results.append(result)
+
+    print(f'{args.script}, {args.image_size}px, batch {args.batch_size} per worker, '
+          f'fine_tune_at={args.fine_tune_at}, {cores} cores')
+    print(f'{"workers":>8}{"threads":>9}{"img/s":>9}{"speed-up":>10}{"efficiency":>12}{"val acc":>9}')
+    base = results[0] if results else None
+    for result in results:
+        throughput = result['images'] / result['epoch']
+        speedup = throughput / (base['images'] / base['epoch'])
+        efficiency = speedup / (result['workers'] / base['workers'])
+        print(f'{result["workers"]:>8}{result["threads"]:>9}{throughput:9.1f}{speedup:9.2f}x'
+              f'{efficiency:11.0%}{result["val_accuracy"]:9.4f}')
+
+
+if __name__ == '__main__':
+    main()
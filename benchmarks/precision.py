@@ -0,0 +1,122 @@
+# benchmarks/precision.py
+#
+# Training-step time and peak memory of each Keras precision policy
+# (common/precision.py). The model is the script's encoder with the
+# attention head from benchmarks/xla.py on its deepest tap, or the Xception
+# baseline of base/. Weights are random (weights=None). Each policy runs in a
+# fresh process, because the policy is global and peak memory can only be
+# read once per process: device peak on a GPU, peak RSS on the CPU.
+#
+#   python benchmarks/precision.py --script vgg16 --batch-size 16 --steps 5
+#   python benchmarks/precision.py --script base --policies float32 mixed_bfloat16
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Dense, Dropout, Flatten
+from tensorflow.keras.models import Model, Sequential
+
+from attention import SCRIPT_ENCODERS
+from encoder import ENCODERS
+from xla import build_head
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.blocks import load_blocks  # noqa: E402
+from common.precision import PRECISIONS, set_precision  # noqa: E402
+
+IMAGE_SIZES = {'vgg16': 224, 'efficientnet_v2': 224, 'mobilenet_v3_large': 224, 'base': 299}
+
+
+def build_model(script, image_size):
+    shape = (image_size, image_size, 3)
+    if script == 'base':
+        # Same layers as the Xception baseline in base/main.py
+        return Sequential([
+            tf.keras.applications.Xception(include_top=False, weights=None, input_shape=shape,
+                                           pooling='max'),
+            Flatten(),
+            Dropout(rate=0.3),
+            Dense(128, activation='relu'),
+            Dropout(rate=0.25),
+            Dense(4, activation='softmax', dtype='float32')
+        ])
+    build, _ = ENCODERS[SCRIPT_ENCODERS[script]]
+    encoder = build(shape)
+    head = build_head(load_blocks(script), tuple(encoder.output_shape[1:]))
+    inputs = tf.keras.Input(shape)
+    return Model(inputs, head(encoder(inputs)))
+
+
+def peak_memory():
+    if tf.config.list_physical_devices('GPU'):
+        return tf.config.experimental.get_memory_info('GPU:0')['peak']
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_policy(args):
+    set_precision(args.policy)
+    tf.keras.utils.set_random_seed(0)
+    image_size = args.image_size or IMAGE_SIZES[args.script]
+    model = build_model(args.script, image_size)
+    # Keras adds loss scaling itself for a mixed_float16 model
+    model.compile(optimizer='adam', loss='categorical_crossentropy', jit_compile=args.jit_compile)
+    rng = np.random.default_rng(0)
+    x = rng.random((args.batch_size, image_size, image_size, 3), dtype=np.float32)
+    y = np.eye(4, dtype=np.float32)[rng.integers(0, 4, args.batch_size)]
+    model.train_on_batch(x, y)  # warm-up / tracing
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        loss = model.train_on_batch(x, y)
+    elapsed = (time.perf_counter() - start) / args.steps
+    return {'policy': args.policy, 'step': elapsed, 'memory': peak_memory(),
+            'loss': float(np.ravel(loss)[0])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare training steps under each precision policy.')
+    parser.add_argument('--script', default='vgg16', choices=list(IMAGE_SIZES))
+    parser.add_argument('--policies', nargs='+', choices=PRECISIONS,
+                        help='Defaults to all, without mixed_float16 when there is no GPU')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--image-size', type=int)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--jit-compile', action='store_true')
+    parser.add_argument('--policy', choices=PRECISIONS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.policy:
+        # Child process: one policy, result as the last stdout line
+        print(json.dumps(run_policy(args)))
+        return
+
+    # CPUs emulate float16 math; a mixed_float16 step takes many times longer
+    policies = args.policies or [policy for policy in PRECISIONS if policy != 'mixed_float16'
+                                 or tf.config.list_physical_devices('GPU')]
+    results = []
+    for policy in policies:
+        command = [sys.executable, os.path.abspath(__file__), '--policy', policy,
+                   '--script', args.script, '--batch-size', str(args.batch_size),
+                   '--steps', str(args.steps)]
+        if args.image_size:
+            command += ['--image-size', str(args.image_size)]
+        if args.jit_compile:
+            command.append('--jit-compile')
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f'{args.script}, batch {args.batch_size}, jit_compile={args.jit_compile}')
+    base_step = results[0]['step']
+    for result in results:
+        print(f'{result["policy"]:<15} {result["step"] * 1000:8.1f} ms/step ({base_step / result["step"]:4.2f}x)  '
+              f'peak {result["memory"] / 2**20:8.1f} MiB  loss {result["loss"]:.4f}')
+
+
+if __name__ == '__main__':
+    main()
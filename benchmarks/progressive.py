@@ -0,0 +1,116 @@
+# benchmarks/progressive.py
+#
+# Convergence against wall-clock time of a script's AS_Net trained at its
+# fixed image size and with progressive resizing (common/progressive.py),
+# on the same loaders, epochs and seed. Prints total training time, best and
+# final validation accuracy, and when each run first reached the best
+# accuracy of the fixed-size run; --plot saves the validation accuracy and
+# loss curves against time.
+#
+#   python benchmarks/progressive.py --script vgg16 --epochs 9 --plot progressive.png
+#   python benchmarks/progressive.py --script mobilenet_v3_large --start-size 96 --stages 4
+
+import argparse
+import os
+import sys
+
+import tensorflow as tf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.blocks import AS_NET_SCRIPTS, as_net  # noqa: E402
+from common.data_pipeline import flow_from_split  # noqa: E402
+from common.evaluation import split_dataset  # noqa: E402
+from common.progressive import fit_progressive, resize_schedule  # noqa: E402
+
+
+def time_to_reach(history, accuracy):
+    reached = [t for t, acc in zip(history['time'], history['val_accuracy']) if acc >= accuracy]
+    return reached[0] if reached else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare fixed-size and progressive-resizing training.')
+    parser.add_argument('--script', default='vgg16', choices=AS_NET_SCRIPTS)
+    parser.add_argument('--data-dir', default='/brain-tumor-mri-dataset',
+                        help='Dataset root with Training/ and Testing/')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--start-size', type=int, default=128)
+    parser.add_argument('--stages', type=int, default=3)
+    parser.add_argument('--epochs', type=int, default=9)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--fine-tune-at', type=int,
+                        help='First trainable encoder layer; None keeps the encoder frozen')
+    parser.add_argument('--jit-compile', action='store_true')
+    parser.add_argument('--weights', default='imagenet', choices=['imagenet', 'none'],
+                        help="Encoder weights; 'none' skips the download, for smoke tests")
+    parser.add_argument('--plot', help='Save the convergence plot to this image file')
+    args = parser.parse_args()
+
+    build = as_net(args.script)
+    tr_df, valid_df, _ = split_dataset(args.data_dir)
+    target_size = (args.image_size, args.image_size)
+    train = flow_from_split(tr_df, 'train', source='cache', target_size=target_size,
+                            shuffle=True, seed=0, batch_size=args.batch_size)
+    valid = flow_from_split(valid_df, 'valid', source='memory', target_size=target_size,
+                            shuffle=False, batch_size=args.batch_size,
+                            class_indices=train.class_indices)
+
+    def build(size):
+        model = build(input_size=(size, size, 3), fine_tune_at=args.fine_tune_at,
+                      jit_compile=args.jit_compile,
+                      weights=None if args.weights == 'none' else args.weights)
+        model.compile(optimizer=tf.keras.optimizers.Adam(args.learning_rate),
+                      loss='categorical_crossentropy', metrics=['accuracy'],
+                      jit_compile=model.jit_compile)
+        return model
+
+    schedules = {
+        'fixed': [(args.image_size, args.epochs)],
+        'progressive': resize_schedule(args.image_size, args.epochs, args.start_size, args.stages),
+    }
+    histories = {}
+    for name, schedule in schedules.items():
+        tf.keras.utils.set_random_seed(0)
+        _, hist = fit_progressive(build, schedule, train, validation_data=valid, verbose=2)
+        histories[name] = hist.history
+
+    target = max(histories['fixed']['val_accuracy'])
+    print(f'{args.script}, {args.epochs} epochs of batch {args.batch_size}, '
+          f'fine_tune_at={args.fine_tune_at}; "reached" = first time at the fixed run\'s '
+          f'best val accuracy {target:.4f}')
+    fixed_time = histories['fixed']['time'][-1]
+    for name, history in histories.items():
+        reached = time_to_reach(history, target)
+        schedule = ' -> '.join(f'{size}x{epochs}' for size, epochs in schedules[name])
+        print(f'{name:<12} {history["time"][-1]:8.1f}s ({fixed_time / history["time"][-1]:4.2f}x)  '
+              f'best {max(history["val_accuracy"]):.4f}  final {history["val_accuracy"][-1]:.4f}  '
+              f'reached {"never" if reached is None else f"{reached:.1f}s":>8}  {schedule}')
+
+    if args.plot:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+        fig, axes = plt.subplots(1, 2, figsize=(14, 5))
+        for name, history in histories.items():
+            for ax, key in zip(axes, ('val_accuracy', 'val_loss')):
+                ax.plot(history['time'], history[key], marker='o', label=name)
+        for name, history in histories.items():
+            # Mark where the progressive run stepped up in size
+            sizes = history['image_size']
+            for t, previous, size in zip(history['time'], sizes, sizes[1:]):
+                if size != previous:
+                    for ax in axes:
+                        ax.axvline(t, color='grey', linestyle=':', linewidth=1)
+        for ax, key in zip(axes, ('Validation accuracy', 'Validation loss')):
+            ax.set_xlabel('Wall-clock time (s)')
+            ax.set_title(key)
+            ax.legend()
+        fig.tight_layout()
+        fig.savefig(args.plot)
+        print(f'Saved {args.plot}')
+
+
+if __name__ == '__main__':
+    main()
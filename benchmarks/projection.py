@@ -0,0 +1,95 @@
+# benchmarks/projection.py
+#
+# Parameters, FLOPs and training-step time of the AS_Net feature-pyramid
+# merge in efficientnet_v2/ and mobilenet_v3_large/: raw bilinear-resized
+# taps concatenated as they are, against anti-aliased pooling plus a learned
+# 1x1 projection of every tap to a fixed width (AS_Net(projection_width=...)).
+# The merge helpers and blocks are the scripts' own (common/asnet.py); the
+# encoder is frozen and has random weights (weights=None), as neither affects
+# the numbers.
+#
+#   python benchmarks/projection.py --batch-size 16 --steps 5
+#   python benchmarks/projection.py --scripts mobilenet_v3_large --widths 64 128 256
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import Input
+from tensorflow.keras.layers import concatenate
+from tensorflow.keras.models import Model
+
+from attention import SCRIPT_ENCODERS
+from encoder import ENCODERS
+from xla import build_head
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.blocks import load_blocks  # noqa: E402
+from common.encoders import multi_output_encoder  # noqa: E402
+from common.evaluation import count_flops  # noqa: E402
+
+SCRIPTS = ('efficientnet_v2', 'mobilenet_v3_large')
+
+
+def build_model(blocks, encoder, layers, shape, projection_width=None):
+    # Same merge as AS_Net in the scripts, on the head of benchmarks/xla.py
+    inputs = Input(shape)
+    outputs = multi_output_encoder(encoder, layers)(inputs)
+    adjust = blocks.pool_feature_map if projection_width else blocks.adjust_feature_map
+    taps = [adjust(x, outputs[-1].shape) for x in outputs]
+    if projection_width:
+        taps = [blocks.project_feature_map(x, projection_width) for x in taps]
+    merged = concatenate(taps[::-1], axis=-1)
+    head = build_head(blocks, tuple(merged.shape[1:]))
+    return Model(inputs, head(merged))
+
+
+def step_time(model, x, y, steps):
+    model.compile(optimizer='adam', loss='categorical_crossentropy')
+    model.train_on_batch(x, y)  # warm-up / tracing
+    start = time.perf_counter()
+    for _ in range(steps):
+        model.train_on_batch(x, y)
+    return (time.perf_counter() - start) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare raw and projected feature-pyramid merges.')
+    parser.add_argument('--scripts', nargs='+', default=list(SCRIPTS), choices=SCRIPTS)
+    parser.add_argument('--widths', type=int, nargs='+', default=[128])
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--steps', type=int, default=5)
+    args = parser.parse_args()
+
+    shape = (args.image_size, args.image_size, 3)
+    rng = np.random.default_rng(0)
+    x = rng.random((args.batch_size,) + shape, dtype=np.float32)
+    y = np.eye(4, dtype=np.float32)[rng.integers(0, 4, args.batch_size)]
+    print(f'Batch of {args.batch_size} at {args.image_size}x{args.image_size}, encoder frozen')
+    for script in args.scripts:
+        blocks = load_blocks(script)
+        build, layers = ENCODERS[SCRIPT_ENCODERS[script]]
+        encoder = build(shape)
+        encoder.trainable = False
+        rows = []
+        for width in [None] + args.widths:
+            tf.keras.utils.set_random_seed(0)
+            model = build_model(blocks, encoder, layers, shape, width)
+            params = sum(int(np.prod(w.shape)) for w in model.trainable_weights)
+            merged_width = model.layers[-1].input_shape[-1]
+            rows.append((f'projected {width}' if width else 'raw concat', merged_width, params,
+                         count_flops(model, args.batch_size), step_time(model, x, y, args.steps)))
+        base_params, base_flops, base_time = rows[0][2:]
+        for label, merged_width, params, flops, elapsed in rows:
+            print(f'{script:<19} {label:<14} merged {merged_width:5d} ch  '
+                  f'{params / 1e6:6.2f}M params ({base_params / params:5.2f}x)  '
+                  f'{flops / 1e9:7.2f} GFLOPs/step ({base_flops / flops:4.2f}x)  '
+                  f'{elapsed * 1000:8.1f} ms/step ({base_time / elapsed:4.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
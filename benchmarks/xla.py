@@ -0,0 +1,84 @@
+# benchmarks/xla.py
+#
+# Training-step time of the AS_Net attention head with XLA off and on. The
+# SAM/CAM/SynergyModule classes are the script's own (its block module, see
+# common/blocks.py), so the benchmark always measures the blocks the script
+# trains. The head runs on a random feature map shaped like the encoder
+# output it sees in training.
+#
+#   python benchmarks/xla.py --script vgg16 --batch-size 32 --steps 20
+#   python benchmarks/xla.py --script efficientnet_v2 --feature-shape 7 7 2000
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.blocks import load_blocks  # noqa: E402
+
+# Encoder output AS_Net feeds to its attention blocks at 224x224
+FEATURE_SHAPES = {
+    'vgg16': (7, 7, 512),
+    'efficientnet_v2': (7, 7, 1280),
+    'mobilenet_v3_large': (7, 7, 960),
+}
+
+
+def build_head(blocks, feature_shape, num_classes=4, fused=False):
+    layers = tf.keras.layers
+    inputs = tf.keras.Input(feature_shape)
+    filters = feature_shape[-1]
+    if fused:
+        sam, cam = blocks.FusedAttention(filters=filters)(inputs)
+    else:
+        sam = blocks.SAM(filters=filters)(inputs)
+        cam = blocks.CAM(filters=filters)(inputs)
+    if hasattr(blocks, 'SynergyModule'):
+        merged = blocks.SynergyModule(filters=filters)([sam, cam])
+    else:
+        merged = layers.concatenate([sam, cam])
+    x = layers.Conv2D(128, 3, activation='relu', padding='same')(merged)
+    x = layers.BatchNormalization()(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dense(256, activation='relu')(x)
+    outputs = layers.Dense(num_classes, activation='softmax', dtype='float32')(x)
+    return tf.keras.Model(inputs, outputs)
+
+
+def step_time(blocks, feature_shape, jit_compile, x, y, steps, fused=False):
+    tf.keras.utils.set_random_seed(0)
+    model = build_head(blocks, feature_shape, fused=fused)
+    model.compile(optimizer='adam', loss='categorical_crossentropy', jit_compile=jit_compile)
+    model.train_on_batch(x, y)  # warm-up / tracing and compilation
+    start = time.perf_counter()
+    for _ in range(steps):
+        model.train_on_batch(x, y)
+    return (time.perf_counter() - start) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare attention-head training steps with and without XLA.')
+    parser.add_argument('--script', default='vgg16', choices=list(FEATURE_SHAPES))
+    parser.add_argument('--feature-shape', type=int, nargs=3)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--steps', type=int, default=20)
+    args = parser.parse_args()
+
+    blocks = load_blocks(args.script)
+    feature_shape = tuple(args.feature_shape or FEATURE_SHAPES[args.script])
+    rng = np.random.default_rng(0)
+    x = rng.random((args.batch_size,) + feature_shape, dtype=np.float32)
+    y = np.eye(4, dtype=np.float32)[rng.integers(0, 4, args.batch_size)]
+
+    results = [(jit, step_time(blocks, feature_shape, jit, x, y, args.steps)) for jit in (False, True)]
+    print(f'{args.script} head, batch {args.batch_size}, features {feature_shape}')
+    for jit, elapsed in results:
+        print(f'jit_compile={str(jit):<6} {elapsed * 1000:8.1f} ms/step  {results[0][1] / elapsed:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
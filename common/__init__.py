@@ -0,0 +1,2 @@
+# Shared building blocks for the AS_Net encoder scripts (vgg16/, efficientnet_v2/,
+# mobilenet_v3_large/) and the Xception baseline (base/).
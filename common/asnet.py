@@ -0,0 +1,367 @@
+# common/asnet.py
+#
+# The AS_Net blocks of efficientnet_v2 and mobilenet_v3_large, which differ
+# only in their encoder: SAM and CAM attention (or FusedAttention, both on one
+# shared conv trunk), resizing or anti-aliased pooling of the tapped encoder
+# maps, optional 1x1 projections, and AS_Net itself, built as a 'features'
+# and a 'head' model. The attention blocks are Layers with their sublayers
+# created once in __init__, weights in build() and static shapes throughout,
+# so the graph can be XLA-compiled and a saved model reloads without
+# custom_objects once this module is imported. vgg16's blocks differ and are
+# registered under their own package name in common/asnet_vgg16.py, so both
+# can be loaded in one process (e.g. a teacher and its student).
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import Input
+from tensorflow.keras.layers import (
+    AveragePooling2D, BatchNormalization, Conv2D, Dense, Dropout, GlobalAveragePooling2D,
+    GlobalMaxPooling2D, Layer, concatenate
+)
+from tensorflow.keras.models import Model, Sequential
+
+from common.encoders import ENCODERS, build_encoder, multi_output_encoder
+from common.layers import factorizable_conv
+
+# Package the layers are registered under, i.e. 'AS_Net>SAM', ...
+PACKAGE = 'AS_Net'
+
+
+@tf.keras.utils.register_keras_serializable(package=PACKAGE)
+class SAM(Layer):
+    def __init__(self, filters, trunk=True, widths=None, factorization=None, rank=None,
+                 **kwargs):
+        super(SAM, self).__init__(**kwargs)
+        self.filters = filters
+        # Output channels of the first two trunk convs (filters // 4 each by
+        # default); conv3/conv4 keep filters // 4 for the attention and the
+        # residual. tools/prune.py saves narrower ones
+        self.widths = tuple(widths) if widths else (filters // 4, filters // 4)
+        # trunk=False leaves out the conv trunk; FusedAttention feeds attend()
+        # from a trunk it shares with CAM
+        self.has_trunk = trunk
+        # Full or factorized ('spatial'/'depthwise', see common/layers.py)
+        # 3x3 trunk convs
+        self.factorization = factorization
+        self.rank = rank
+        if trunk:
+            self.conv1 = factorizable_conv(self.widths[0], 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            self.conv2 = factorizable_conv(self.widths[1], 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            self.conv3 = factorizable_conv(self.filters // 4, 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            self.conv4 = Conv2D(self.filters // 4, 1,
+                                activation='relu', kernel_initializer='he_normal')
+        # keepdims gives (1, 1, C) for broadcasting without a Reshape
+        self.avg_pool = GlobalAveragePooling2D(keepdims=True)
+        self.max_pool = GlobalMaxPooling2D(keepdims=True)
+        self.W1 = Conv2D(self.filters // 4, 1,
+                         activation='sigmoid', kernel_initializer='he_normal')
+        self.W2 = Conv2D(self.filters // 4, 1,
+                         activation='sigmoid', kernel_initializer='he_normal')
+
+    def build(self, input_shape):
+        pooled_shape = (input_shape[0], 1, 1, self.filters // 4)
+        if self.has_trunk:
+            self.conv1.build(input_shape)
+            self.conv2.build(tuple(input_shape[:-1]) + (self.widths[0],))
+            self.conv3.build(tuple(input_shape[:-1]) + (self.widths[1],))
+            self.conv4.build(input_shape)
+        self.W1.build(pooled_shape)
+        self.W2.build(pooled_shape)
+        super(SAM, self).build(input_shape)
+
+    def trunk(self, inputs):
+        out1 = self.conv3(self.conv2(self.conv1(inputs)))
+        out2 = self.conv4(inputs)
+        return out1, out2
+
+    def attend(self, out1, out2):
+        merge1 = self.W1(self.avg_pool(out2))
+        merge2 = self.W2(self.max_pool(out2))
+
+        out3 = merge1 + merge2
+        y = out1 * out3 + out2
+        return y
+
+    def call(self, inputs):
+        return self.attend(*self.trunk(inputs))
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape[:-1]) + (self.filters // 4,)
+
+    def get_config(self):
+        config = super(SAM, self).get_config()
+        config.update({'filters': self.filters, 'trunk': self.has_trunk,
+                       'widths': list(self.widths), 'factorization': self.factorization,
+                       'rank': self.rank})
+        return config
+
+
+@tf.keras.utils.register_keras_serializable(package=PACKAGE)
+class CAM(Layer):
+    def __init__(self, filters, reduction_ratio=16, trunk=True, widths=None,
+                 factorization=None, rank=None, **kwargs):
+        super(CAM, self).__init__(**kwargs)
+        self.filters = filters
+        # See SAM
+        self.widths = tuple(widths) if widths else (filters // 4, filters // 4)
+        self.reduction_ratio = reduction_ratio
+        # trunk=False: see SAM
+        self.has_trunk = trunk
+        self.factorization = factorization
+        self.rank = rank
+        if trunk:
+            self.conv1 = factorizable_conv(self.widths[0], 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            self.conv2 = factorizable_conv(self.widths[1], 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            self.conv3 = factorizable_conv(self.filters // 4, 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            self.conv4 = Conv2D(self.filters // 4, 1,
+                                activation='relu', kernel_initializer='he_normal')
+        self.gpool = GlobalAveragePooling2D(keepdims=True)
+        self.fc1 = Dense(self.filters // (4 * reduction_ratio),
+                         activation='relu', use_bias=False)
+        self.fc2 = Dense(self.filters // 4,
+                         activation='sigmoid', use_bias=False)
+
+    def build(self, input_shape):
+        if self.has_trunk:
+            self.conv1.build(input_shape)
+            self.conv2.build(tuple(input_shape[:-1]) + (self.widths[0],))
+            self.conv3.build(tuple(input_shape[:-1]) + (self.widths[1],))
+            self.conv4.build(input_shape)
+        self.fc1.build((input_shape[0], 1, 1, self.filters // 4))
+        self.fc2.build((input_shape[0], 1, 1, self.filters // (4 * self.reduction_ratio)))
+        super(CAM, self).build(input_shape)
+
+    def trunk(self, inputs):
+        out1 = self.conv3(self.conv2(self.conv1(inputs)))
+        out2 = self.conv4(inputs)
+        return out1, out2
+
+    def attend(self, out1, out2):
+        out3 = self.fc2(self.fc1(self.gpool(out2)))
+        y = out1 * out3 + out2
+        return y
+
+    def call(self, inputs):
+        return self.attend(*self.trunk(inputs))
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape[:-1]) + (self.filters // 4,)
+
+    def get_config(self):
+        config = super(CAM, self).get_config()
+        config.update({'filters': self.filters, 'reduction_ratio': self.reduction_ratio,
+                       'trunk': self.has_trunk, 'widths': list(self.widths),
+                       'factorization': self.factorization, 'rank': self.rank})
+        return config
+
+
+@tf.keras.utils.register_keras_serializable(package=PACKAGE)
+class FusedAttention(Layer):
+    """SAM and CAM on one shared conv trunk; returns [spatial, channel] outputs."""
+
+    def __init__(self, filters, reduction_ratio=16, widths=None, factorization=None,
+                 rank=None, **kwargs):
+        super(FusedAttention, self).__init__(**kwargs)
+        self.filters = filters
+        self.reduction_ratio = reduction_ratio
+        # The trunk (three 3x3 convs + 1x1 reduction) is the bulk of the
+        # head's FLOPs; it lives in the SAM and is reused for the CAM branch
+        self.sam = SAM(filters, widths=widths, factorization=factorization, rank=rank)
+        self.widths = self.sam.widths
+        self.factorization = factorization
+        self.rank = rank
+        self.cam = CAM(filters, reduction_ratio, trunk=False)
+
+    def build(self, input_shape):
+        self.sam.build(input_shape)
+        self.cam.build(input_shape)
+        super(FusedAttention, self).build(input_shape)
+
+    def call(self, inputs):
+        out1, out2 = self.sam.trunk(inputs)
+        return [self.sam.attend(out1, out2), self.cam.attend(out1, out2)]
+
+    def compute_output_shape(self, input_shape):
+        shape = tuple(input_shape[:-1]) + (self.filters // 4,)
+        return [shape, shape]
+
+    def get_config(self):
+        config = super(FusedAttention, self).get_config()
+        config.update({'filters': self.filters, 'reduction_ratio': self.reduction_ratio,
+                       'widths': list(self.widths), 'factorization': self.factorization,
+                       'rank': self.rank})
+        return config
+
+
+@tf.keras.utils.register_keras_serializable(package=PACKAGE)
+class ResizeLayer(Layer):
+    def __init__(self, target_height, target_width, **kwargs):
+        super(ResizeLayer, self).__init__(**kwargs)
+        self.target_height = target_height
+        self.target_width = target_width
+
+    def call(self, inputs):
+        # Resize in float32 (what tf.image.resize computes and returns
+        # anyway; XLA rejects its gradient on bfloat16 inputs) and cast back
+        # to the compute dtype of a mixed-precision policy
+        resized = tf.image.resize(tf.cast(inputs, 'float32'), (self.target_height, self.target_width))
+        return tf.cast(resized, self.compute_dtype)
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0], self.target_height, self.target_width, input_shape[-1])
+
+    def get_config(self):
+        config = super(ResizeLayer, self).get_config()
+        config.update({'target_height': self.target_height, 'target_width': self.target_width})
+        return config
+
+
+def adjust_feature_map(x, target_shape):
+    _, h, w, _ = target_shape
+    current_h, current_w = x.shape[1:3]
+    if current_h != h or current_w != w:
+        resize_layer = ResizeLayer(h, w)
+        return resize_layer(x)
+    return x
+
+
+@tf.keras.utils.register_keras_serializable(package=PACKAGE)
+class AntiAliasedPool(Layer):
+    """Blur with a fixed 3x3 binomial filter, then average-pool by `factor`."""
+
+    def __init__(self, factor, **kwargs):
+        super(AntiAliasedPool, self).__init__(**kwargs)
+        self.factor = factor
+        self.pool = AveragePooling2D(factor)
+
+    def build(self, input_shape):
+        binomial = np.array([1., 2., 1.])
+        kernel = np.outer(binomial, binomial) / 16
+        # Depthwise kernel: the same filter for every channel
+        self.kernel = np.tile(kernel[:, :, None, None], (1, 1, input_shape[-1], 1)).astype('float32')
+        self.pool.build(input_shape)
+        super(AntiAliasedPool, self).build(input_shape)
+
+    def call(self, inputs):
+        # Reflect padding so the borders are not blurred towards zero
+        padded = tf.pad(inputs, [[0, 0], [1, 1], [1, 1], [0, 0]], mode='REFLECT')
+        blurred = tf.nn.depthwise_conv2d(padded, tf.cast(self.kernel, inputs.dtype),
+                                         strides=[1, 1, 1, 1], padding='VALID')
+        return self.pool(blurred)
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0], input_shape[1] // self.factor, input_shape[2] // self.factor,
+                input_shape[-1])
+
+    def get_config(self):
+        config = super(AntiAliasedPool, self).get_config()
+        config.update({'factor': self.factor})
+        return config
+
+
+def pool_feature_map(x, target_shape):
+    # Integer downsampling factors pool with anti-aliasing; anything else
+    # (e.g. an input size the encoder strides do not divide) is resized
+    _, h, w, _ = target_shape
+    current_h, current_w = x.shape[1:3]
+    if current_h == h and current_w == w:
+        return x
+    if current_h % h == 0 and current_w % w == 0 and current_h // h == current_w // w:
+        return AntiAliasedPool(current_h // h)(x)
+    return adjust_feature_map(x, target_shape)
+
+
+def project_feature_map(x, width):
+    # Learned 1x1 projection of one tapped map to a fixed channel width
+    x = Conv2D(width, 1, activation='relu', kernel_initializer='he_normal')(x)
+    return BatchNormalization()(x)
+
+
+# AS_Net with any encoder of the registry in common/encoders.py
+def AS_Net(encoder, input_size=(224, 224, 3), fine_tune_at=None, reg_factor=0.0005,
+           jit_compile=None, fused_attention=False, projection_width=None,
+           factorization=None, factorization_rank=None, weights='imagenet'):
+    inputs = Input(input_size)
+    print(f'CURRENT ENCODER: {encoder}')
+
+    # ImageNet weights unless weights=None; unknown names raise a ValueError
+    ENCODER = build_encoder(encoder, input_size, weights=weights)
+    ENCODER.summary() # Print the summary to inspect layer names
+
+    # Freeze all layers initially
+    ENCODER.trainable = False
+
+    # Optionally, unfreeze layers for fine-tuning from a certain layer
+    if fine_tune_at is not None:
+        for layer in ENCODER.layers[:fine_tune_at]:
+            layer.trainable = False
+        for layer in ENCODER.layers[fine_tune_at:]:
+            layer.trainable = True
+
+    layer_names = ENCODERS[encoder]['layers']
+
+    # All tapped layers come out of one forward pass through the encoder
+    outputs = multi_output_encoder(ENCODER, layer_names)(inputs)
+
+    # Encoder plus resizing to the deepest map's size form the 'features'
+    # stage; everything after it is the 'head'. With the encoder frozen the
+    # head can train on stored features alone (common/feature_store.py). With a
+    # projection width, taps are downsampled by anti-aliased pooling instead
+    # of bilinear resizing
+    adjust = pool_feature_map if projection_width else adjust_feature_map
+    adjusted = [adjust(x, outputs[-1].shape) for x in outputs]
+    features = Model(inputs=inputs, outputs=adjusted, name='features')
+    head_inputs = [Input(x.shape[1:]) for x in adjusted]
+
+    # Project every tap to projection_width channels before the merge, so the
+    # merged width (and every SAM/CAM conv) does not follow the very wide
+    # encoder expansion layers; None concatenates the raw maps
+    taps = head_inputs
+    if projection_width:
+        taps = [project_feature_map(x, projection_width) for x in head_inputs]
+
+    # Merge feature maps
+    merged = taps[-1]
+    for i in range(len(taps) - 2, -1, -1):
+        merged = concatenate([merged, taps[i]], axis=-1)
+
+    # Apply SAM and CAM, scale filters dynamically based on merged feature size
+    filters = merged.shape[-1]
+    if fused_attention:
+        # Spatial and channel attention on one shared conv trunk
+        SAM1, CAM1 = FusedAttention(filters=filters, factorization=factorization,
+                                    rank=factorization_rank)(merged)
+    else:
+        SAM1 = SAM(filters=filters, factorization=factorization, rank=factorization_rank)(merged)
+        CAM1 = CAM(filters=filters, factorization=factorization, rank=factorization_rank)(merged)
+
+    # Combine SAM and CAM outputs
+    combined = concatenate([SAM1, CAM1], axis=-1)
+
+    # Simplify the final layers
+    final_layers = Sequential([
+        Conv2D(128, 3, activation='relu', padding='same'),
+        BatchNormalization(),
+        GlobalAveragePooling2D(),
+        Dense(256, activation='relu'),
+        Dropout(0.3),
+        # float32 probabilities (and loss) under a mixed-precision policy
+        Dense(4, activation='softmax', dtype='float32')
+    ])
+
+    output = final_layers(combined)
+    head = Model(inputs=head_inputs, outputs=output, name='head')
+
+    model = Model(inputs=inputs, outputs=head(features(inputs)))
+    # jit_compile=None leaves XLA to Keras' 'auto' choice; True/False is kept
+    # on the model and passed on by the scripts' compile() calls
+    if jit_compile is not None:
+        model.jit_compile = jit_compile
+        head.jit_compile = jit_compile
+    return model
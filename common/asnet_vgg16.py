@@ -0,0 +1,397 @@
+# common/asnet_vgg16.py
+#
+# The AS_Net blocks of vgg16: SAM with multi-scale max-pooled spatial
+# attention, squeeze-and-excitation CAM (or FusedAttention, both on one shared
+# conv trunk), the SynergyModule that merges them with learned weights, and
+# AS_Net on the deepest tapped encoder map. Built like those of common/asnet.py
+# but different layers, so they are registered under a package of their own;
+# checkpoints saved before the split name them 'AS_Net>...' and load with
+# LEGACY_OBJECTS as custom_objects (common.blocks.custom_objects).
+
+import tensorflow as tf
+from tensorflow.keras import Input
+from tensorflow.keras.initializers import Constant
+from tensorflow.keras.layers import (
+    BatchNormalization, Conv2D, Dense, Dropout, GlobalAveragePooling2D, Layer, MaxPool2D
+)
+from tensorflow.keras.models import Model, Sequential
+
+from common.encoders import ENCODERS, build_encoder, multi_output_encoder
+from common.layers import factorizable_conv
+
+# Package the layers are registered under, i.e. 'AS_Net_VGG16>SAM', ...
+PACKAGE = 'AS_Net_VGG16'
+
+
+@tf.keras.utils.register_keras_serializable(package=PACKAGE)
+class SAM(Layer):
+    def __init__(self, filters, trunk=True, widths=None, factorization=None, rank=None,
+                 **kwargs):
+        super(SAM, self).__init__(**kwargs)
+        self.filters = filters
+        # Output channels of the first two trunk convs (filters // 4 each by
+        # default); conv3/conv4 keep filters // 4 for the attention and the
+        # residual. tools/prune.py saves narrower ones
+        self.widths = tuple(widths) if widths else (filters // 4, filters // 4)
+        # trunk=False leaves out the conv trunk; FusedAttention feeds attend()
+        # from a trunk it shares with CAM
+        self.has_trunk = trunk
+        # Full or factorized ('spatial'/'depthwise', see common/layers.py)
+        # 3x3 trunk convs
+        self.factorization = factorization
+        self.rank = rank
+        if trunk:
+            # Three sequential 3x3 convs as specified
+            self.conv1 = factorizable_conv(self.widths[0], 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            self.conv2 = factorizable_conv(self.widths[1], 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            self.conv3 = factorizable_conv(self.filters // 4, 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            # Dimension reduction conv
+            self.conv4 = Conv2D(self.filters // 4, 1,
+                                activation='relu', kernel_initializer='he_normal')
+        # 2x2 and 4x4 max pooling branches
+        self.pool1 = MaxPool2D(pool_size=(2, 2))
+        self.pool2 = MaxPool2D(pool_size=(4, 4))
+        # Attention branch convs
+        self.W1 = Conv2D(1, 1, activation='sigmoid',
+                         kernel_initializer='he_normal')
+        self.W2 = Conv2D(1, 1, activation='sigmoid',
+                         kernel_initializer='he_normal')
+
+    def build(self, input_shape):
+        reduced_shape = tuple(input_shape[:-1]) + (self.filters // 4,)
+        if self.has_trunk:
+            self.conv1.build(input_shape)
+            self.conv2.build(tuple(input_shape[:-1]) + (self.widths[0],))
+            self.conv3.build(tuple(input_shape[:-1]) + (self.widths[1],))
+            self.conv4.build(input_shape)
+        self.W1.build(reduced_shape)
+        self.W2.build(reduced_shape)
+        # Upsampling target, fixed at build time instead of tf.shape() per call
+        self.size = (int(input_shape[1]), int(input_shape[2]))
+        super(SAM, self).build(input_shape)
+
+    def trunk(self, inputs):
+        # Sequential convolutions
+        out1 = self.conv3(self.conv2(self.conv1(inputs)))
+        # Dimension reduction
+        out2 = self.conv4(inputs)
+        return out1, out2
+
+    def attend(self, out1, out2):
+        # 2x2 max pooling branch
+        pool1 = self.pool1(out2)
+        # Bilinear upsampling to original size, in float32 like ResizeLayer
+        upsample1 = tf.cast(tf.image.resize(tf.cast(pool1, 'float32'), size=self.size,
+                                            method='bilinear'), self.compute_dtype)
+        # Apply 1x1 conv with sigmoid
+        attention1 = self.W1(upsample1)
+
+        # 4x4 max pooling branch
+        pool2 = self.pool2(out2)
+        # Bilinear upsampling to original size
+        upsample2 = tf.cast(tf.image.resize(tf.cast(pool2, 'float32'), size=self.size,
+                                            method='bilinear'), self.compute_dtype)
+        # Apply 1x1 conv with sigmoid
+        attention2 = self.W2(upsample2)
+
+        # Sum the two attention maps
+        attention_sum = attention1 + attention2
+
+        # Apply attention to features via element-wise multiplication
+        attended_features = out1 * attention_sum
+
+        # Add to dimension-reduced input (residual connection)
+        y = attended_features + out2
+        return y
+
+    def call(self, inputs):
+        return self.attend(*self.trunk(inputs))
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape[:-1]) + (self.filters // 4,)
+
+    def get_config(self):
+        config = super(SAM, self).get_config()
+        config.update({'filters': self.filters, 'trunk': self.has_trunk,
+                       'widths': list(self.widths), 'factorization': self.factorization,
+                       'rank': self.rank})
+        return config
+
+
+@tf.keras.utils.register_keras_serializable(package=PACKAGE)
+class CAM(Layer):
+    def __init__(self, filters, reduction_ratio=16, trunk=True, widths=None,
+                 factorization=None, rank=None, **kwargs):
+        super(CAM, self).__init__(**kwargs)
+        self.filters = filters
+        # See SAM
+        self.widths = tuple(widths) if widths else (filters // 4, filters // 4)
+        self.reduction_ratio = reduction_ratio
+        # trunk=False: see SAM
+        self.has_trunk = trunk
+        self.factorization = factorization
+        self.rank = rank
+        if trunk:
+            # Conv block to process input features
+            self.conv1 = factorizable_conv(self.widths[0], 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            self.conv2 = factorizable_conv(self.widths[1], 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            self.conv3 = factorizable_conv(self.filters // 4, 3, factorization, rank,
+                                           activation='relu', kernel_initializer='he_normal')
+            # Dimension reduction conv
+            self.conv4 = Conv2D(self.filters // 4, 1,
+                                activation='relu', kernel_initializer='he_normal')
+        # Squeeze-and-Excitation components; keepdims gives the (1, 1, C)
+        # shape needed for broadcasting without a Reshape
+        self.gpool = GlobalAveragePooling2D(keepdims=True)
+        self.fc1 = Dense(self.filters // (4 * reduction_ratio),
+                         activation='relu', use_bias=False)
+        self.fc2 = Dense(self.filters // 4,
+                         activation='sigmoid', use_bias=False)
+
+    def build(self, input_shape):
+        if self.has_trunk:
+            self.conv1.build(input_shape)
+            self.conv2.build(tuple(input_shape[:-1]) + (self.widths[0],))
+            self.conv3.build(tuple(input_shape[:-1]) + (self.widths[1],))
+            self.conv4.build(input_shape)
+        self.fc1.build((input_shape[0], 1, 1, self.filters // 4))
+        self.fc2.build((input_shape[0], 1, 1, self.filters // (4 * self.reduction_ratio)))
+        super(CAM, self).build(input_shape)
+
+    def trunk(self, inputs):
+        # Process input through conv block
+        out1 = self.conv3(self.conv2(self.conv1(inputs)))
+        # Dimension reduction
+        out2 = self.conv4(inputs)
+        return out1, out2
+
+    def attend(self, out1, out2):
+        # Squeeze-and-Excitation: squeeze spatial dimensions
+        channel_attention = self.gpool(out2)
+        # Dimension reduction in channel-wise fully connected layer
+        channel_attention = self.fc1(channel_attention)
+        # Dimension increase with sigmoid activation
+        channel_attention = self.fc2(channel_attention)
+
+        # Apply channel attention via element-wise multiplication
+        recalibrated = out1 * channel_attention
+
+        # Add residual connection with dimension-reduced input
+        y = recalibrated + out2
+        return y
+
+    def call(self, inputs):
+        return self.attend(*self.trunk(inputs))
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape[:-1]) + (self.filters // 4,)
+
+    def get_config(self):
+        config = super(CAM, self).get_config()
+        config.update({'filters': self.filters, 'reduction_ratio': self.reduction_ratio,
+                       'trunk': self.has_trunk, 'widths': list(self.widths),
+                       'factorization': self.factorization, 'rank': self.rank})
+        return config
+
+
+@tf.keras.utils.register_keras_serializable(package=PACKAGE)
+class FusedAttention(Layer):
+    """SAM and CAM on one shared conv trunk; returns [spatial, channel] outputs."""
+
+    def __init__(self, filters, reduction_ratio=16, widths=None, factorization=None,
+                 rank=None, **kwargs):
+        super(FusedAttention, self).__init__(**kwargs)
+        self.filters = filters
+        self.reduction_ratio = reduction_ratio
+        # The trunk (three 3x3 convs + 1x1 reduction) is the bulk of the
+        # head's FLOPs; it lives in the SAM and is reused for the CAM branch
+        self.sam = SAM(filters, widths=widths, factorization=factorization, rank=rank)
+        self.widths = self.sam.widths
+        self.factorization = factorization
+        self.rank = rank
+        self.cam = CAM(filters, reduction_ratio, trunk=False)
+
+    def build(self, input_shape):
+        self.sam.build(input_shape)
+        self.cam.build(input_shape)
+        super(FusedAttention, self).build(input_shape)
+
+    def call(self, inputs):
+        out1, out2 = self.sam.trunk(inputs)
+        return [self.sam.attend(out1, out2), self.cam.attend(out1, out2)]
+
+    def compute_output_shape(self, input_shape):
+        shape = tuple(input_shape[:-1]) + (self.filters // 4,)
+        return [shape, shape]
+
+    def get_config(self):
+        config = super(FusedAttention, self).get_config()
+        config.update({'filters': self.filters, 'reduction_ratio': self.reduction_ratio,
+                       'widths': list(self.widths), 'factorization': self.factorization,
+                       'rank': self.rank})
+        return config
+
+
+@tf.keras.utils.register_keras_serializable(package=PACKAGE)
+class SynergyModule(Layer):
+    def __init__(self, filters, factorization=None, rank=None, **kwargs):
+        # autocast=False keeps alpha/beta float32 under a mixed-precision
+        # policy instead of casting them to the compute dtype in call()
+        super(SynergyModule, self).__init__(autocast=False, **kwargs)
+        self.filters = filters
+        # Full or factorized 3x3 conv, as in SAM/CAM
+        self.factorization = factorization
+        self.rank = rank
+        # Integration components
+        self.conv = factorizable_conv(filters, 3, factorization, rank,
+                                      kernel_initializer='he_normal')
+        self.bn = BatchNormalization()
+
+    def build(self, input_shape):
+        spatial_shape, _ = input_shape
+        # Trainable scaling parameters
+        self.alpha = self.add_weight(name='alpha', shape=(), initializer=Constant(0.5),
+                                     dtype='float32', trainable=True)
+        self.beta = self.add_weight(name='beta', shape=(), initializer=Constant(0.5),
+                                    dtype='float32', trainable=True)
+        self.conv.build(spatial_shape)
+        self.bn.build(tuple(spatial_shape[:-1]) + (self.filters,))
+        super(SynergyModule, self).build(input_shape)
+
+    def call(self, inputs, training=None):
+        # Unpack inputs (spatial and channel attention outputs)
+        spatial_features, channel_features = inputs
+
+        # Scale each pathway with trainable parameters and sum, in float32
+        alpha = tf.cast(self.alpha, 'float32')
+        beta = tf.cast(self.beta, 'float32')
+        combined = (tf.cast(spatial_features, 'float32') * alpha
+                    + tf.cast(channel_features, 'float32') * beta)
+
+        # Apply convolution and batch normalization
+        output = self.conv(tf.cast(combined, self.compute_dtype))
+        output = self.bn(output, training=training)
+
+        return output
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape[0][:-1]) + (self.filters,)
+
+    def get_config(self):
+        config = super(SynergyModule, self).get_config()
+        config.update({'filters': self.filters, 'factorization': self.factorization,
+                       'rank': self.rank})
+        return config
+
+
+@tf.keras.utils.register_keras_serializable(package=PACKAGE)
+class ResizeLayer(Layer):
+    def __init__(self, target_height, target_width, **kwargs):
+        super(ResizeLayer, self).__init__(**kwargs)
+        self.target_height = target_height
+        self.target_width = target_width
+
+    def call(self, inputs):
+        # Resize in float32 (what tf.image.resize computes and returns
+        # anyway; XLA rejects its gradient on bfloat16 inputs) and cast back
+        # to the compute dtype of a mixed-precision policy
+        resized = tf.image.resize(tf.cast(inputs, 'float32'), (self.target_height, self.target_width))
+        return tf.cast(resized, self.compute_dtype)
+
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0], self.target_height, self.target_width, input_shape[-1])
+
+    def get_config(self):
+        config = super(ResizeLayer, self).get_config()
+        config.update({'target_height': self.target_height, 'target_width': self.target_width})
+        return config
+
+
+def adjust_feature_map(x, target_shape):
+    _, h, w, _ = target_shape
+    current_h, current_w = x.shape[1:3]
+    if current_h != h or current_w != w:
+        resize_layer = ResizeLayer(h, w)
+        return resize_layer(x)
+    return x
+
+
+# AS_Net with VGG16 encoder
+def AS_Net(encoder='vgg16', input_size=(224, 224, 3), fine_tune_at=None,
+           jit_compile=None, fused_attention=False, factorization=None, factorization_rank=None,
+           weights='imagenet'):
+    inputs = Input(input_size)
+    print(f'CURRENT ENCODER: {encoder}')
+
+    # Any encoder of the registry in common/encoders.py (VGG16 by default),
+    # with ImageNet weights unless weights=None; unknown names raise a ValueError
+    ENCODER = build_encoder(encoder, input_size, weights=weights)
+
+    # Freeze all layers initially
+    ENCODER.trainable = False
+
+    # Optionally, unfreeze layers for fine-tuning from a certain layer
+    if fine_tune_at is not None:
+        for layer in ENCODER.layers[:fine_tune_at]:
+            layer.trainable = False
+        for layer in ENCODER.layers[fine_tune_at:]:
+            layer.trainable = True
+
+    # Selected output layers (you can experiment with different indices)
+    layer_indices = ENCODERS[encoder]['layers']
+
+    # All tapped layers come out of one forward pass through the encoder
+    encoder_outputs = multi_output_encoder(ENCODER, layer_indices)(inputs)
+
+    # Get the final encoder output that will be processed by the attention paths
+    final_encoder_output = encoder_outputs[-1]
+    filters = final_encoder_output.shape[-1]
+
+    if fused_attention:
+        # Spatial and channel attention on one shared conv trunk
+        SAM_output, CAM_output = FusedAttention(filters=filters, factorization=factorization,
+                                                rank=factorization_rank)(final_encoder_output)
+    else:
+        # Create two parallel attention paths
+        # Spatial Attention Path
+        SAM_output = SAM(filters=filters, factorization=factorization,
+                         rank=factorization_rank)(final_encoder_output)
+
+        # Channel Attention Path
+        CAM_output = CAM(filters=filters, factorization=factorization,
+                         rank=factorization_rank)(final_encoder_output)
+
+    # Apply Synergy Module to combine attention outputs
+    synergy_output = SynergyModule(filters=filters, factorization=factorization,
+                                   rank=factorization_rank)([SAM_output, CAM_output])
+
+    # Simplify the final layers
+    final_layers = Sequential([
+        Conv2D(128, 3, activation='relu', padding='same'),
+        BatchNormalization(),
+        GlobalAveragePooling2D(),
+        Dense(256, activation='relu'),
+        Dropout(0.3),
+        # float32 probabilities (and loss) under a mixed-precision policy
+        Dense(4, activation='softmax', dtype='float32')
+    ])
+
+    output = final_layers(synergy_output)
+
+    model = Model(inputs=inputs, outputs=output)
+    # jit_compile=None leaves XLA to Keras' 'auto' choice; True/False is kept
+    # on the model and passed on by the script's compile() call
+    if jit_compile is not None:
+        model.jit_compile = jit_compile
+    return model
+
+
+# Registered names of checkpoints saved when the blocks were defined in
+# vgg16/main.py under the package common/asnet.py keeps
+LEGACY_OBJECTS = {f'AS_Net>{layer.__name__}': layer
+                  for layer in (SAM, CAM, FusedAttention, SynergyModule, ResizeLayer)}
@@ -0,0 +1,122 @@
+# common/augmentation.py
+#
+# Batched, on-graph version of the scripts' ImageDataGenerator augmentation.
+# Rotation, shift, shear, zoom and horizontal flip are folded into one
+# projective matrix per image and applied to the whole batch by a single
+# ImageProjectiveTransformV3 op; brightness is a per-image multiply. Parameter
+# ranges mean exactly what they mean for ImageDataGenerator.
+
+import math
+
+import tensorflow as tf
+
+
+class BatchAugmentation:
+    """
+    Random affine + brightness augmentation for a batch of images.
+
+    Args:
+        brightness_range (tuple): Min/max brightness factor, None to disable
+        rotation_range (float): Degrees, uniformly sampled in [-range, range]
+        width_shift_range (float): Fraction of the width
+        height_shift_range (float): Fraction of the height
+        shear_range (float): Shear angle in degrees
+        zoom_range (float | tuple): Zoom in [1 - range, 1 + range] per axis
+        horizontal_flip (bool): Flip half of the images left-right
+        fill_mode (str): 'reflect', 'nearest', 'wrap' or 'constant'
+        cval (float): Fill value for fill_mode='constant'
+        seed (int): Seed for reproducible draws when no per-call seed is given
+    """
+
+    def __init__(self, brightness_range=None, rotation_range=0.0, width_shift_range=0.0,
+                 height_shift_range=0.0, shear_range=0.0, zoom_range=0.0,
+                 horizontal_flip=False, fill_mode='nearest', cval=0.0, seed=None):
+        self.brightness_range = brightness_range
+        self.rotation_range = float(rotation_range)
+        self.width_shift_range = float(width_shift_range)
+        self.height_shift_range = float(height_shift_range)
+        self.shear_range = float(shear_range)
+        if isinstance(zoom_range, (int, float)):
+            zoom_range = (1 - zoom_range, 1 + zoom_range)
+        self.zoom_range = tuple(float(z) for z in zoom_range)
+        self.horizontal_flip = horizontal_flip
+        self.fill_mode = fill_mode.upper()
+        self.cval = float(cval)
+        self._rng = (tf.random.Generator.from_seed(seed) if seed is not None
+                     else tf.random.Generator.from_non_deterministic_state())
+
+    def _transforms(self, seeds, batch, height, width):
+        # Same matrix chain as Keras' apply_affine_transform, in (x=col, y=row)
+        # coordinates, mapping output pixels to input pixels
+        def uniform(i, low, high):
+            return tf.random.stateless_uniform([batch], seeds[i], low, high)
+
+        height = tf.cast(height, tf.float32)
+        width = tf.cast(width, tf.float32)
+        zeros, ones = tf.zeros([batch]), tf.ones([batch])
+        theta = uniform(0, -self.rotation_range, self.rotation_range) * (math.pi / 180)
+        tx = uniform(1, -self.width_shift_range, self.width_shift_range) * width
+        ty = uniform(2, -self.height_shift_range, self.height_shift_range) * height
+        shear = uniform(3, -self.shear_range, self.shear_range) * (math.pi / 180)
+        zx = uniform(4, *self.zoom_range)
+        zy = uniform(5, *self.zoom_range)
+
+        def matrix(rows):
+            return tf.stack([tf.stack(row, axis=-1) for row in rows], axis=-2)
+
+        rotation = matrix([[tf.cos(theta), -tf.sin(theta), zeros],
+                           [tf.sin(theta), tf.cos(theta), zeros],
+                           [zeros, zeros, ones]])
+        shift = matrix([[ones, zeros, tx], [zeros, ones, ty], [zeros, zeros, ones]])
+        shear_m = matrix([[ones, -tf.sin(shear), zeros], [zeros, tf.cos(shear), zeros],
+                          [zeros, zeros, ones]])
+        zoom = matrix([[zx, zeros, zeros], [zeros, zy, zeros], [zeros, zeros, ones]])
+        m = rotation @ shift @ shear_m @ zoom
+
+        # Rotate/zoom around the image centre
+        o_x, o_y = ones * (width / 2 - 0.5), ones * (height / 2 - 0.5)
+        to_centre = matrix([[ones, zeros, o_x], [zeros, ones, o_y], [zeros, zeros, ones]])
+        from_centre = matrix([[ones, zeros, -o_x], [zeros, ones, -o_y], [zeros, zeros, ones]])
+        m = to_centre @ m @ from_centre
+
+        if self.horizontal_flip:
+            # Flipping the output is x -> (width - 1) - x before the affine map
+            flip = tf.random.stateless_uniform([batch], seeds[6]) < 0.5
+            sign = tf.where(flip, -ones, ones)
+            offset = tf.where(flip, ones * (width - 1), zeros)
+            m = m @ matrix([[sign, zeros, offset], [zeros, ones, zeros], [zeros, zeros, ones]])
+
+        return tf.stack([m[:, 0, 0], m[:, 0, 1], m[:, 0, 2],
+                         m[:, 1, 0], m[:, 1, 1], m[:, 1, 2],
+                         zeros, zeros], axis=-1)
+
+    def __call__(self, images, seed=None):
+        """
+        Augment a float batch of shape (batch, height, width, channels) in [0, 255].
+
+        Args:
+            images (tf.Tensor): Images to transform
+            seed (tf.Tensor): Optional int64 shape-[2] stateless seed; the
+                instance's generator is used when omitted
+
+        Returns:
+            tf.Tensor: float32 batch with the same shape
+        """
+        images = tf.cast(images, tf.float32)
+        if seed is None:
+            seed = self._rng.make_seeds(1)[:, 0]
+        seeds = tf.random.experimental.stateless_split(tf.cast(seed, tf.int64), num=8)
+        shape = tf.shape(images)
+        batch, height, width = shape[0], shape[1], shape[2]
+
+        transforms = self._transforms(seeds, batch, height, width)
+        images = tf.raw_ops.ImageProjectiveTransformV3(
+            images=images, transforms=transforms, output_shape=shape[1:3],
+            fill_value=self.cval, interpolation='BILINEAR', fill_mode=self.fill_mode)
+
+        if self.brightness_range is not None:
+            # PIL's ImageEnhance.Brightness: scale, then clip to the uint8 range
+            factor = tf.random.stateless_uniform([batch, 1, 1, 1], seeds[7],
+                                                 self.brightness_range[0], self.brightness_range[1])
+            images = tf.clip_by_value(images * factor, 0.0, 255.0)
+        return images
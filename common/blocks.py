@@ -0,0 +1,71 @@
+# common/blocks.py
+#
+# Where each script's AS_Net blocks live: common/asnet.py for efficientnet_v2
+# and mobilenet_v3_large, which share them, and common/asnet_vgg16.py for
+# vgg16; base has none. Importing a block module registers its
+# Keras-serializable layers under a package name of its own, so benchmarks
+# and tools can build a script's blocks, call its AS_Net and reload saved
+# models of any scripts, together in one process, without running them.
+
+import functools
+import importlib
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scripts with a saved model, by directory
+SCRIPTS = ('vgg16', 'efficientnet_v2', 'mobilenet_v3_large', 'base')
+# Those that define AS_Net, for tools that build and train one
+AS_NET_SCRIPTS = ('vgg16', 'efficientnet_v2', 'mobilenet_v3_large')
+# Block module of each of those, and the encoder its script builds AS_Net on
+BLOCK_MODULES = {'vgg16': 'common.asnet_vgg16', 'efficientnet_v2': 'common.asnet',
+                 'mobilenet_v3_large': 'common.asnet'}
+ENCODER_NAMES = {'vgg16': 'vgg16', 'efficientnet_v2': 'efficientnetv2b0',
+                 'mobilenet_v3_large': 'mobilenetv3'}
+
+
+def load_blocks(script):
+    """
+    Import the AS_Net blocks of one script, registering its layers.
+
+    Args:
+        script (str): Script directory, one of AS_NET_SCRIPTS
+
+    Returns:
+        module: common.asnet or common.asnet_vgg16
+    """
+    if script not in BLOCK_MODULES:
+        raise ValueError(f'{script!r} has no AS_Net blocks; expected one of {AS_NET_SCRIPTS}')
+    return importlib.import_module(BLOCK_MODULES[script])
+
+
+def as_net(script):
+    """
+    AS_Net of one script, building on the script's encoder unless given one.
+
+    Args:
+        script (str): Script directory, one of AS_NET_SCRIPTS
+
+    Returns:
+        callable: AS_Net taking the same keyword arguments as the script's
+    """
+    return functools.partial(load_blocks(script).AS_Net, encoder=ENCODER_NAMES[script])
+
+
+def custom_objects(script):
+    """
+    custom_objects for tf.keras.models.load_model of a script's saved model.
+
+    Registers the script's layers; the mapping itself only resolves the names
+    of checkpoints saved before the blocks moved to their own modules (see
+    common/asnet_vgg16.py).
+
+    Args:
+        script (str): Script directory, one of SCRIPTS
+
+    Returns:
+        dict: Registered name to layer class
+    """
+    if script not in BLOCK_MODULES:
+        return {}
+    return dict(getattr(load_blocks(script), 'LEGACY_OBJECTS', {}))
@@ -0,0 +1,318 @@
+# common/data_pipeline.py
+#
+# tf.data replacement for ImageDataGenerator.flow_from_dataframe. Decoding and
+# resizing run as parallel graph ops (JPEGs at a reduced DCT scale), batches
+# are prefetched, and the returned dataset carries the same `class_indices` /
+# `classes` / `samples` attributes the scripts read from the Keras iterators.
+
+import numpy as np
+import tensorflow as tf
+
+from common.augmentation import BatchAugmentation
+from common.decode import decode_image, load_image
+from common.materialize import materialize_images
+
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+def _class_indices(df, y_col):
+    # Same ordering rule as flow_from_dataframe: sorted class names
+    return {name: i for i, name in enumerate(sorted(df[y_col].unique()))}
+
+
+def _attach_attributes(ds, df, x_col, labels, class_indices, batch_size):
+    # image_dataset_from_directory uses the same trick for `class_names`
+    ds.class_indices = dict(class_indices)
+    ds.classes = labels
+    ds.samples = len(df)
+    ds.filenames = list(df[x_col])
+    ds.batch_size = batch_size
+    return ds
+
+
+def _generator_transform(generator, target_size):
+    # Per-image fallback for Keras ImageDataGenerator augmentation
+    def transform(image):
+        def apply(x):
+            return generator.random_transform(x.astype(np.float32)).astype(np.float32)
+        out = tf.numpy_function(apply, [tf.cast(image, tf.float32)], tf.float32, stateful=True)
+        out.set_shape((*target_size, 3))
+        return out
+    return transform
+
+
+def _deterministic(shuffle, seed):
+    # Parallel maps may hand out elements as they finish when the order is
+    # random anyway; a seeded loader keeps it, so a run (or a resumed one,
+    # see common/training.py) replays the same batches
+    return not shuffle or seed is not None
+
+
+def _array_source(images, rows, labels, shuffle, seed):
+    # Rows are read from `images` (an in-memory or memory-mapped uint8 array)
+    # one at a time, so nothing larger than a batch is ever copied
+    image_shape = tuple(images.shape[1:])
+
+    def read_row(row):
+        return images[row]
+
+    def read(row, label):
+        image = tf.numpy_function(read_row, [row], tf.uint8, stateful=False)
+        image.set_shape(image_shape)
+        return image, label
+
+    ds = tf.data.Dataset.from_tensor_slices((rows, labels))
+    if shuffle:
+        ds = ds.shuffle(len(rows), seed=seed, reshuffle_each_iteration=True)
+    return ds.map(read, num_parallel_calls=AUTOTUNE, deterministic=_deterministic(shuffle, seed))
+
+
+def _cached_images(image_cache, paths, labels, target_size, shuffle, seed):
+    cached_shape = image_cache.images.shape[1:3]
+    if tuple(cached_shape) != target_size:
+        raise ValueError(f'Image cache holds {cached_shape} images, loader expects {target_size}')
+    return _array_source(image_cache.images, image_cache.rows(paths), labels, shuffle, seed)
+
+
+def _batch_for_model(ds, batch_size, num_classes, rescale, augmentation=None,
+                     target_size=None, shuffle=True, seed=None):
+    if augmentation is not None and not isinstance(augmentation, BatchAugmentation):
+        transform = _generator_transform(augmentation, target_size)
+        ds = ds.map(lambda image, label: (transform(image), label),
+                    num_parallel_calls=AUTOTUNE, deterministic=_deterministic(shuffle, seed))
+
+    def to_model_inputs(images, batch_labels):
+        # uint8 -> float32 [0, 1] happens here, one batch at a time
+        images = tf.cast(images, tf.float32) * rescale
+        return images, tf.one_hot(batch_labels, num_classes)
+
+    ds = ds.batch(batch_size)
+    if isinstance(augmentation, BatchAugmentation):
+        # One stateless seed per batch keeps draws reproducible under parallel map
+        seeds = tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True).batch(2)
+        ds = tf.data.Dataset.zip((ds, seeds)).map(
+            lambda batch, batch_seed: (augmentation(batch[0], seed=batch_seed), batch[1]),
+            num_parallel_calls=AUTOTUNE, deterministic=True)
+    ds = ds.map(to_model_inputs, num_parallel_calls=AUTOTUNE, deterministic=True)
+    return ds.prefetch(AUTOTUNE)
+
+
+def flow_from_arrays(images, y, batch_size=32, shuffle=True, seed=None, rescale=1 / 255):
+    """
+    Batch uint8 images (e.g. from prepare_data) and normalize them on the fly.
+
+    Args:
+        images (np.ndarray): uint8 array of shape (N, height, width, 3), may be a memmap
+        y (np.ndarray): One-hot labels of shape (N, num_classes)
+        batch_size (int): Images per batch
+        shuffle (bool): Reshuffle every epoch
+        seed (int): Shuffle seed
+        rescale (float): Factor applied to pixel values
+
+    Returns:
+        tf.data.Dataset: Dataset of (float32 images, one-hot labels) batches
+    """
+    labels = np.argmax(y, axis=1).astype(np.int32)
+    ds = _array_source(images, np.arange(len(images), dtype=np.int64), labels, shuffle, seed)
+    ds = _batch_for_model(ds, batch_size, y.shape[1], rescale)
+    ds.classes = labels
+    ds.samples = len(labels)
+    ds.batch_size = batch_size
+    return ds
+
+
+def flow_from_dataframe(df, x_col='Class Path', y_col='Class', batch_size=32,
+                        target_size=(224, 224), shuffle=True, seed=None,
+                        augmentation=None, rescale=1 / 255, cache=False,
+                        class_indices=None, interpolation='nearest', image_cache=None):
+    """
+    Build a batched, prefetched tf.data pipeline from a DataFrame of image paths.
+
+    Args:
+        df (pd.DataFrame): DataFrame with image paths and class names
+        x_col (str): Column holding the image paths
+        y_col (str): Column holding the class names
+        batch_size (int): Images per batch
+        target_size (tuple): (height, width) images are resized to
+        shuffle (bool): Reshuffle every epoch; False keeps DataFrame order
+        seed (int): Shuffle seed
+        augmentation: Optional BatchAugmentation applied to whole batches on
+            the graph, or an ImageDataGenerator applied per image (slow path)
+        rescale (float): Factor applied to pixel values after augmentation
+        cache (bool | str): Cache decoded uint8 images in memory (True) or in
+            the given file path
+        class_indices (dict): Class name to index mapping, inferred if None
+        interpolation (str): Resize method
+        image_cache (ImageCache): Read pre-decoded rows from this memory-mapped
+            cache instead of decoding the files
+
+    Returns:
+        tf.data.Dataset: Dataset of (images, one-hot labels) batches with
+        `class_indices`, `classes`, `samples` and `filenames` attributes
+    """
+    target_size = tuple(target_size)
+    class_indices = class_indices or _class_indices(df, y_col)
+    labels = df[y_col].map(class_indices).to_numpy(dtype=np.int32)
+    paths = df[x_col].to_numpy(dtype=str)
+
+    def decode(path, label):
+        return load_image(path, target_size, interpolation), label
+
+    if image_cache is not None:
+        ds = _cached_images(image_cache, paths, labels, target_size, shuffle, seed)
+    elif cache is not False:
+        # Decode once, then reshuffle the cached tensors every epoch
+        ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+        ds = ds.map(decode, num_parallel_calls=AUTOTUNE, deterministic=True)
+        ds = ds.cache(cache if isinstance(cache, str) else '')
+        if shuffle:
+            ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+    else:
+        ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+        if shuffle:
+            ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.map(decode, num_parallel_calls=AUTOTUNE, deterministic=_deterministic(shuffle, seed))
+
+    ds = _batch_for_model(ds, batch_size, len(class_indices), rescale, augmentation,
+                          target_size, shuffle, seed)
+    return _attach_attributes(ds, df, x_col, labels, class_indices, batch_size)
+
+
+def flow_from_memory(df, x_col='Class Path', y_col='Class', batch_size=32,
+                     target_size=(224, 224), rescale=1 / 255, class_indices=None, workers=None):
+    """
+    Decode a split once into an in-memory uint8 tensor and batch it unaugmented.
+
+    Meant for validation: every epoch sees exactly the same images in the
+    same order, so val_loss/val_accuracy (and the callbacks keyed on them)
+    only move when the model does, and no epoch pays for decoding again.
+
+    Args:
+        df (pd.DataFrame): DataFrame with image paths and class names
+        x_col (str): Column holding the image paths
+        y_col (str): Column holding the class names
+        batch_size (int): Images per batch
+        target_size (tuple): (height, width) images are resized to
+        rescale (float): Factor applied to pixel values
+        class_indices (dict): Class name to index mapping, inferred if None
+        workers (int): Decode processes, defaults to the available cores
+
+    Returns:
+        tf.data.Dataset: Dataset of (images, one-hot labels) batches with
+        `class_indices`, `classes`, `samples` and `filenames` attributes
+    """
+    target_size = tuple(target_size)
+    class_indices = class_indices or _class_indices(df, y_col)
+    labels = df[y_col].map(class_indices).to_numpy(dtype=np.int32)
+    images = materialize_images(df[x_col], target_size, workers=workers)
+
+    # uint8 keeps the split at a quarter of its float32 size; the cast happens per batch
+    ds = tf.data.Dataset.from_tensor_slices((tf.constant(images), labels))
+    ds = _batch_for_model(ds, batch_size, len(class_indices), rescale, shuffle=False)
+    return _attach_attributes(ds, df, x_col, labels, class_indices, batch_size)
+
+
+_RECORD_FEATURES = {
+    'image': tf.io.FixedLenFeature([], tf.string),
+    'label': tf.io.FixedLenFeature([], tf.int64),
+}
+
+
+def flow_from_records(shards, batch_size=32, target_size=(224, 224), shuffle=True,
+                      seed=None, augmentation=None, rescale=1 / 255,
+                      interpolation='nearest', shuffle_buffer=2048, cycle_length=8):
+    """
+    Stream an exported split from its TFRecord shards.
+
+    Shards are read with a parallel interleave when shuffling and strictly in
+    record order otherwise, so evaluation order matches `shards.classes`.
+
+    Args:
+        shards (RecordShards): Output of common.records.export_records
+        batch_size (int): Images per batch
+        target_size (tuple): (height, width) images are resized to
+        shuffle (bool): Shuffle shard order and records every epoch
+        seed (int): Shuffle seed
+        augmentation: Optional BatchAugmentation (or ImageDataGenerator)
+        rescale (float): Factor applied to pixel values after augmentation
+        interpolation (str): Resize method
+        shuffle_buffer (int): Records held in the shuffle buffer
+        cycle_length (int): Shards read concurrently
+
+    Returns:
+        tf.data.Dataset: Dataset of (images, one-hot labels) batches with the
+        same attributes as flow_from_dataframe
+    """
+    target_size = tuple(target_size)
+
+    def parse(serialized):
+        features = tf.io.parse_single_example(serialized, _RECORD_FEATURES)
+        image = decode_image(features['image'], target_size, interpolation)
+        return image, tf.cast(features['label'], tf.int32)
+
+    if shuffle:
+        files = tf.data.Dataset.from_tensor_slices(shards.shards)
+        files = files.shuffle(len(shards.shards), seed=seed, reshuffle_each_iteration=True)
+        ds = files.interleave(lambda f: tf.data.TFRecordDataset(f, buffer_size=8 << 20),
+                              cycle_length=min(cycle_length, len(shards.shards)),
+                              num_parallel_calls=AUTOTUNE,
+                              deterministic=_deterministic(shuffle, seed))
+        ds = ds.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    else:
+        ds = tf.data.TFRecordDataset(shards.shards, buffer_size=8 << 20)
+    ds = ds.map(parse, num_parallel_calls=AUTOTUNE, deterministic=_deterministic(shuffle, seed))
+    # Record count is known from the export; lets len() and LR schedules work
+    ds = ds.apply(tf.data.experimental.assert_cardinality(len(shards)))
+
+    ds = _batch_for_model(ds, batch_size, len(shards.class_indices), rescale, augmentation,
+                          target_size, shuffle, seed)
+    ds.class_indices = dict(shards.class_indices)
+    ds.classes = shards.classes
+    ds.samples = len(shards)
+    ds.filenames = list(shards.filenames)
+    ds.batch_size = batch_size
+    return ds
+
+
+def flow_from_split(df, split, source='records', target_size=(224, 224), shuffle=True,
+                    seed=None, target_shard_mb=128, **kwargs):
+    """
+    Build the loader of one split from the chosen storage layout.
+
+    Args:
+        df (pd.DataFrame): DataFrame of the split
+        split (str): Split name used to key shards and caches
+        source (str): 'records' (sequential shards), 'cache' (memory-mapped
+            uint8 rows), 'files' (one image file per read) or 'memory'
+            (decoded once into RAM, never shuffled or augmented)
+        target_size (tuple): (height, width) images are resized to
+        shuffle (bool): Reshuffle every epoch; False keeps DataFrame order
+        seed (int): Shuffle seed, also used to mix records across shards
+        target_shard_mb (float): Shard size for source='records'
+        **kwargs: Forwarded to flow_from_dataframe / flow_from_records /
+            flow_from_memory
+
+    Returns:
+        tf.data.Dataset: Batched dataset with class_indices/classes attributes
+    """
+    if source == 'records':
+        from common.records import export_records
+        class_indices = kwargs.pop('class_indices', None)
+        shards = export_records(df, split, class_indices=class_indices,
+                                target_shard_mb=target_shard_mb,
+                                shuffle_seed=(seed or 0) if shuffle else None)
+        return flow_from_records(shards, target_size=target_size, shuffle=shuffle,
+                                 seed=seed, **kwargs)
+    if source == 'memory':
+        if shuffle or kwargs.get('augmentation') is not None:
+            raise ValueError("source='memory' is for evaluation; pass shuffle=False and no augmentation")
+        kwargs.pop('augmentation', None)
+        return flow_from_memory(df, target_size=target_size, **kwargs)
+    if source == 'cache':
+        from common.image_cache import build_image_cache
+        kwargs['image_cache'] = build_image_cache(df, split, target_size)
+    elif source != 'files':
+        raise ValueError(f"Unknown data source '{source}'. Use 'records', 'cache', 'files' or 'memory'.")
+    return flow_from_dataframe(df, target_size=target_size, shuffle=shuffle, seed=seed, **kwargs)
+
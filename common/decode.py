@@ -0,0 +1,125 @@
+# common/decode.py
+#
+# Image decoding shared by the loaders, caches and prediction helpers. JPEGs
+# are decoded with libjpeg's DCT scaling (1/2, 1/4 or 1/8) straight to the
+# smallest size that is still at least the target, and only then resized, so a
+# large scan never gets fully decoded just to become 224x224.
+#
+# read_image (PIL, for the in-memory and cached splits) and decode_image
+# (tf.data) give identical pixels for nearest resizing: both use the accurate
+# integer IDCT, the same DCT scale rule and the same nearest_indices().
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+
+# Bump when decoded pixels change, so caches of them are rebuilt
+DECODER_VERSION = 3
+
+# Scale denominators libjpeg can decode to, largest first
+_JPEG_RATIOS = (8, 4, 2, 1)
+
+
+def nearest_indices(in_size, out_size):
+    """Source index of every output pixel along one axis for nearest resizing."""
+    # Pixel centres, in float64 so both decoders round alike
+    index = np.floor((np.arange(out_size) + 0.5) * (in_size / out_size)).astype(np.int64)
+    return np.minimum(index, in_size - 1)
+
+
+def read_image(path, image_size, resample=Image.NEAREST, draft=True):
+    """
+    Decode one image file to a uint8 RGB array of the target size.
+
+    Args:
+        path (str): Image file path
+        image_size (tuple): (height, width)
+        resample (int): PIL resampling filter for the final resize;
+            Image.NEAREST uses nearest_indices(), like decode_image
+        draft (bool): Let libjpeg decode at a reduced scale first
+
+    Returns:
+        np.ndarray: uint8 array of shape (height, width, 3)
+    """
+    with Image.open(path) as img:
+        if draft:
+            # Picks the largest DCT scale whose output still covers the target;
+            # a no-op for non-JPEG files
+            img.draft('RGB', (image_size[1], image_size[0]))
+        # Convert grayscale to RGB if needed
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if resample == Image.NEAREST:
+            pixels = np.asarray(img, dtype=np.uint8)
+            rows = nearest_indices(pixels.shape[0], image_size[0])
+            cols = nearest_indices(pixels.shape[1], image_size[1])
+            return np.ascontiguousarray(pixels[rows][:, cols])
+        # PIL takes (width, height)
+        img = img.resize((image_size[1], image_size[0]), resample)
+        return np.asarray(img, dtype=np.uint8)
+
+
+def _jpeg_ratio_index(data, target_size):
+    shape = tf.io.extract_jpeg_shape(data)
+    # PIL's Image.draft rule: the largest ratio within the whole-number
+    # downscale factor of both sides; ratio 1 always qualifies
+    scale = tf.minimum(shape[0] // target_size[0], shape[1] // target_size[1])
+    fits = [scale >= r for r in _JPEG_RATIOS[:-1]] + [tf.constant(True)]
+    return tf.argmax(tf.stack(fits), output_type=tf.int32)
+
+
+def _resize_nearest(image, target_size):
+    # Gathers with nearest_indices(), computed in float64 like read_image
+    shape = tf.shape(image, out_type=tf.int64)
+    indices = []
+    for axis, size in enumerate(target_size):
+        scale = tf.cast(shape[axis], tf.float64) / size
+        index = tf.cast(tf.floor((tf.range(size, dtype=tf.float64) + 0.5) * scale), tf.int64)
+        indices.append(tf.minimum(index, shape[axis] - 1))
+    return tf.gather(tf.gather(image, indices[0], axis=0), indices[1], axis=1)
+
+
+def decode_image(data, target_size, interpolation='nearest', scaled_jpeg=True):
+    """
+    Decode encoded image bytes and resize them to a uint8 RGB tensor.
+
+    Args:
+        data (tf.Tensor): Scalar string tensor with the encoded image
+        target_size (tuple): (height, width)
+        interpolation (str): tf.image.resize method; 'nearest' matches
+            read_image(resample=Image.NEAREST) pixel for pixel
+        scaled_jpeg (bool): Decode JPEGs at a reduced DCT scale first
+
+    Returns:
+        tf.Tensor: uint8 tensor of shape (height, width, 3)
+    """
+    def generic():
+        # channels=3 converts grayscale scans to RGB like img.convert('RGB')
+        return tf.io.decode_image(data, channels=3, expand_animations=False)
+
+    def jpeg(ratio=1):
+        # The accurate integer IDCT is the one PIL uses
+        return tf.io.decode_jpeg(data, channels=3, ratio=ratio, dct_method='INTEGER_ACCURATE')
+
+    if scaled_jpeg:
+        def scaled():
+            # decode_jpeg's ratio is a static attribute, so branch per ratio
+            branches = [lambda r=r: jpeg(r) for r in _JPEG_RATIOS]
+            return tf.switch_case(_jpeg_ratio_index(data, target_size), branches)
+
+        image = tf.cond(tf.io.is_jpeg(data), scaled, generic)
+    else:
+        image = tf.cond(tf.io.is_jpeg(data), jpeg, generic)
+
+    if interpolation == 'nearest':
+        image = _resize_nearest(image, target_size)
+    else:
+        image = tf.cast(tf.round(tf.image.resize(image, target_size, method=interpolation)), tf.uint8)
+    image.set_shape((*target_size, 3))
+    return image
+
+
+def load_image(path, target_size, interpolation='nearest', scaled_jpeg=True):
+    """Read an image file and decode it with decode_image."""
+    return decode_image(tf.io.read_file(path), target_size, interpolation, scaled_jpeg)
@@ -0,0 +1,121 @@
+# common/distillation.py
+#
+# Knowledge distillation from a trained teacher checkpoint: the student trains
+# on a mix of the hard-label loss and the KL divergence to the
+# temperature-softened teacher outputs, always for the same augmented input
+# the student sees. A head trained on stored features gets the teacher's
+# probabilities stored next to every augmented feature variant
+# (build_feature_store(teacher=...)); a model trained on images runs the
+# teacher on each augmented training batch (Distiller(teacher=...)).
+#
+# The teacher is loaded next to the student, with its own script's layers
+# (common/blocks.py registers each family of blocks under its own name).
+
+import tensorflow as tf
+
+from common.blocks import custom_objects
+
+
+def load_teacher(teacher_script, teacher_path):
+    """
+    Load a teacher checkpoint for inference, with its own script's layers.
+
+    Args:
+        teacher_script (str): Script directory the teacher was trained with,
+            e.g. 'vgg16'
+        teacher_path (str): Teacher checkpoint, e.g. 'vgg16/best_model.keras'
+
+    Returns:
+        tf.keras.Model: The teacher, frozen
+    """
+    teacher = tf.keras.models.load_model(teacher_path, compile=False,
+                                         custom_objects=custom_objects(teacher_script))
+    teacher.trainable = False
+    return teacher
+
+
+def run_teacher(teacher, x):
+    """
+    Teacher class probabilities for a batch of student inputs.
+
+    The teacher takes the student's images, rescaled alike; they are resized
+    when the teacher was trained at another input size.
+
+    Args:
+        teacher (tf.keras.Model): Output of load_teacher
+        x (tf.Tensor): Batch of student input images
+
+    Returns:
+        tf.Tensor: float32 probabilities of shape (batch, num_classes)
+    """
+    size = tuple(teacher.input_shape[1:3])
+    if tuple(x.shape[1:3]) != size:
+        x = tf.image.resize(tf.cast(x, 'float32'), size)
+    return tf.cast(teacher(x, training=False), 'float32')
+
+
+def distillation_loss(teacher_probs, student_probs, temperature):
+    """
+    Per-sample KL divergence between temperature-softened teacher and student.
+
+    Both models end in a softmax, so their log-probabilities stand in for the
+    logits (softmax is invariant to the per-sample constant between them).
+    Scaled by temperature**2 to keep gradient magnitudes comparable to the
+    hard-label loss.
+    """
+    epsilon = tf.keras.backend.epsilon()
+    teacher_log = tf.nn.log_softmax(
+        tf.math.log(tf.clip_by_value(teacher_probs, epsilon, 1.0)) / temperature)
+    student_log = tf.nn.log_softmax(
+        tf.math.log(tf.clip_by_value(student_probs, epsilon, 1.0)) / temperature)
+    kl = tf.reduce_sum(tf.exp(teacher_log) * (teacher_log - student_log), axis=-1)
+    return kl * temperature ** 2
+
+
+class Distiller(tf.keras.Model):
+    """
+    Train a student on hard labels and teacher probabilities.
+
+    Without a teacher, training inputs are {'inputs': student inputs,
+    'soft_targets': teacher probabilities} (see
+    flow_from_feature_store(soft_targets=True)). With one, training inputs
+    are the student's own (augmented) images and the teacher is run on each
+    batch. Evaluation data is scored on the hard loss alone. The total loss
+    is alpha * hard + (1 - alpha) * distillation loss. Saving a Distiller
+    saves `saved_model`, or else the student, so a ModelCheckpoint on it
+    writes a plain checkpoint; when the student is the head of an image
+    model, pass that model so the checkpoint takes images.
+    """
+
+    def __init__(self, student, temperature=4.0, alpha=0.5, saved_model=None, teacher=None,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.student = student
+        self.temperature = temperature
+        self.alpha = alpha
+        self.saved_model = saved_model
+        self.teacher = teacher
+
+    def call(self, inputs, training=None):
+        if isinstance(inputs, dict):
+            inputs = inputs['inputs']
+        return self.student(inputs, training=training)
+
+    def compute_loss(self, x=None, y=None, y_pred=None, sample_weight=None, training=True):
+        hard = super().compute_loss(x=x, y=y, y_pred=y_pred, sample_weight=sample_weight,
+                                    training=training)
+        if isinstance(x, dict):
+            targets = x['soft_targets']
+        elif self.teacher is not None and training:
+            targets = run_teacher(self.teacher, x)
+        else:
+            return hard
+        soft = distillation_loss(tf.cast(targets, y_pred.dtype), y_pred, self.temperature)
+        if sample_weight is not None:
+            # class_weight applies to both terms
+            soft = soft * tf.cast(tf.reshape(sample_weight, tf.shape(soft)), soft.dtype)
+        return self.alpha * hard + (1 - self.alpha) * tf.reduce_mean(soft)
+
+    def save(self, *args, **kwargs):
+        return (self.saved_model or self.student).save(*args, **kwargs)
+
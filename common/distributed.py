@@ -0,0 +1,189 @@
+# common/distributed.py
+#
+# Data-parallel training over several CPU processes or machines: every worker
+# process is one replica of a MultiWorkerMirroredStrategy, built from a
+# cluster spec in the TF_CONFIG format,
+#
+#   {"cluster": {"worker": ["node1:12345", "node2:12345"]},
+#    "task": {"type": "worker", "index": 0}}
+#
+# and the replicas' gradients are all-reduced over gRPC (ring all-reduce)
+# every optimizer update. Each worker reads its own shard of a split,
+# assigned from the dataset manifest's DataFrame, so no image is decoded by
+# two workers; the training shards are equally long, because every update
+# waits for all workers. Keras' fit() cannot start under this strategy, so
+# the scripts train through fit_accumulated (common/training.py) instead.
+#
+#   strategy = cluster_strategy()  # from TF_CONFIG; None outside a cluster
+#   shard_df, shard_name = shard_split(tr_df, 'train', strategy)
+#
+# tools/launch_local.py runs a script as N local workers;
+# benchmarks/multiworker.py measures the scaling efficiency on one machine.
+
+import json
+import os
+import socket
+import subprocess
+import tempfile
+import time
+
+import tensorflow as tf
+
+CLUSTER_ENV = 'TF_CONFIG'
+
+
+def cluster_strategy(cluster_spec=None):
+    """
+    MultiWorkerMirroredStrategy of this worker, from a cluster spec.
+
+    Must run before any other TensorFlow op of the process.
+
+    Args:
+        cluster_spec (str or dict): TF_CONFIG-style spec, or a path to a JSON
+            file holding one; None reads the TF_CONFIG environment variable
+
+    Returns:
+        tf.distribute.MultiWorkerMirroredStrategy: None when there is no spec
+    """
+    options = tf.distribute.experimental.CommunicationOptions(
+        implementation=tf.distribute.experimental.CommunicationImplementation.RING)
+    if cluster_spec is None:
+        if not os.environ.get(CLUSTER_ENV):
+            return None
+        resolver = tf.distribute.cluster_resolver.TFConfigClusterResolver()
+    else:
+        if isinstance(cluster_spec, str):
+            with open(cluster_spec) as f:
+                cluster_spec = json.load(f)
+        task = cluster_spec['task']
+        resolver = tf.distribute.cluster_resolver.SimpleClusterResolver(
+            tf.train.ClusterSpec(cluster_spec['cluster']), task_type=task['type'],
+            task_id=task['index'], rpc_layer='grpc')
+    return tf.distribute.MultiWorkerMirroredStrategy(cluster_resolver=resolver,
+                                                    communication_options=options)
+
+
+def worker_info(strategy=None):
+    """(index, count) of this worker; (0, 1) outside a cluster."""
+    resolver = getattr(strategy, 'cluster_resolver', None)
+    if resolver is None or not resolver.cluster_spec().jobs:
+        return 0, 1
+    return resolver.task_id, resolver.cluster_spec().num_tasks(resolver.task_type)
+
+
+def is_chief(strategy=None):
+    """Worker 0 is the one that evaluates, exports and keeps the checkpoints."""
+    return worker_info(strategy)[0] == 0
+
+
+def shard_split(df, split, strategy=None, even=True):
+    """
+    This worker's shard of a split's DataFrame.
+
+    Rows are dealt round-robin by class and path, so every shard has the
+    split's class balance and the assignment is the same on every worker.
+
+    Args:
+        df (pd.DataFrame): Split, as read from the manifest
+        split (str): Split name
+        strategy (tf.distribute.Strategy): Cluster strategy; None or a
+            single-worker strategy returns the whole split
+        even (bool): Drop the last rows so that all shards are equally long,
+            as training needs; evaluation can take uneven shards
+
+    Returns:
+        tuple: (shard DataFrame, shard name to key its records and caches)
+    """
+    index, count = worker_info(strategy)
+    if count == 1:
+        return df, split
+    ordered = df.sort_values(['Class', 'Class Path'], kind='stable')
+    shard = ordered.iloc[index::count]
+    if even:
+        shard = shard.iloc[:len(df) // count]
+    return shard.reset_index(drop=True), f'{split}-{index}of{count}'
+
+
+def worker_path(path, strategy=None):
+    """
+    `path` on the chief, a scratch copy of it on every other worker.
+
+    Callbacks such as ModelCheckpoint and TensorBoard run on all workers;
+    only the chief's files are kept.
+    """
+    index, _ = worker_info(strategy)
+    if index == 0:
+        return path
+    return os.path.join(tempfile.gettempdir(), f'worker-{index}', os.path.basename(path))
+
+
+def local_model(model):
+    """
+    A single-process copy of a model trained under a cluster strategy.
+
+    Evaluating or predicting with the distributed model would need every
+    worker to take part; the chief evaluates and exports this copy alone.
+    """
+    copy = tf.keras.models.clone_model(model)
+    copy.set_weights(model.get_weights())
+    copy.compile_from_config(model.get_compile_config())
+    return copy
+
+
+def local_cluster(workers, host='localhost'):
+    """Cluster spec dict of `workers` workers on free ports of this machine."""
+    addresses = []
+    sockets = []
+    for _ in range(workers):
+        # Held open until all ports are picked, so none is picked twice
+        s = socket.socket()
+        s.bind((host, 0))
+        sockets.append(s)
+        addresses.append(f'{host}:{s.getsockname()[1]}')
+    for s in sockets:
+        s.close()
+    return {'worker': addresses}
+
+
+def launch_local(command, workers, threads=None, **popen_kwargs):
+    """
+    Start `command` as every worker of a local cluster.
+
+    Args:
+        command (list): Command line of one worker, the same for all
+        workers (int): Number of worker processes
+        threads (int): TensorFlow intra-op threads per worker, e.g. the
+            cores divided by the workers; None leaves TensorFlow's default
+        **popen_kwargs: Forwarded to subprocess.Popen, e.g. stdout
+
+    Returns:
+        list: subprocess.Popen per worker, in worker order
+    """
+    cluster = local_cluster(workers)
+    processes = []
+    for index in range(workers):
+        env = dict(os.environ, **{CLUSTER_ENV: json.dumps(
+            {'cluster': cluster, 'task': {'type': 'worker', 'index': index}})})
+        if threads:
+            env.update(TF_NUM_INTRAOP_THREADS=str(threads), OMP_NUM_THREADS=str(threads))
+        processes.append(subprocess.Popen(command, env=env, **popen_kwargs))
+    return processes
+
+
+def join(processes, poll=0.5):
+    """
+    Wait for the workers of a cluster; if one fails, stop the rest.
+
+    Workers blocked in an all-reduce would otherwise wait for the failed one
+    forever.
+
+    Returns:
+        list: Exit code per worker
+    """
+    while any(process.poll() is None for process in processes):
+        if any(process.poll() for process in processes):
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+        time.sleep(poll)
+    return [process.returncode for process in processes]
@@ -0,0 +1,90 @@
+# common/encoders.py
+#
+# The encoders AS_Net can be built on, and feature taps on them. AS_Net reads
+# several intermediate feature maps; wrapping each one in its own
+# Model(ENCODER.inputs, layer) and calling them all on the same input re-runs
+# the shared encoder prefix once per tap. One multi-output Model computes
+# every tap in a single forward pass.
+
+from tensorflow.keras.applications import VGG16, MobileNetV3Large, Xception, efficientnet_v2
+from tensorflow.keras.models import Model
+
+# Encoder name -> Keras application constructor, tapped layers (names or
+# indices, shallow to deep) and the factor the scripts scale uint8 pixels by
+ENCODERS = {
+    'vgg16': {
+        'build': VGG16,
+        # Last conv of each block
+        'layers': [2, 5, 9, 13, 17],
+        'rescale': 1 / 255,
+    },
+    'efficientnetv2b0': {
+        'build': efficientnet_v2.EfficientNetV2B0,
+        'layers': [
+            'block2b_expand_conv',
+            'block3b_expand_conv',  # Changed from 'block3d_expand_conv' to 'block3b_expand_conv'
+            'block5c_expand_conv',
+            'block6d_expand_conv',
+            'top_conv',
+        ],
+        'rescale': 1 / 255,
+    },
+    'mobilenetv3': {
+        'build': MobileNetV3Large,
+        'layers': [
+            'expanded_conv_depthwise',     # block_2 - relatively early features
+            'expanded_conv_1_depthwise',   # block_5 - mid-level features
+            'expanded_conv_5_depthwise',   # block_11 - deeper features
+            'expanded_conv_10_depthwise',  # block_14 - even deeper
+            'conv_1',                      # last conv layer before pooling
+        ],
+        'rescale': 1 / 255,
+    },
+    'xception': {
+        'build': Xception,
+        # Entry flow at strides 2/4/8, end of the middle flow, exit flow
+        'layers': [
+            'block1_conv2_act',
+            'block3_sepconv2_bn',
+            'block4_sepconv2_bn',
+            'block13_sepconv2_bn',
+            'block14_sepconv2_act',
+        ],
+        'rescale': 1 / 255,
+    },
+}
+
+
+def build_encoder(name, input_size, weights='imagenet'):
+    """
+    Build a registered encoder without its classification top.
+
+    Args:
+        name (str): Key of ENCODERS
+        input_size (tuple): (height, width, channels) of the input
+        weights (str): 'imagenet' or None for random initialization
+
+    Returns:
+        keras.Model: The encoder
+    """
+    if name not in ENCODERS:
+        raise ValueError(f'Unsupported encoder {name!r}; expected one of {sorted(ENCODERS)}')
+    return ENCODERS[name]['build'](weights=weights, include_top=False, input_shape=input_size)
+
+
+def multi_output_encoder(encoder, layers, name=None):
+    """
+    Wrap `encoder` so one call returns all requested intermediate feature maps.
+
+    Args:
+        encoder (keras.Model): Functional encoder, e.g. VGG16(include_top=False)
+        layers (Sequence[str | int]): Layer names or indices to tap, in output order
+        name (str): Model name, defaults to '<encoder name>_features'
+
+    Returns:
+        keras.Model: Model mapping the encoder input to a list of feature maps
+    """
+    outputs = [encoder.get_layer(index=layer).output if isinstance(layer, int)
+               else encoder.get_layer(layer).output
+               for layer in layers]
+    return Model(inputs=encoder.inputs, outputs=outputs, name=name or f'{encoder.name}_features')
@@ -0,0 +1,137 @@
+# common/evaluation.py
+#
+# Helpers shared by the post-training tools (tools/) and the benchmarks: the
+# scripts' train/test split rebuilt from the dataset root, per-image inference
+# on a float model, the FLOP count of a model's forward pass, and the brief
+# recovery fine-tuning and latency/accuracy report of the compression tools.
+
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from sklearn.model_selection import train_test_split
+from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+from common.data_pipeline import flow_from_split
+from common.hashing import audit_splits, drop_flagged
+from common.manifest import load_dataset_df
+from common.materialize import encode_labels, materialize_images
+
+
+def split_dataset(data_dir):
+    """
+    Training, validation and test DataFrames split exactly as the scripts split them.
+
+    The Testing folder is halved into valid/test with the scripts' seed and
+    stratification, and files the audit flags as corrupt are dropped.
+
+    Args:
+        data_dir (str): Dataset root with Training/ and Testing/
+
+    Returns:
+        tuple: (tr_df, valid_df, ts_df)
+    """
+    tr_df = load_dataset_df(os.path.join(data_dir, 'Training'))
+    ts_df = load_dataset_df(os.path.join(data_dir, 'Testing'))
+    valid_df, ts_df = train_test_split(ts_df, train_size=0.5, random_state=20,
+                                       stratify=ts_df['Class'])
+    audit = audit_splits({'train': tr_df, 'valid': valid_df, 'test': ts_df}, verbose=False)
+    return drop_flagged(tr_df, audit), drop_flagged(valid_df, audit), drop_flagged(ts_df, audit)
+
+
+def predict_per_image(model, images, rescale):
+    """
+    Class predictions and mean latency of a Keras model at batch size 1.
+
+    Args:
+        model (keras.Model): Model with a fixed input size
+        images (np.ndarray): uint8 images, (N, H, W, 3)
+        rescale (float): Factor the model's inputs are scaled by in training
+
+    Returns:
+        tuple: (predicted class indices, mean seconds per image)
+    """
+    forward = tf.function(lambda x: model(x, training=False))
+    forward(images[:1].astype(np.float32) * rescale)  # warm-up / tracing
+    predictions, elapsed = [], 0.0
+    for image in images:
+        x = image[None].astype(np.float32) * rescale
+        start = time.perf_counter()
+        predictions.append(np.argmax(forward(x).numpy()))
+        elapsed += time.perf_counter() - start
+    return np.asarray(predictions), elapsed / len(images)
+
+
+def count_flops(model, batch_size):
+    """Floating-point operations of one inference forward pass on a batch."""
+    forward = tf.function(lambda x: model(x, training=False))
+    concrete = forward.get_concrete_function(
+        tf.TensorSpec((batch_size,) + tuple(model.input_shape[1:]), tf.float32))
+    graph = convert_variables_to_constants_v2(concrete).graph
+    options = tf.compat.v1.profiler.ProfileOptionBuilder.float_operation()
+    options['output'] = 'none'
+    return tf.compat.v1.profiler.profile(graph, options=options).total_float_ops
+
+
+def recovery_data(data_dir, image_size, batch_size=32, rescale=1 / 255):
+    """
+    Training loader and held-out test arrays for fine-tuning a compressed model.
+
+    Args:
+        data_dir (str): Dataset root with Training/ and Testing/
+        image_size (tuple): (height, width) of the model input
+        batch_size (int): Training batch size
+        rescale (float): Factor the model's inputs are scaled by in training
+
+    Returns:
+        tuple: (repeating, shuffled training dataset, uint8 test images,
+        test class indices)
+    """
+    tr_df, _, ts_df = split_dataset(data_dir)
+    _, class_indices = encode_labels(tr_df['Class'])
+    train = flow_from_split(tr_df, 'train', source='cache', target_size=image_size, shuffle=True,
+                            seed=0, batch_size=batch_size, rescale=rescale,
+                            class_indices=class_indices)
+    test_images = materialize_images(ts_df['Class Path'], image_size, resample=Image.BICUBIC,
+                                     verbose=False)
+    test_labels = np.argmax(encode_labels(ts_df['Class'], class_indices)[0], axis=-1)
+    return train.repeat(), test_images, test_labels
+
+
+def fine_tune(model, train, steps, learning_rate=1e-4):
+    """Recover a compressed model with `steps` Adam steps on hard labels."""
+    tf.keras.utils.set_random_seed(0)
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate), loss='categorical_crossentropy')
+    model.fit(train, steps_per_epoch=steps, epochs=1, verbose=0)
+    return model
+
+
+def score(model, test_images, test_labels, rescale=1 / 255):
+    """Parameters, batch-1 FLOPs and latency, and test accuracy of a model."""
+    predictions, latency = predict_per_image(model, test_images, rescale)
+    return {'params': model.count_params(), 'flops': count_flops(model, 1), 'latency': latency,
+            'accuracy': np.mean(predictions == test_labels)}
+
+
+def print_tradeoff(rows):
+    """
+    Print score() rows against the first one, marking the Pareto-optimal ones.
+
+    A row is Pareto-optimal when no other row is at least as fast and at
+    least as accurate, and strictly better in one of the two.
+
+    Args:
+        rows (list): score() dicts with a 'label' and the saved model 'path'
+    """
+    base = rows[0]
+    for row in rows:
+        optimal = not any(other['latency'] <= row['latency'] and other['accuracy'] >= row['accuracy']
+                          and (other['latency'], other['accuracy']) != (row['latency'], row['accuracy'])
+                          for other in rows)
+        print(f"{'*' if optimal else ' '} {row['label']:<16} "
+              f"{row['params'] / 1e6:7.2f}M params  {row['flops'] / 1e9:7.2f} GFLOPs  "
+              f"{row['latency'] * 1000:7.1f} ms/image ({base['latency'] / row['latency']:4.2f}x)  "
+              f"{row['accuracy']:.4f} accuracy ({row['accuracy'] - base['accuracy']:+.4f})  "
+              f"{row['path']}")
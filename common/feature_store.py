@@ -0,0 +1,302 @@
+# common/feature_store.py
+#
+# Stored outputs of a frozen encoder. While the encoder is not trained its
+# feature maps are a pure function of the image, so they are computed once per
+# image (and per augmentation variant) and the head trains on the stored
+# tensors instead of pushing every batch through the backbone again.
+#
+# Every tapped output is one float16 .npy of shape (N, variants, H, W, C),
+# memory-mapped on load; an .npz index maps the content hash of every image to
+# its row. The store is keyed by encoder name, tapped layers, weights, the
+# layer types of the feature model, input size and augmentation, and
+# rebuilding only runs images whose content hash is not stored yet. The key
+# includes the encoder's compute dtype, so features from a mixed-precision
+# encoder are stored apart from float32 ones.
+#
+# Given a distillation teacher, its class probabilities for every variant are
+# stored as well (float32, (N, variants, classes)). They come from the same
+# augmented images as the features, which can only be reproduced while
+# encoding, so the teacher's weights are part of the key.
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from common.data_pipeline import AUTOTUNE, flow_from_dataframe
+from common.decode import DECODER_VERSION
+from common.distillation import run_teacher
+from common.hashing import build_hash_index
+from common.paths import cache_path, save_npz_atomic
+
+
+class FeatureStore:
+    """Memory-mapped stored feature maps of one split, in DataFrame order."""
+
+    def __init__(self, prefix, num_taps, hashes, paths, labels, class_indices, soft=False):
+        self.prefix = prefix
+        self.tap_paths = [f'{prefix}.tap{i}.npy' for i in range(num_taps)]
+        # Stored teacher probabilities, if built with a teacher
+        self.soft_path = f'{prefix}.soft.npy' if soft else None
+        self.index = {h: row for row, h in enumerate(np.load(prefix + '.index.npz')['hashes'])}
+        self.rows = np.fromiter((self.index[h] for h in hashes), dtype=np.int64, count=len(hashes))
+        self.filenames = list(paths)
+        self.classes = labels
+        self.class_indices = class_indices
+        self._taps = None
+        self._soft = None
+
+    @property
+    def taps(self):
+        # Opened lazily so the object stays cheap to pickle into workers
+        if self._taps is None:
+            self._taps = [np.load(path, mmap_mode='r') for path in self.tap_paths]
+        return self._taps
+
+    @property
+    def soft_targets(self):
+        if self._soft is None and self.soft_path is not None:
+            self._soft = np.load(self.soft_path, mmap_mode='r')
+        return self._soft
+
+    @property
+    def variants(self):
+        return self.taps[0].shape[1]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_taps'] = None
+        state['_soft'] = None
+        return state
+
+
+def _weights_digest(model):
+    digest = hashlib.sha1()
+    for weight in model.weights:
+        digest.update(np.ascontiguousarray(weight.numpy()).tobytes())
+    return digest.hexdigest()
+
+
+def _augmentation_key(augmentation):
+    if augmentation is None:
+        return None
+    return {key: repr(value) for key, value in sorted(vars(augmentation).items())
+            if not key.startswith('_')}
+
+
+def build_feature_store(features, df, split, encoder_name, layers, augmentation=None,
+                        variants=1, batch_size=32, rescale=1 / 255, x_col='Class Path',
+                        y_col='Class', class_indices=None, teacher=None, verbose=True):
+    """
+    Run a frozen feature model once per image and variant and store its outputs.
+
+    Args:
+        features (keras.Model): Frozen model from images to the tapped
+            feature maps the head consumes
+        df (pd.DataFrame): DataFrame of the split
+        split (str): Split name, e.g. 'train' or 'valid'
+        encoder_name (str): Encoder the features come from, part of the key
+        layers (Sequence[str | int]): Tapped encoder layers, part of the key
+        augmentation (BatchAugmentation): Augmentation applied before the
+            encoder; None stores the plain images
+        variants (int): Augmented copies stored per image; ignored (1) when
+            augmentation is None
+        batch_size (int): Images per encoder call
+        rescale (float): Factor applied to pixel values after augmentation
+        x_col (str): Column holding the image paths
+        y_col (str): Column holding the class names
+        class_indices (dict): Class name to index mapping, inferred if None
+        teacher (keras.Model): Distillation teacher (common.distillation.
+            load_teacher) whose probabilities are stored for every variant
+        verbose (bool): Print how many images had to be encoded
+
+    Returns:
+        FeatureStore: Stored features with rows in DataFrame order
+    """
+    start = time.perf_counter()
+    variants = variants if augmentation is not None else 1
+    input_shape = tuple(features.input_shape[1:])
+    class_indices = class_indices or {name: i for i, name in enumerate(sorted(df[y_col].unique()))}
+    labels = df[y_col].map(class_indices).to_numpy(dtype=np.int32)
+
+    key = json.dumps({'encoder': encoder_name, 'layers': [str(layer) for layer in layers],
+                      'input': input_shape, 'rescale': rescale, 'variants': variants,
+                      'dtype': features.compute_dtype, 'decoder': DECODER_VERSION,
+                      'graph': [type(layer).__name__ for layer in features.layers],
+                      'augmentation': _augmentation_key(augmentation),
+                      'weights': _weights_digest(features),
+                      **({'teacher': [_weights_digest(teacher),
+                                      [type(layer).__name__ for layer in teacher.layers]]}
+                         if teacher is not None else {})}, sort_keys=True)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+    prefix = cache_path('features', f'{encoder_name}-{split}-{digest}', '')
+    index_path = prefix + '.index.npz'
+    num_taps = len(features.outputs)
+    soft = teacher is not None
+
+    hashes = build_hash_index(df[x_col], verbose=False)['SHA1'].to_numpy(dtype=str)
+    stored = []
+    if os.path.exists(index_path):
+        with np.load(index_path) as index:
+            stored = [str(h) for h in index['hashes']]
+    stored_rows = {h: row for row, h in enumerate(stored)}
+    unique = list(dict.fromkeys(hashes))
+    if all(h in stored_rows for h in unique) and len(stored_rows) == len(unique):
+        if verbose:
+            print(f'Feature store {encoder_name}/{split}: {len(unique)} images up to date')
+        return FeatureStore(prefix, num_taps, hashes, df[x_col], labels, class_indices, soft)
+
+    # Rows are unique images; duplicated files share one row
+    todo = [h for h in unique if h not in stored_rows]
+    by_hash = df.assign(_hash=hashes).drop_duplicates('_hash').set_index('_hash')
+
+    # The tapped maps, then the teacher probabilities if there is a teacher
+    paths = [f'{prefix}.tap{i}.npy' for i in range(num_taps)]
+    shapes = [tuple(output.shape[1:]) for output in features.outputs]
+    dtypes = [np.float16] * num_taps
+    if soft:
+        paths.append(f'{prefix}.soft.npy')
+        shapes.append(tuple(teacher.output_shape[1:]))
+        dtypes.append(np.float32)
+    tmp_paths = [f'{path[:-len(".npy")]}.{os.getpid()}.tmp.npy' for path in paths]
+    outs = [np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype,
+                                      shape=(len(unique), variants) + shape)
+            for tmp_path, dtype, shape in zip(tmp_paths, dtypes, shapes)]
+
+    new_rows = {h: row for row, h in enumerate(unique)}
+    keep = [h for h in unique if h in stored_rows]
+    if keep:
+        old = [np.load(path, mmap_mode='r') for path in paths]
+        dst = np.asarray([new_rows[h] for h in keep])
+        src = np.asarray([stored_rows[h] for h in keep])
+        # Copy in chunks so a large store is never fully resident
+        for chunk in np.array_split(np.arange(len(keep)), max(1, len(keep) // 256)):
+            for out, tap in zip(outs, old):
+                out[dst[chunk]] = tap[src[chunk]]
+        del old
+
+    if todo:
+        # Single-output models return a tensor, not a one-element list
+        extract = tf.function(lambda x: tf.nest.flatten(features(x, training=False))
+                              + ([run_teacher(teacher, x)] if soft else []))
+        images = flow_from_dataframe(by_hash.loc[todo].reset_index(drop=True), x_col=x_col,
+                                     y_col=y_col, batch_size=batch_size, target_size=input_shape[:2],
+                                     shuffle=False, rescale=1.0, class_indices=class_indices)
+        row = 0
+        for step, (batch, _) in enumerate(images):
+            rows = [new_rows[h] for h in todo[row:row + len(batch)]]
+            for variant in range(variants):
+                x = batch
+                if augmentation is not None:
+                    x = augmentation(x, seed=tf.constant([variant, step], dtype=tf.int64))
+                for out, tap in zip(outs, extract(x * rescale)):
+                    out[rows, variant] = tap.numpy().astype(out.dtype)
+            row += len(batch)
+            if verbose:
+                print(f'\r  encoded {row}/{len(todo)} images', end='', flush=True)
+        if verbose:
+            print()
+
+    for out, tmp_path, path in zip(outs, tmp_paths, paths):
+        out.flush()
+        os.replace(tmp_path, path)
+    del outs
+    save_npz_atomic(index_path, hashes=np.asarray(unique, dtype=str),
+                    paths=by_hash.loc[unique, x_col].to_numpy(dtype=str))
+    if verbose:
+        print(f'Feature store {encoder_name}/{split}: encoded {len(todo)}/{len(unique)} images '
+              f'x {variants} variants in {time.perf_counter() - start:.1f}s')
+    return FeatureStore(prefix, num_taps, hashes, df[x_col], labels, class_indices, soft)
+
+
+def flow_from_feature_store(store, batch_size=32, shuffle=True, seed=None, soft_targets=False):
+    """
+    Batch stored feature maps as head inputs.
+
+    Each epoch reads one randomly chosen stored variant per image when
+    shuffling, and always the first variant otherwise.
+
+    Args:
+        store (FeatureStore): Output of build_feature_store
+        batch_size (int): Samples per batch
+        shuffle (bool): Reshuffle every epoch
+        seed (int): Shuffle and variant seed
+        soft_targets (bool): Also read the teacher probabilities stored with
+            each variant (build_feature_store(teacher=...))
+
+    Returns:
+        tf.data.Dataset: Dataset of (tuple of float32 feature maps, one-hot
+        labels) batches with `class_indices`, `classes`, `samples` and
+        `filenames` attributes. With soft_targets the inputs are
+        {'inputs': feature maps, 'soft_targets': probabilities}, as a
+        common.distillation.Distiller expects
+    """
+    if soft_targets and store.soft_targets is None:
+        raise ValueError('The feature store was built without a teacher; '
+                         'pass build_feature_store(teacher=...)')
+    taps = store.taps
+    # The teacher probabilities are read like one more tap, of the same variant
+    arrays = taps + ([store.soft_targets] if soft_targets else [])
+    variants = store.variants
+    num_classes = len(store.class_indices)
+
+    def read_batch(rows, picks):
+        # One fancy-indexed read per array and batch
+        return tuple(array[rows, picks].astype(np.float32) for array in arrays)
+
+    def read(rows, picks, labels):
+        read_arrays = tf.numpy_function(read_batch, [rows, picks], [tf.float32] * len(arrays),
+                                        stateful=False)
+        for tensor, array in zip(read_arrays, arrays):
+            tensor.set_shape((None,) + array.shape[2:])
+        maps = tuple(read_arrays[:len(taps)])
+        inputs = {'inputs': maps, 'soft_targets': read_arrays[-1]} if soft_targets else maps
+        return inputs, tf.one_hot(labels, num_classes)
+
+    columns = (store.rows, store.classes)
+    ds = tf.data.Dataset.from_tensor_slices(columns)
+    if shuffle:
+        ds = ds.shuffle(len(store), seed=seed, reshuffle_each_iteration=True)
+        picks = tf.data.Dataset.random(seed=seed, rerandomize_each_iteration=True).map(
+            lambda r: r % variants)
+    else:
+        picks = tf.data.Dataset.from_tensors(tf.constant(0, tf.int64)).repeat()
+    ds = tf.data.Dataset.zip((ds, picks)).map(lambda sample, pick: (sample[0], pick, sample[1]))
+    ds = ds.batch(batch_size).map(read, num_parallel_calls=AUTOTUNE, deterministic=True)
+    ds = ds.prefetch(AUTOTUNE)
+
+    ds.class_indices = dict(store.class_indices)
+    ds.classes = store.classes
+    ds.samples = len(store)
+    ds.filenames = store.filenames
+    ds.batch_size = batch_size
+    return ds
+
+
+class FullModelCheckpoint(tf.keras.callbacks.ModelCheckpoint):
+    """
+    ModelCheckpoint that writes the full image model while its head is fitted.
+
+    The head trained on stored features shares its weights with the full
+    model, so saving the latter on improvement gives an ordinary image-input
+    checkpoint that the tools and a distillation teacher can load.
+
+    Args:
+        model (tf.keras.Model): Model to save, whatever model is being fitted
+        filepath (str): As for ModelCheckpoint
+        **kwargs: Forwarded to ModelCheckpoint
+    """
+
+    def __init__(self, model, filepath, **kwargs):
+        super().__init__(filepath, **kwargs)
+        self.saved_model = model
+
+    def set_model(self, model):
+        # fit() hands over the fitted model; monitoring only reads the logs
+        super().set_model(self.saved_model)
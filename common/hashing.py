@@ -0,0 +1,245 @@
+# common/hashing.py
+#
+# Content-hash index for dataset auditing. Every file gets a SHA-1 of its
+# bytes and a 64-bit difference hash (dHash) of its 9x8 grayscale thumbnail;
+# files that cannot be read or that PIL cannot fully decode are recorded as
+# corrupt instead. Hashes are computed by a process pool and stored keyed by
+# path, size and mtime, so a rerun only hashes new or changed files.
+# audit_splits() then reports corrupt files, duplicates inside a split and
+# images leaked across splits.
+
+import hashlib
+import multiprocessing as mp
+import time
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from common.manifest import file_stats
+from common.materialize import default_workers
+from common.paths import cache_path, save_npz_atomic
+
+
+# Bump when the hash definition changes, so stored hashes are recomputed
+HASH_VERSION = 1
+
+
+def _hash_file(path):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        # Unreadable files are findings too, not a reason to abort the audit
+        return '', 0, f'{type(e).__name__}: {e}'
+    sha1 = hashlib.sha1(data).hexdigest()
+    try:
+        with Image.open(path) as img:
+            # A reduced DCT scale still entropy-decodes the whole file, so
+            # truncated or damaged JPEGs fail here like a full decode would
+            img.draft('L', (64, 64))
+            thumb = np.asarray(img.convert('L').resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    except Exception as e:
+        return sha1, 0, f'{type(e).__name__}: {e}'
+    bits = (thumb[:, 1:] > thumb[:, :-1]).ravel()
+    return sha1, int(np.packbits(bits).view('>u8')[0]), ''
+
+
+def _load_store(store_path):
+    try:
+        with np.load(store_path) as store:
+            if int(store['version']) != HASH_VERSION:
+                return {}
+            return {str(path): (int(size), int(mtime), str(sha1), int(dhash), str(error))
+                    for path, size, mtime, sha1, dhash, error in zip(
+                        store['paths'], store['sizes'], store['mtimes'], store['sha1'],
+                        store['dhash'], store['errors'])}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def build_hash_index(paths, workers=None, verbose=True):
+    """
+    Hash image files, reusing stored hashes of files that did not change.
+
+    Args:
+        paths (Iterable[str]): Image paths as they appear in 'Class Path'
+        workers (int): Hashing processes, defaults to the available cores
+        verbose (bool): Print how many files had to be hashed
+
+    Returns:
+        pd.DataFrame: Columns 'Path', 'SHA1', 'DHash' (uint64) and 'Error'
+            (empty unless the file could not be read or decoded), in input order
+    """
+    start = time.perf_counter()
+    paths = np.asarray(list(paths), dtype=str)
+    sizes, mtimes = file_stats(paths)
+    store_path = cache_path('hashes', 'content', '.npz')
+    store = _load_store(store_path)
+
+    stale = [i for i, (path, size, mtime) in enumerate(zip(paths, sizes, mtimes))
+             if store.get(path, (None, None))[:2] != (size, mtime)]
+    unreadable = {}
+    if stale:
+        todo = paths[stale].tolist()
+        workers = min(workers or default_workers(), len(todo))
+        if workers > 1:
+            with mp.get_context('fork').Pool(workers) as pool:
+                hashed = pool.map(_hash_file, todo, chunksize=max(1, len(todo) // (workers * 8)))
+        else:
+            hashed = [_hash_file(path) for path in todo]
+        for i, result in zip(stale, hashed):
+            if result[0]:
+                store[paths[i]] = (int(sizes[i]), int(mtimes[i])) + result
+            else:
+                # Read failures are not stored, so the next run retries them
+                unreadable[paths[i]] = (int(sizes[i]), int(mtimes[i])) + result
+
+        # The store covers every file ever hashed, not just this call's paths
+        keys = list(store)
+        columns = list(zip(*store.values()))
+        save_npz_atomic(store_path,
+                        version=np.int64(HASH_VERSION),
+                        paths=np.asarray(keys, dtype=str),
+                        sizes=np.asarray(columns[0], dtype=np.int64),
+                        mtimes=np.asarray(columns[1], dtype=np.int64),
+                        sha1=np.asarray(columns[2], dtype=str),
+                        dhash=np.asarray(columns[3], dtype=np.uint64),
+                        errors=np.asarray(columns[4], dtype=str))
+
+    rows = [unreadable.get(path) or store[path] for path in paths]
+    index = pd.DataFrame({
+        'Path': paths,
+        'SHA1': [row[2] for row in rows],
+        'DHash': np.asarray([row[3] for row in rows], dtype=np.uint64),
+        'Error': [row[4] for row in rows],
+    })
+    if verbose:
+        print(f'Hash index: {len(paths)} files, hashed {len(stale)} in {time.perf_counter() - start:.2f}s')
+    return index
+
+
+# Set bits of every byte value
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+# Most hash comparisons held in memory at once by _near_pairs
+_COMPARE_CHUNK = 1 << 20
+
+
+def _hamming(a, b):
+    # Elementwise, with broadcasting
+    x = np.ascontiguousarray(np.bitwise_xor(a, b))
+    return _POPCOUNT[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1, dtype=np.int64)
+
+
+def _near_pairs(dhash, max_distance):
+    # Repeats of a hash are paired with its first image only, as exact copies
+    # are in audit_splits, so near-constant scans sharing one hash stay linear
+    values, first, inverse = np.unique(dhash, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    repeats = np.flatnonzero(first[inverse] != np.arange(len(dhash)))
+    pairs = set(zip(first[inverse[repeats]].tolist(), repeats.tolist()))
+
+    # Pigeonhole: hashes within max_distance bits agree exactly on at least one
+    # of max_distance + 1 bands, so only distinct hashes sharing a band are
+    # compared, a block of rows of a band group at a time so that memory stays
+    # bounded however many share it
+    n_bands = max_distance + 1
+    band_bits = 64 // n_bands
+    for band in range(n_bands):
+        keys = (values >> np.uint64(band * band_bits)) & np.uint64((1 << band_bits) - 1)
+        order = np.argsort(keys, kind='stable')
+        bounds = np.flatnonzero(np.diff(keys[order])) + 1
+        for group in np.split(order, bounds):
+            if len(group) < 2:
+                continue
+            rows = max(1, _COMPARE_CHUNK // len(group))
+            for start in range(0, len(group) - 1, rows):
+                left, right = group[start:start + rows], group[start + 1:]
+                distance = _hamming(values[left][:, None], values[right][None, :])
+                upper = np.arange(len(right))[None, :] >= np.arange(len(left))[:, None]
+                i, j = np.nonzero((distance <= max_distance) & upper)
+                a, b = first[left[i]], first[right[j]]
+                pairs.update(zip(np.minimum(a, b).tolist(), np.maximum(a, b).tolist()))
+    return sorted(pairs)
+
+
+def audit_splits(splits, x_col='Class Path', max_distance=3, workers=None, verbose=True):
+    """
+    Flag corrupt files, duplicates and cross-split leakage before training.
+
+    Args:
+        splits (dict): Split name to DataFrame, e.g. {'train': tr_df, 'test': ts_df}
+        x_col (str): Column holding the image paths
+        max_distance (int): Most differing dHash bits for a near-duplicate;
+            0 only reports exact duplicates
+        workers (int): Hashing processes, defaults to the available cores
+        verbose (bool): Print a summary per finding kind
+
+    Returns:
+        pd.DataFrame: One row per finding with columns 'Kind' ('corrupt',
+            'duplicate', 'near-duplicate' or 'leak'), 'Split', 'Path',
+            'Other Split', 'Other Path' and 'Distance'
+    """
+    names = [name for name, df in splits.items() for _ in range(len(df))]
+    paths = [path for df in splits.values() for path in df[x_col]]
+    index = build_hash_index(paths, workers=workers, verbose=verbose)
+    index['Split'] = names
+
+    findings = [('corrupt', split, path, '', '', -1)
+                for split, path in index.loc[index['Error'] != '', ['Split', 'Path']].itertuples(index=False)]
+
+    valid = index[index['Error'] == ''].reset_index(drop=True)
+    pairs = {}
+    # Exact copies: every file against the first one with the same bytes
+    for _, group in valid.groupby('SHA1', sort=False):
+        first = group.index[0]
+        for other in group.index[1:]:
+            pairs[(first, other)] = 0
+    if max_distance > 0:
+        dhash = valid['DHash'].to_numpy()
+        for i, j in _near_pairs(dhash, max_distance):
+            if valid.at[i, 'SHA1'] != valid.at[j, 'SHA1']:
+                pairs[(i, j)] = int(_hamming(dhash[i:i + 1], dhash[j:j + 1])[0])
+
+    for (i, j), distance in sorted(pairs.items()):
+        a, b = valid.loc[i], valid.loc[j]
+        if a['Split'] != b['Split']:
+            kind = 'leak'
+        else:
+            # Duplicates have identical bytes; an equal dHash alone is near
+            kind = 'duplicate' if a['SHA1'] == b['SHA1'] else 'near-duplicate'
+        findings.append((kind, a['Split'], a['Path'], b['Split'], b['Path'], distance))
+
+    report = pd.DataFrame(findings, columns=['Kind', 'Split', 'Path', 'Other Split',
+                                             'Other Path', 'Distance'])
+    if verbose:
+        counts = report['Kind'].value_counts()
+        print('Dataset audit: ' + ', '.join(f'{counts.get(kind, 0)} {kind}' for kind in
+                                            ('corrupt', 'duplicate', 'near-duplicate', 'leak')))
+        for (split, other), group in report[report['Kind'] == 'leak'].groupby(['Split', 'Other Split']):
+            print(f'  {len(group)} images of {split} also appear in {other}')
+    return report
+
+
+def drop_flagged(df, report, kinds=('corrupt',), x_col='Class Path'):
+    """
+    Remove images flagged by audit_splits() from a split's DataFrame.
+
+    For pair findings the second image ('Other Path') is dropped, so one copy
+    of every duplicate survives; pass kinds=('corrupt', 'leak') to also drop
+    the later-split side of every leaked pair.
+
+    Args:
+        df (pd.DataFrame): DataFrame of the split
+        report (pd.DataFrame): Result of audit_splits()
+        kinds (tuple): Finding kinds to act on
+        x_col (str): Column holding the image paths
+
+    Returns:
+        pd.DataFrame: df without the flagged rows
+    """
+    flagged = report[report['Kind'].isin(kinds)]
+    drop = set(flagged.loc[flagged['Kind'] == 'corrupt', 'Path'])
+    drop.update(flagged.loc[flagged['Kind'] != 'corrupt', 'Other Path'])
+    return df[~df[x_col].isin(drop)]
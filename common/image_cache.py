@@ -0,0 +1,121 @@
+# common/image_cache.py
+#
+# Pre-decoded, pre-resized uint8 image cache. Every split/resolution pair is
+# stored as one (N, H, W, 3) uint8 .npy file that is memory-mapped on load,
+# plus an .npz index with the source path, size and mtime of every row.
+# Rebuilding stats the source files, compares them with the index and only
+# decodes rows whose source file is new or changed.
+
+import os
+import shutil
+import time
+
+import numpy as np
+
+from common.decode import DECODER_VERSION
+from common.manifest import file_stats
+from common.materialize import decode_into
+from common.paths import cache_path, save_npz_atomic
+
+
+class ImageCache:
+    """Memory-mapped uint8 images plus a path -> row index."""
+
+    def __init__(self, images_path, paths):
+        self.images_path = images_path
+        self.paths = np.asarray(paths, dtype=str)
+        self.index = {path: row for row, path in enumerate(self.paths)}
+        self._images = None
+
+    @property
+    def images(self):
+        # Opened lazily so the object stays cheap to pickle into workers
+        if self._images is None:
+            self._images = np.load(self.images_path, mmap_mode='r')
+        return self._images
+
+    def __len__(self):
+        return len(self.paths)
+
+    def rows(self, paths):
+        """Return the cache rows holding the given image paths."""
+        return np.fromiter((self.index[p] for p in paths), dtype=np.int64, count=len(paths))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_images'] = None
+        return state
+
+
+def build_image_cache(df, split, image_size, x_col='Class Path', verbose=True):
+    """
+    Create or refresh the uint8 cache for one split at one resolution.
+
+    Args:
+        df (pd.DataFrame): DataFrame of the split
+        split (str): Split name, e.g. 'train', 'valid' or 'test'
+        image_size (tuple): (height, width) the images are resized to
+        x_col (str): Column holding the image paths
+        verbose (bool): Print how many rows had to be decoded
+
+    Returns:
+        ImageCache: Cache whose rows follow the DataFrame order
+    """
+    start = time.perf_counter()
+    height, width = image_size
+    key = f'{split}-{height}x{width}'
+    images_path = cache_path('images', key, '.npy')
+    index_path = cache_path('images', key, '.index.npz')
+
+    paths = df[x_col].to_numpy(dtype=str)
+    sizes, mtimes = file_stats(paths)
+    shape = (len(paths), height, width, 3)
+
+    old_rows = {}
+    if os.path.exists(index_path) and os.path.exists(images_path):
+        with np.load(index_path) as index:
+            decoder = int(index['decoder']) if 'decoder' in index.files else 1
+            rows = zip(index['paths'], index['sizes'], index['mtimes']) if decoder == DECODER_VERSION else []
+            for row, (path, size, mtime) in enumerate(rows):
+                old_rows[str(path)] = (row, int(size), int(mtime))
+
+    reuse = np.full(len(paths), -1, dtype=np.int64)
+    for i, (path, size, mtime) in enumerate(zip(paths, sizes, mtimes)):
+        old = old_rows.get(path)
+        if old is not None and old[1] == size and old[2] == mtime:
+            reuse[i] = old[0]
+    stale = np.flatnonzero(reuse < 0)
+
+    same_layout = (len(old_rows) == len(paths)
+                   and np.array_equal(reuse[reuse >= 0], np.flatnonzero(reuse >= 0)))
+    if len(stale) == 0 and same_layout:
+        if verbose:
+            print(f'Image cache {key}: {len(paths)} rows up to date ({time.perf_counter() - start:.3f}s)')
+        return ImageCache(images_path, paths)
+
+    # Built in a temporary file and renamed into place, so a process reading
+    # the live cache keeps its consistent (old) mapping
+    tmp_path = f'{images_path}.{os.getpid()}.tmp.npy'
+    if same_layout:
+        # Same rows in the same order: patch the changed rows of a copy
+        shutil.copyfile(images_path, tmp_path)
+    else:
+        images = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=shape)
+        if old_rows and (reuse >= 0).any():
+            old_images = np.load(images_path, mmap_mode='r')
+            keep = np.flatnonzero(reuse >= 0)
+            # Copy in chunks so a large cache is never fully resident
+            for chunk in np.array_split(keep, max(1, len(keep) // 1024)):
+                images[chunk] = old_images[reuse[chunk]]
+            del old_images
+        images.flush()
+        del images
+    decode_into(paths[stale], image_size, tmp_path, rows=stale, verbose=verbose)
+    os.replace(tmp_path, images_path)
+
+    save_npz_atomic(index_path, paths=paths, sizes=sizes, mtimes=mtimes,
+                    decoder=np.int64(DECODER_VERSION))
+    if verbose:
+        print(f'Image cache {key}: decoded {len(stale)}/{len(paths)} rows '
+              f'in {time.perf_counter() - start:.1f}s')
+    return ImageCache(images_path, paths)
@@ -0,0 +1,143 @@
+# common/layers.py
+#
+# Factorized stand-ins for the full 3x3 convs of the attention blocks, which
+# dominate the head's compute on CPU:
+#   'spatial'   a kx1 conv to `rank` channels, then a 1xk conv (Jaderberg et
+#               al.'s separable low-rank filters); rank filters // 2 costs a
+#               third of the full conv when its input is as wide as its output
+#   'depthwise' a kxk depthwise conv with depth multiplier `rank`, then a 1x1
+#               conv (depthwise-separable)
+# Either factorization can be trained from scratch or set from a trained full
+# kernel by truncated SVD (FactorizedConv2D.load_kernel, used by
+# tools/factorize.py). The layer is registered here once and shared by both
+# families of AS_Net blocks (common/asnet.py, common/asnet_vgg16.py).
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Conv2D, DepthwiseConv2D, Layer
+
+FACTORIZATIONS = ('spatial', 'depthwise')
+
+
+def factorize_kernel(kernel, factorization, rank):
+    """
+    Truncated-SVD factors of a full conv kernel.
+
+    'spatial' factors the (k*Cin, k*Cout) matrix of the kernel's row and
+    column taps; 'depthwise' factors each input channel's (k*k, Cout) slice.
+    Both are exact at full rank.
+
+    Args:
+        kernel (np.ndarray): (k, k, Cin, Cout) kernel
+        factorization (str): One of FACTORIZATIONS
+        rank (int): Intermediate channels ('spatial') or depth multiplier
+            ('depthwise'); components past the kernel's rank are zero
+
+    Returns:
+        tuple: (first kernel, second kernel) of FactorizedConv2D
+    """
+    k, _, cin, cout = kernel.shape
+    if factorization == 'spatial':
+        # kernel[h, w, c, o] as a matrix over (h, c) x (w, o)
+        matrix = kernel.transpose(0, 2, 1, 3).reshape(k * cin, k * cout)
+        u, s, vt = np.linalg.svd(matrix, full_matrices=False)
+    elif factorization == 'depthwise':
+        # One (k*k, Cout) matrix per input channel
+        matrix = kernel.transpose(2, 0, 1, 3).reshape(cin, k * k, cout)
+        u, s, vt = np.linalg.svd(matrix, full_matrices=False)
+    else:
+        raise ValueError(f'Unknown factorization {factorization!r}; expected one of {FACTORIZATIONS}')
+
+    kept = min(rank, s.shape[-1])
+    root = np.sqrt(s[..., :kept])
+    left = np.zeros(u.shape[:-1] + (rank,), np.float32)
+    right = np.zeros(vt.shape[:-2] + (rank, vt.shape[-1]), np.float32)
+    left[..., :kept] = u[..., :kept] * root[..., None, :]
+    right[..., :kept, :] = root[..., :, None] * vt[..., :kept, :]
+
+    if factorization == 'spatial':
+        first = left.reshape(k, cin, rank)[:, None]                       # (k, 1, Cin, R)
+        second = right.reshape(rank, k, cout).transpose(1, 0, 2)[None]   # (1, k, R, Cout)
+    else:
+        first = left.reshape(cin, k, k, rank).transpose(1, 2, 0, 3)      # (k, k, Cin, R)
+        # Depthwise output channel c * R + r
+        second = right.reshape(cin * rank, cout)[None, None]             # (1, 1, Cin*R, Cout)
+    return first, second
+
+
+@tf.keras.utils.register_keras_serializable(package='AS_Net')
+class FactorizedConv2D(Layer):
+    """Low-rank or depthwise-separable replacement of a 'same'-padded Conv2D."""
+
+    def __init__(self, filters, kernel_size=3, factorization='spatial', rank=None,
+                 activation=None, use_bias=True, kernel_initializer='he_normal', **kwargs):
+        super(FactorizedConv2D, self).__init__(**kwargs)
+        if factorization not in FACTORIZATIONS:
+            raise ValueError(f'Unknown factorization {factorization!r}; expected one of {FACTORIZATIONS}')
+        self.filters = filters
+        self.kernel_size = kernel_size
+        self.factorization = factorization
+        self.rank = rank or (max(1, filters // 2) if factorization == 'spatial' else 1)
+        self.activation = activation
+        self.use_bias = use_bias
+        self.kernel_initializer = kernel_initializer
+        if factorization == 'spatial':
+            self.first = Conv2D(self.rank, (kernel_size, 1), padding='same', use_bias=False,
+                                kernel_initializer=kernel_initializer)
+            self.second = Conv2D(filters, (1, kernel_size), padding='same', activation=activation,
+                                 use_bias=use_bias, kernel_initializer=kernel_initializer)
+        else:
+            self.first = DepthwiseConv2D(kernel_size, padding='same', depth_multiplier=self.rank,
+                                         use_bias=False, depthwise_initializer=kernel_initializer)
+            self.second = Conv2D(filters, 1, activation=activation, use_bias=use_bias,
+                                 kernel_initializer=kernel_initializer)
+
+    def build(self, input_shape):
+        self.first.build(input_shape)
+        channels = self.rank if self.factorization == 'spatial' else input_shape[-1] * self.rank
+        self.second.build(tuple(input_shape[:-1]) + (channels,))
+        super(FactorizedConv2D, self).build(input_shape)
+
+    def call(self, inputs):
+        return self.second(self.first(inputs))
+
+    def load_kernel(self, kernel, bias=None):
+        """Set the factors from a trained full (k, k, Cin, filters) kernel and its bias."""
+        first, second = factorize_kernel(np.asarray(kernel, np.float32), self.factorization, self.rank)
+        self.first.kernel.assign(first)
+        self.second.kernel.assign(second)
+        if bias is not None:
+            self.second.bias.assign(bias)
+
+    def compute_output_shape(self, input_shape):
+        return tuple(input_shape[:-1]) + (self.filters,)
+
+    def get_config(self):
+        config = super(FactorizedConv2D, self).get_config()
+        config.update({'filters': self.filters, 'kernel_size': self.kernel_size,
+                       'factorization': self.factorization, 'rank': self.rank,
+                       'activation': self.activation, 'use_bias': self.use_bias,
+                       'kernel_initializer': self.kernel_initializer})
+        return config
+
+
+def factorizable_conv(filters, kernel_size, factorization=None, rank=None, **kwargs):
+    """
+    A 'same'-padded Conv2D, or its FactorizedConv2D replacement.
+
+    With factorization=None this is exactly the Conv2D the blocks used
+    before, so existing checkpoints keep loading.
+
+    Args:
+        filters (int): Output channels
+        kernel_size (int): Square kernel size
+        factorization (str): None or one of FACTORIZATIONS
+        rank (int): See FactorizedConv2D; None picks its default
+        **kwargs: activation, use_bias and kernel_initializer of the conv
+
+    Returns:
+        keras.layers.Layer: Conv2D or FactorizedConv2D
+    """
+    if factorization is None:
+        return Conv2D(filters, kernel_size, padding='same', **kwargs)
+    return FactorizedConv2D(filters, kernel_size, factorization, rank, **kwargs)
@@ -0,0 +1,166 @@
+# common/manifest.py
+#
+# Persistent dataset manifest. The first run walks `<root>/<class>/<image>`
+# with os.scandir (one thread per class directory) and stores path, class,
+# size and mtime as flat numpy columns. Later runs only stat the class
+# directories and rescan the ones whose mtime changed, i.e. where files were
+# added, removed or renamed. Files rewritten in place do not touch the
+# directory mtime; pass verify_files=True to re-stat everything.
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from common.paths import cache_path, save_npz_atomic
+
+
+MANIFEST_VERSION = 1
+
+# Manifests loaded in this process, keyed by absolute root. file_stats() can
+# read sizes and mtimes from them instead of re-stat'ing.
+_LOADED = {}
+
+
+def _scan_class_dir(path):
+    names, sizes, mtimes = [], [], []
+    with os.scandir(path) as it:
+        for entry in it:
+            if not entry.is_file():
+                continue
+            st = entry.stat()
+            names.append(entry.name)
+            sizes.append(st.st_size)
+            mtimes.append(st.st_mtime_ns)
+    order = np.argsort(names) if names else np.zeros(0, dtype=np.int64)
+    return (np.asarray(names, dtype=str)[order],
+            np.asarray(sizes, dtype=np.int64)[order],
+            np.asarray(mtimes, dtype=np.int64)[order])
+
+
+def _read_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with np.load(manifest_path) as data:
+            if int(data['version']) != MANIFEST_VERSION:
+                return None
+            return {key: data[key] for key in data.files}
+    except (OSError, ValueError, KeyError):
+        # A truncated or foreign file is treated as a cold start
+        return None
+
+
+def build_manifest(root, manifest_path=None, workers=None, verify_files=False, verbose=True):
+    """
+    Create or incrementally refresh the manifest of a dataset directory.
+
+    Args:
+        root (str): Dataset directory containing one sub-directory per class
+        manifest_path (str): Where to store the manifest (defaults to CACHE_DIR)
+        workers (int): Threads used to scan class directories
+        verify_files (bool): Rescan every class directory, catching files
+            that were rewritten in place
+        verbose (bool): Print how many directories had to be rescanned
+
+    Returns:
+        pd.DataFrame: Columns 'Class Path', 'Class', 'Size' and 'Mtime'
+    """
+    start = time.perf_counter()
+    manifest_path = manifest_path or cache_path('manifest', root, '.npz')
+    previous = _read_manifest(manifest_path)
+
+    with os.scandir(root) as it:
+        class_dirs = sorted((entry.name, entry.stat().st_mtime_ns)
+                            for entry in it if entry.is_dir())
+
+    cached = {}
+    if previous is not None:
+        for i, (label, dir_mtime) in enumerate(zip(previous['classes'], previous['dir_mtimes'])):
+            rows = previous['class_ids'] == i
+            cached[str(label)] = (int(dir_mtime), previous['files'][rows],
+                                  previous['sizes'][rows], previous['mtimes'][rows])
+
+    stale = [label for label, dir_mtime in class_dirs
+             if verify_files or label not in cached or cached[label][0] != dir_mtime]
+    if stale:
+        with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+            scanned = pool.map(_scan_class_dir, [os.path.join(root, label) for label in stale])
+            for label, columns in zip(stale, scanned):
+                cached[label] = (None,) + columns
+
+    classes = np.asarray([label for label, _ in class_dirs], dtype=str)
+    columns = [cached[label][1:] for label, _ in class_dirs]
+    files = np.concatenate([c[0] for c in columns]) if columns else np.zeros(0, dtype=str)
+    sizes = np.concatenate([c[1] for c in columns]) if columns else np.zeros(0, dtype=np.int64)
+    mtimes = np.concatenate([c[2] for c in columns]) if columns else np.zeros(0, dtype=np.int64)
+    class_ids = np.repeat(np.arange(len(classes), dtype=np.int32), [len(c[0]) for c in columns])
+
+    if stale or previous is None or len(previous['classes']) != len(classes):
+        save_npz_atomic(manifest_path,
+                        version=np.int64(MANIFEST_VERSION),
+                        classes=classes,
+                        dir_mtimes=np.asarray([m for _, m in class_dirs], dtype=np.int64),
+                        files=files,
+                        class_ids=class_ids,
+                        sizes=sizes,
+                        mtimes=mtimes)
+
+    manifest = pd.DataFrame({
+        'Class Path': [os.path.join(root, classes[c], f) for c, f in zip(class_ids, files)],
+        'Class': classes[class_ids],
+        'Size': sizes,
+        'Mtime': mtimes,
+    })
+    _LOADED[os.path.abspath(root)] = manifest
+
+    if verbose:
+        print(f'Manifest {root}: {len(manifest)} files, rescanned {len(stale)}/{len(class_dirs)} '
+              f'class directories in {time.perf_counter() - start:.3f}s')
+    return manifest
+
+
+def load_dataset_df(root, **kwargs):
+    """
+    Drop-in replacement for the os.listdir walk in the training scripts.
+
+    Args:
+        root (str): Path to the dataset directory
+
+    Returns:
+        pd.DataFrame: DataFrame with columns 'Class Path' and 'Class'
+    """
+    return build_manifest(root, **kwargs)[['Class Path', 'Class']].copy()
+
+
+def file_stats(paths, verify_files=True):
+    """
+    Size and mtime of image paths, for caches to find changed source files.
+
+    Args:
+        paths (Iterable[str]): Image paths as they appear in 'Class Path'
+        verify_files (bool): stat every path. False reads the manifests
+            built in this process instead, which is faster but misses files
+            rewritten in place (see build_manifest); only paths they do not
+            cover are stat'ed then
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: int64 sizes and mtimes (ns)
+    """
+    paths = list(paths)
+    known = {}
+    for manifest in () if verify_files else _LOADED.values():
+        known.update(zip(manifest['Class Path'],
+                         zip(manifest['Size'].to_numpy(), manifest['Mtime'].to_numpy())))
+
+    sizes = np.empty(len(paths), dtype=np.int64)
+    mtimes = np.empty(len(paths), dtype=np.int64)
+    for i, path in enumerate(paths):
+        stats = known.get(path)
+        if stats is None:
+            st = os.stat(path)
+            stats = (st.st_size, st.st_mtime_ns)
+        sizes[i], mtimes[i] = stats
+    return sizes, mtimes
@@ -0,0 +1,210 @@
+# common/materialize.py
+#
+# Bounded-memory dataset materialization. Images are decoded chunk by chunk
+# straight into a preallocated uint8 buffer (or a .npy file on disk), so peak
+# memory is one chunk plus the uint8 output instead of two float32 copies.
+# Normalization to [0, 1] is left to the input pipeline.
+#
+# Decoding is spread over a pool of forked worker processes. Each worker takes
+# disjoint chunks of rows and writes them straight into the output, a shared
+# anonymous mapping or the .npy file, so no pixels are ever pickled back.
+
+import mmap
+import multiprocessing as mp
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from common.decode import read_image
+
+
+# Inherited by forked workers: (paths, rows, image_size, resample, target, offset)
+_JOB = None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def encode_labels(classes, class_indices=None):
+    """
+    Integer-encode class names and expand them with np.eye.
+
+    Args:
+        classes (Iterable[str]): Class name per sample
+        class_indices (dict): Class name to index mapping, inferred if None
+
+    Returns:
+        tuple[np.ndarray, dict]: uint8 one-hot matrix and the class mapping
+    """
+    classes = np.asarray(classes, dtype=str)
+    if class_indices is None:
+        names, labels = np.unique(classes, return_inverse=True)
+        class_indices = {str(name): i for i, name in enumerate(names)}
+    else:
+        labels = np.fromiter((class_indices[c] for c in classes), dtype=np.int64, count=len(classes))
+    return np.eye(len(class_indices), dtype=np.uint8)[labels], class_indices
+
+
+def default_workers():
+    """CPU cores available to this process."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def shared_array(shape, dtype=np.uint8):
+    """
+    Allocate a zeroed array in anonymous shared memory.
+
+    Writes made by forked decode workers are visible to the parent, which is
+    what decode_into() needs; a plain np.empty array would stay private to
+    each worker.
+    """
+    nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    buffer = mmap.mmap(-1, max(nbytes, 1))
+    return np.frombuffer(buffer, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _decode_chunk(bounds):
+    paths, rows, image_size, resample, target, offset = _JOB
+    lo, hi = bounds
+    failures = []
+    fd = os.open(target, os.O_WRONLY) if isinstance(target, str) else None
+    try:
+        for i in range(lo, hi):
+            try:
+                image = read_image(paths[i], image_size, resample)
+            except Exception as e:
+                # Any unreadable file is reported at the end, not fatal here
+                failures.append((paths[i], f'{type(e).__name__}: {e}'))
+                image = np.zeros((image_size[0], image_size[1], 3), dtype=np.uint8)
+            if fd is None:
+                target[rows[i]] = image
+            else:
+                # Plain writes: mapped pages would stay resident in the worker
+                os.pwrite(fd, image.tobytes(), offset + int(rows[i]) * image.nbytes)
+    finally:
+        if fd is not None:
+            os.close(fd)
+    return hi - lo, failures
+
+
+def decode_into(paths, image_size, target, rows=None, resample=Image.NEAREST, workers=None,
+                chunk_size=64, errors='raise', verbose=True):
+    """
+    Decode images in parallel straight into a uint8 output.
+
+    Args:
+        paths (Sequence[str]): Image paths
+        image_size (tuple): (height, width) images are resized to
+        target (np.ndarray | str): Array from shared_array(), or the path of
+            an existing uint8 .npy file of the right shape
+        rows (Sequence[int]): Output row per path, defaults to 0..len(paths)-1
+        resample (int): PIL resampling filter
+        workers (int): Decode processes, defaults to the available cores;
+            1 (or a platform without fork) decodes in this process
+        chunk_size (int): Most images a worker takes at a time
+        errors (str): 'raise' fails after all files were tried, listing the
+            unreadable ones; 'warn' prints them and leaves their rows zeroed
+        verbose (bool): Print progress
+
+    Returns:
+        list[tuple[str, str]]: (path, error) for every file that failed
+    """
+    global _JOB
+    paths = list(paths)
+    rows = np.arange(len(paths)) if rows is None else np.asarray(rows, dtype=np.int64)
+    offset = 0
+    if isinstance(target, str):
+        offset = np.load(target, mmap_mode='r').offset
+
+    workers = min(workers or default_workers(), max(1, len(paths)))
+    if 'fork' not in mp.get_all_start_methods():
+        workers = 1
+    # Small enough chunks that every worker gets several, for load balance
+    step = max(1, min(chunk_size, -(-len(paths) // (workers * 4))))
+    chunks = [(lo, min(lo + step, len(paths))) for lo in range(0, len(paths), step)]
+
+    failures, done = [], 0
+
+    def collect(results):
+        nonlocal done
+        for count, chunk_failures in results:
+            done += count
+            failures.extend(chunk_failures)
+            if verbose:
+                print(f'\r  decoded {done}/{len(paths)} images', end='', flush=True)
+
+    _JOB = (paths, rows, tuple(image_size), resample, target, offset)
+    try:
+        if workers == 1:
+            collect(map(_decode_chunk, chunks))
+        else:
+            # Workers only run PIL/numpy code, so forking a process that has
+            # TensorFlow loaded is safe; the job is inherited, not pickled
+            with mp.get_context('fork').Pool(workers) as pool:
+                collect(pool.imap_unordered(_decode_chunk, chunks))
+    finally:
+        _JOB = None
+    if verbose and paths:
+        print()
+
+    if failures:
+        listing = '\n'.join(f'  {path}: {error}' for path, error in failures[:20])
+        more = f'\n  ... and {len(failures) - 20} more' if len(failures) > 20 else ''
+        message = f'{len(failures)} of {len(paths)} images could not be decoded:\n{listing}{more}'
+        if errors == 'raise':
+            raise RuntimeError(message)
+        print(message + '\nTheir rows were left black.')
+    return failures
+
+
+def materialize_images(paths, image_size, memmap_path=None, chunk_size=256,
+                       resample=Image.NEAREST, workers=None, errors='raise', verbose=True):
+    """
+    Decode images into one uint8 array without ever holding a float copy.
+
+    Args:
+        paths (Sequence[str]): Image paths
+        image_size (tuple): (height, width) images are resized to
+        memmap_path (str): If set, stream rows into this .npy file and return
+            it memory-mapped read-only; memory then stays flat in the dataset size
+        chunk_size (int): Most images a worker decodes at a time
+        resample (int): PIL resampling filter
+        workers (int): Decode processes, defaults to the available cores
+        errors (str): 'raise' or 'warn', see decode_into()
+        verbose (bool): Print progress, throughput and peak RSS
+
+    Returns:
+        np.ndarray: uint8 array of shape (len(paths), height, width, 3)
+    """
+    start = time.perf_counter()
+    paths = list(paths)
+    shape = (len(paths), image_size[0], image_size[1], 3)
+
+    if memmap_path is None:
+        out = shared_array(shape)
+        decode_into(paths, image_size, out, resample=resample, workers=workers,
+                    chunk_size=chunk_size, errors=errors, verbose=verbose)
+    else:
+        # Only create the .npy header here; workers fill in the rows
+        header = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=np.uint8, shape=shape)
+        del header
+        decode_into(paths, image_size, memmap_path, resample=resample, workers=workers,
+                    chunk_size=chunk_size, errors=errors, verbose=verbose)
+        out = np.load(memmap_path, mmap_mode='r')
+
+    if verbose:
+        elapsed = time.perf_counter() - start
+        print(f'Materialized {len(paths)} images at {image_size} in {elapsed:.1f}s '
+              f'({len(paths) / max(elapsed, 1e-9):.0f} img/s), peak RSS {peak_rss_mb():.0f} MiB')
+    return out
@@ -0,0 +1,37 @@
+# common/paths.py
+
+import hashlib
+import os
+
+import numpy as np
+
+
+# Every persistent artefact (manifests, caches, indexes) lives under one
+# directory so a run can be reset by deleting it.
+CACHE_DIR = os.environ.get('ASNET_CACHE_DIR', os.path.join(os.getcwd(), '.asnet_cache'))
+
+
+def cache_path(kind, key, suffix):
+    """
+    Build the on-disk location of a cached artefact.
+
+    Args:
+        kind (str): Artefact family, e.g. 'manifest' or 'images'
+        key (str): Anything identifying the source (usually a dataset path)
+        suffix (str): File name suffix including the extension
+
+    Returns:
+        str: Absolute file path inside CACHE_DIR/kind
+    """
+    digest = hashlib.sha1(os.path.abspath(key).encode('utf-8')).hexdigest()[:12]
+    name = f'{os.path.basename(os.path.normpath(key))}-{digest}{suffix}'
+    directory = os.path.join(CACHE_DIR, kind)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def save_npz_atomic(path, **arrays):
+    """Write an .npz file and move it into place so readers never see half a file."""
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
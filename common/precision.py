@@ -0,0 +1,35 @@
+# common/precision.py
+#
+# Keras mixed-precision policies for the AS_Net scripts and the Xception
+# baseline. Under a mixed policy layers compute in bfloat16/float16 and keep
+# float32 variables. The softmax output layers are pinned to float32 in the
+# scripts, so probabilities and the loss stay in full precision.
+#
+# 'mixed_bfloat16' has float32's exponent range and needs no loss scaling; it
+# is the choice on CPUs with AVX512-BF16/AMX and on TPUs. 'mixed_float16' is
+# for GPUs with tensor cores; its gradients can underflow, so Keras wraps the
+# optimizer in a LossScaleOptimizer when a model built under that policy is
+# compiled (compile(auto_scale_loss=True), the default).
+
+import tensorflow as tf
+
+PRECISIONS = ('float32', 'mixed_bfloat16', 'mixed_float16')
+
+
+def set_precision(precision):
+    """
+    Set the global Keras dtype policy that models built afterwards use.
+
+    Args:
+        precision (str): One of PRECISIONS
+
+    Returns:
+        str: Compute dtype of the policy, e.g. 'bfloat16'
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'Unknown precision {precision!r}; expected one of {PRECISIONS}')
+    if precision == 'mixed_float16' and not tf.config.list_physical_devices('GPU'):
+        # Runs, but CPUs emulate float16 math and are slower than in float32
+        print('mixed_float16 without a GPU is slow; mixed_bfloat16 is the CPU policy')
+    tf.keras.mixed_precision.set_global_policy(precision)
+    return tf.keras.mixed_precision.global_policy().compute_dtype
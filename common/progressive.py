@@ -0,0 +1,185 @@
+# common/progressive.py
+#
+# Progressive resizing: train at a small resolution first and step up to the
+# final IMAGE_SIZE over a few stages, since early epochs learn the coarse
+# features just as well on small images at a fraction of the compute.
+#
+# AS_Net is built for one static input size (the taps are resized to the
+# deepest map's static shape), so there is one model per resolution, all
+# built, compiled and traced up front: each keeps its own (XLA-compiled)
+# train step and nothing retraces when the size changes. Their weights do not
+# depend on the resolution (every head ends in global pooling), so at every
+# step up the weights and the optimizer state (Adam moments, step count and
+# with it the learning-rate schedule) are handed to the next model. The
+# loaders keep producing full-size batches from their cache or shards; they
+# are downscaled on the fly.
+#
+#   schedule = resize_schedule(224, num_epochs, start_size=128)
+#   model, hist = fit_progressive(lambda size: build_and_compile(size), schedule,
+#                                 tr_gen, validation_data=valid_gen, callbacks=[...])
+
+import time
+
+import numpy as np
+import tensorflow as tf
+
+# Sizes are multiples of the encoders' total stride
+SIZE_STEP = 32
+
+
+def resize_schedule(final_size, epochs, start_size=128, stages=3):
+    """
+    Image sizes from start_size up to final_size and the epochs spent at each.
+
+    Sizes are evenly spaced and rounded to multiples of SIZE_STEP; the epochs
+    are split evenly, with the remainder going to the final size.
+
+    Args:
+        final_size (int): Size the model is trained and evaluated at in the end
+        epochs (int): Total training epochs
+        start_size (int): First, smallest size
+        stages (int): Number of sizes, fewer if there are fewer epochs
+
+    Returns:
+        list: (size, epochs) per stage, in training order
+    """
+    if start_size > final_size:
+        raise ValueError(f'start_size {start_size} is larger than the final size {final_size}')
+    stages = max(1, min(stages, epochs))
+    sizes = [int(round(size / SIZE_STEP)) * SIZE_STEP
+             for size in np.linspace(start_size, final_size, stages)[:-1]] + [final_size]
+    per_stage = epochs // stages
+    return [(size, per_stage + (epochs - per_stage * stages if i == stages - 1 else 0))
+            for i, size in enumerate(sizes)]
+
+
+def resize_batches(ds, size):
+    """Downscale the image batches of a (images, labels, ...) dataset to size x size."""
+    if tuple(ds.element_spec[0].shape[1:3]) == (size, size):
+        return ds
+
+    def resize(images, *rest):
+        resized = tf.image.resize(images, (size, size), antialias=True)
+        return (tf.cast(resized, images.dtype),) + rest
+
+    return ds.map(resize, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+
+
+class WallClock(tf.keras.callbacks.Callback):
+    """Log the seconds since the first epoch began, and the input size, per epoch."""
+
+    def __init__(self):
+        super(WallClock, self).__init__()
+        self.start = None
+
+    def on_train_begin(self, logs=None):
+        # One clock across all stages, hand-overs included
+        if self.start is None:
+            self.start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is not None:
+            logs['time'] = time.perf_counter() - self.start
+            logs['image_size'] = self.model.input_shape[1]
+
+
+def hand_over(source, target):
+    """Copy the weights and optimizer state of one stage's model to the next."""
+    target.set_weights(source.get_weights())
+    with target.distribute_strategy.scope():
+        if not target.optimizer.built:
+            target.optimizer.build(target.trainable_variables)
+    if len(target.optimizer.variables) != len(source.optimizer.variables):
+        raise ValueError('The stage models have different optimizer states; build them identically')
+    for variable, value in zip(target.optimizer.variables, source.optimizer.variables):
+        variable.assign(value)
+
+
+def warm_up(model, train, validation_data=None, class_weight=None):
+    """
+    Trace (and XLA-compile) a compiled model's train and test steps ahead of fit().
+
+    One training step runs on the first batch, after which the weights and
+    the optimizer state are restored, so the model trains as if untouched.
+
+    Args:
+        model (keras.Model): Compiled model
+        train (tf.data.Dataset): Training batches at the model's input size
+        validation_data (tf.data.Dataset): Validation batches, likewise
+        class_weight (dict): The class weights fit() will get; they change
+            the traced step's inputs
+    """
+    strategy = model.distribute_strategy
+    with strategy.scope():
+        if not model.optimizer.built:
+            model.optimizer.build(model.trainable_variables)
+    initial = model.get_weights()
+    state = [variable.numpy() for variable in model.optimizer.variables]
+    train = train.take(1)
+    if class_weight is not None:
+        weights = tf.constant([class_weight[i] for i in range(len(class_weight))], tf.float32)
+        train = train.map(lambda x, y: (x, y, tf.gather(weights, tf.argmax(y, axis=-1))))
+    model.make_train_function()
+    model.train_function(iter(strategy.experimental_distribute_dataset(train)))
+    if validation_data is not None:
+        model.make_test_function()
+        model.test_function(iter(strategy.experimental_distribute_dataset(validation_data.take(1))))
+    model.set_weights(initial)
+    for variable, value in zip(model.optimizer.variables, state):
+        variable.assign(value)
+
+
+def fit_progressive(build, schedule, train, validation_data=None, callbacks=(), **fit_kwargs):
+    """
+    Train through the stages of a resize_schedule(), one model per size.
+
+    Callbacks that save, restore or stop the model (checkpoints, early
+    stopping, ReduceLROnPlateau) only make sense at the final size, so
+    `callbacks` are passed to the last stage only. A single-stage schedule is
+    the fixed-size run, with the same 'time' log for comparison; neither
+    counts model building or tracing.
+
+    Args:
+        build (callable): size -> model compiled for (size, size, 3) inputs;
+            all stages must build the same architecture
+        schedule (list): (size, epochs) per stage
+        train (tf.data.Dataset): Training batches at the final size or larger
+        validation_data (tf.data.Dataset): Validation batches, resized alike
+        callbacks (Sequence): Keras callbacks of the final stage
+        **fit_kwargs: Forwarded to every fit(), e.g. class_weight
+
+    Returns:
+        tuple: (final-size model, History whose .history has every stage's
+        epochs in order, with 'time' and 'image_size' entries)
+    """
+    # Built, compiled and traced before the clock starts, so stepping up
+    # never waits on a model build or a retrace
+    models = []
+    for size, _ in schedule:
+        models.append(build(size))
+        warm_up(models[-1], resize_batches(train, size),
+                None if validation_data is None else resize_batches(validation_data, size),
+                fit_kwargs.get('class_weight'))
+    clock = WallClock()
+    merged = tf.keras.callbacks.History()
+    merged.history, merged.epoch = {}, []
+    epoch = 0
+    for stage, ((size, epochs), model) in enumerate(zip(schedule, models)):
+        if stage:
+            hand_over(models[stage - 1], model)
+        last = stage == len(schedule) - 1
+        print(f'Stage {stage + 1}/{len(schedule)}: {size}x{size} for {epochs} epochs')
+        hist = model.fit(resize_batches(train, size),
+                         validation_data=(None if validation_data is None
+                                          else resize_batches(validation_data, size)),
+                         initial_epoch=epoch, epochs=epoch + epochs,
+                         callbacks=[clock] + (list(callbacks) if last else []), **fit_kwargs)
+        # Keys that only some stages log (e.g. ReduceLROnPlateau's
+        # learning_rate) are padded with NaN to keep the epochs aligned
+        for key in set(merged.history) | set(hist.history):
+            previous = merged.history.get(key, [np.nan] * len(merged.epoch))
+            merged.history[key] = previous + hist.history.get(key, [np.nan] * len(hist.epoch))
+        merged.epoch += hist.epoch
+        epoch += epochs
+    merged.set_model(models[-1])
+    return models[-1], merged
@@ -0,0 +1,164 @@
+# common/records.py
+#
+# Sharded TFRecord export of a split. Each record holds the original encoded
+# image bytes, its label and its source path; shards are cut at a target size
+# so reads stay large and sequential. Every shard gets a sidecar .index.npy of
+# (offset, length) pairs for random access, and a per-split .meta.npz records
+# what was exported so unchanged splits are not written twice.
+
+import glob
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+from common.manifest import file_stats
+from common.paths import cache_path, save_npz_atomic
+
+
+# TFRecord framing: uint64 length, uint32 length CRC, payload, uint32 payload CRC
+_RECORD_OVERHEAD = 16
+
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _signature(paths, labels, sizes, mtimes, target_shard_bytes):
+    digest = hashlib.sha1()
+    digest.update(np.int64(target_shard_bytes).tobytes())
+    for column in (labels.astype(np.int64), sizes, mtimes):
+        digest.update(np.ascontiguousarray(column).tobytes())
+    digest.update('\0'.join(paths).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _plan_shards(sizes, target_shard_bytes):
+    # Greedy cut: start a new shard once the running payload reaches the target
+    bounds, start, total = [], 0, 0
+    for i, size in enumerate(sizes):
+        total += int(size) + _RECORD_OVERHEAD
+        if total >= target_shard_bytes:
+            bounds.append((start, i + 1))
+            start, total = i + 1, 0
+    if start < len(sizes):
+        bounds.append((start, len(sizes)))
+    return bounds
+
+
+class RecordShards:
+    """Shard files of one exported split, in record order."""
+
+    def __init__(self, meta_path):
+        with np.load(meta_path) as meta:
+            directory = os.path.dirname(meta_path)
+            self.shards = [os.path.join(directory, str(name)) for name in meta['shards']]
+            self.filenames = [str(path) for path in meta['paths']]
+            self.classes = meta['labels'].astype(np.int32)
+            self.class_indices = {str(name): i for i, name in enumerate(meta['class_names'])}
+            self.records_per_shard = meta['records_per_shard']
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def read(self, i):
+        """Random access to record `i` through the shard's offset index."""
+        shard = int(np.searchsorted(np.cumsum(self.records_per_shard), i, side='right'))
+        local = i - int(np.sum(self.records_per_shard[:shard]))
+        offset, length = np.load(self.shards[shard] + '.index.npy', mmap_mode='r')[local]
+        with open(self.shards[shard], 'rb') as f:
+            f.seek(int(offset) + 12)
+            return parse_example(f.read(int(length)))
+
+
+def parse_example(serialized):
+    """Decode a serialized record into (image bytes, label, path)."""
+    example = tf.train.Example.FromString(serialized)
+    feature = example.features.feature
+    return (feature['image'].bytes_list.value[0],
+            feature['label'].int64_list.value[0],
+            feature['path'].bytes_list.value[0].decode('utf-8'))
+
+
+def export_records(df, split, class_indices=None, x_col='Class Path', y_col='Class',
+                   target_shard_mb=128, shuffle_seed=None, workers=16, verbose=True):
+    """
+    Pack one split into sequential TFRecord shards with per-shard offset indexes.
+
+    Args:
+        df (pd.DataFrame): DataFrame of the split
+        split (str): Split name, e.g. 'train', 'valid' or 'test'
+        class_indices (dict): Class name to index mapping, inferred if None
+        x_col (str): Column holding the image paths
+        y_col (str): Column holding the class names
+        target_shard_mb (float): Approximate shard size in MiB
+        shuffle_seed (int): Permute records once before writing so that every
+            shard mixes classes; None keeps DataFrame order (use for evaluation)
+        workers (int): Threads reading source files
+        verbose (bool): Print what was written
+
+    Returns:
+        RecordShards: The exported shards
+    """
+    start = time.perf_counter()
+    class_indices = class_indices or {name: i for i, name in enumerate(sorted(df[y_col].unique()))}
+    order = np.arange(len(df))
+    if shuffle_seed is not None:
+        order = np.random.default_rng(shuffle_seed).permutation(len(df))
+    paths = df[x_col].to_numpy(dtype=str)[order]
+    labels = df[y_col].map(class_indices).to_numpy(dtype=np.int64)[order]
+    sizes, mtimes = file_stats(paths)
+
+    target_shard_bytes = int(target_shard_mb * 1024 * 1024)
+    prefix = cache_path('records', split, '')
+    meta_path = prefix + '.meta.npz'
+    signature = _signature(paths, labels, sizes, mtimes, target_shard_bytes)
+    if os.path.exists(meta_path):
+        with np.load(meta_path) as meta:
+            current = str(meta['signature']) == signature
+        if current:
+            if verbose:
+                print(f'Record shards {split}: up to date')
+            return RecordShards(meta_path)
+
+    # Drop shards of an earlier export, their count may differ
+    for stale in glob.glob(glob.escape(prefix) + '-*-of-*.tfrecord*'):
+        os.remove(stale)
+
+    bounds = _plan_shards(sizes, target_shard_bytes)
+    shard_names, records_per_shard = [], []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for n, (lo, hi) in enumerate(bounds):
+            shard_path = f'{prefix}-{n:05d}-of-{len(bounds):05d}.tfrecord'
+            index = np.empty((hi - lo, 2), dtype=np.int64)
+            offset = 0
+            with tf.io.TFRecordWriter(shard_path) as writer:
+                for j, data in enumerate(pool.map(_read_bytes, paths[lo:hi])):
+                    example = tf.train.Example(features=tf.train.Features(feature={
+                        'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[data])),
+                        'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[int(labels[lo + j])])),
+                        'path': tf.train.Feature(bytes_list=tf.train.BytesList(
+                            value=[paths[lo + j].encode('utf-8')])),
+                    })).SerializeToString()
+                    writer.write(example)
+                    index[j] = (offset, len(example))
+                    offset += len(example) + _RECORD_OVERHEAD
+            np.save(shard_path + '.index.npy', index)
+            shard_names.append(os.path.basename(shard_path))
+            records_per_shard.append(hi - lo)
+
+    save_npz_atomic(meta_path,
+                    signature=np.asarray(signature),
+                    shards=np.asarray(shard_names, dtype=str),
+                    records_per_shard=np.asarray(records_per_shard, dtype=np.int64),
+                    paths=paths,
+                    labels=labels,
+                    class_names=np.asarray(sorted(class_indices, key=class_indices.get), dtype=str))
+    if verbose:
+        print(f'Record shards {split}: wrote {len(paths)} records into {len(bounds)} shards '
+              f'in {time.perf_counter() - start:.1f}s')
+    return RecordShards(meta_path)
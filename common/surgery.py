@@ -0,0 +1,51 @@
+# common/surgery.py
+#
+# Structural edits of a trained model for the compression tools (pruning,
+# factorization): layers are addressed by their name path through the nested
+# models (AS_Net > head > sequential > dense), the model config is edited at
+# those paths and the model rebuilt from it, after which the tool carries the
+# trained weights over layer by layer.
+
+import copy
+
+import tensorflow as tf
+
+
+def named_layers(model, path=()):
+    """Yield (name path, layer) for every layer, descending into nested models."""
+    for layer in model.layers:
+        yield path + (layer.name,), layer
+        if isinstance(layer, tf.keras.Model):
+            yield from named_layers(layer, path + (layer.name,))
+
+
+def layer_configs(config, path=()):
+    """Map the name paths of named_layers() to the layer entries of a model config."""
+    found = {}
+    for child in config.get('layers', []):
+        child_path = path + (child['config']['name'],)
+        found[child_path] = child
+        found.update(layer_configs(child['config'], child_path))
+    return found
+
+
+def rebuild(model, edit):
+    """
+    Rebuild a model from its config after `edit` changed some layer configs.
+
+    Args:
+        model (keras.Model): Model to rebuild
+        edit (callable): Called with layer_configs() of a copy of the model
+            config; changes the layer config dicts in place
+
+    Returns:
+        keras.Model: New model with freshly initialized weights
+    """
+    config = copy.deepcopy(model.get_config())
+    configs = layer_configs(config)
+    edit(configs)
+    # Layers would otherwise be built for their old input widths; the
+    # functional rebuild builds them on the new ones
+    for layer_config in configs.values():
+        layer_config.pop('build_config', None)
+    return model.__class__.from_config(config)
@@ -0,0 +1,357 @@
+# common/training.py
+#
+# A training loop for effective batches larger than fit for in memory:
+# every loader batch is a micro-batch whose gradients are summed into
+# accumulators by one tf.function (XLA-compiled when the model is), and every
+# `accumulation_steps` micro-batches a second one applies their average with
+# the model's optimizer. Activation memory is that of one micro-batch; the
+# update is that of the whole effective batch (up to BatchNormalization,
+# whose batch statistics stay per micro-batch).
+#
+# It stands in for model.fit(): the compiled loss, metrics (Precision,
+# Recall, AUC, ...) and optimizer, class_weight and the usual callbacks
+# (EarlyStopping, ReduceLROnPlateau, ModelCheckpoint, TensorBoard) work as
+# with fit, and it returns the same History. A callback "batch" is one
+# optimizer update. Validation runs through model.evaluate().
+#
+#   hist = fit_accumulated(model, tr_gen, epochs=35, accumulation_steps=4,
+#                          validation_data=valid_gen, class_weight=class_weight_dict,
+#                          callbacks=[early_stopping, reduce_lr, checkpoint])
+#
+# With a checkpoint_dir it also survives preemption: every checkpoint_every
+# updates and at every epoch end it saves, under a rotating
+# tf.train.CheckpointManager, everything the rest of the run depends on -
+# all model variables (dropout seed states included), the optimizer state
+# (moments, step count and with it the learning-rate schedule), the metric
+# totals of the epoch so far, the position and shuffle state of the input
+# pipeline's iterator, the CALLBACK_STATE of the callbacks and the History.
+# Calling it again with the same directory resumes from the latest
+# checkpoint, mid-epoch if that is where it was taken. With a seeded loader
+# and op determinism on, the resumed run ends bit-identical to an
+# uninterrupted one; tools/resume_check.py checks exactly that.
+#
+#   hist = fit_accumulated(model, tr_gen, epochs=35, validation_data=valid_gen,
+#                          checkpoint_dir='checkpoints', checkpoint_every=50)
+#
+# It also trains under a multi-replica strategy, in particular the
+# MultiWorkerMirroredStrategy of common/distributed.py that model.fit() cannot
+# start under: each replica accumulates its own batches and the update
+# all-reduces the replicas' gradients. Validation then runs on the replicas
+# too, with the metrics added up across them.
+#
+# See benchmarks/accumulation.py for its throughput and memory against fit.
+
+import math
+import pickle
+
+import tensorflow as tf
+
+# What each callback needs to carry on where it stopped instead of starting
+# over (patience used up, best value so far, ...); on_train_begin resets them
+CALLBACK_STATE = (
+    (tf.keras.callbacks.EarlyStopping, ('wait', 'stopped_epoch', 'best', 'best_weights', 'best_epoch')),
+    (tf.keras.callbacks.ReduceLROnPlateau, ('wait', 'best', 'cooldown_counter')),
+    (tf.keras.callbacks.ModelCheckpoint, ('best',)),
+    (tf.keras.callbacks.History, ('epoch', 'history')),
+)
+
+
+def _class_sample_weight(class_weight):
+    # One-hot labels -> per-sample weights, as fit(class_weight=...) does
+    weights = tf.constant([class_weight[i] for i in range(len(class_weight))], tf.float32)
+    return lambda y: tf.gather(weights, tf.argmax(y, axis=-1))
+
+
+class _Accumulator:
+    """The accumulate, apply and test steps of one compiled model, on every replica."""
+
+    def __init__(self, model, class_weight=None, jit_compile=None):
+        self.model = model
+        self.strategy = model.distribute_strategy
+        self.class_sample_weight = _class_sample_weight(class_weight) if class_weight else None
+        with self.strategy.scope():
+            # Sums kept per replica; read outside a replica they are added up
+            local = dict(trainable=False, synchronization=tf.VariableSynchronization.ON_READ,
+                         aggregation=tf.VariableAggregation.SUM)
+            self.gradients = [tf.Variable(tf.zeros_like(v), **local)
+                              for v in model.trainable_variables]
+            self.count = tf.Variable(0.0, **local)
+            self.loss_tracker = tf.keras.metrics.Mean(name='loss')
+        jit_compile = bool(model.jit_compile) if jit_compile is None else jit_compile
+        self.accumulate = self._replicated(self._accumulate, jit_compile)
+        self.apply = self._replicated(self._apply, jit_compile)
+        self.test = self._replicated(self._test, jit_compile)
+        self.results = tf.function(self._results)
+        # BatchNormalization statistics, which each replica moves with its own batches
+        self.moving = [v for v in model.non_trainable_variables
+                       if v.path.endswith(('moving_mean', 'moving_variance'))]
+        self.moving_means = tf.function(lambda: self.strategy.run(self._moving_means))
+
+    def _replicated(self, step, jit_compile):
+        # Every replica runs the step on its own batch
+        step = tf.function(step, jit_compile=jit_compile)
+        return tf.function(lambda *args: self.strategy.run(step, args=args))
+
+    def _sample_weight(self, y, sample_weight):
+        if self.class_sample_weight is None:
+            return sample_weight
+        weight = self.class_sample_weight(y)
+        return weight if sample_weight is None else weight * tf.cast(sample_weight, weight.dtype)
+
+    def _track_loss(self, loss, n):
+        # compute_loss divides by the replica count so that the replicas'
+        # gradients add up to the mean; the logged loss is the unscaled one
+        replicas = self.strategy.num_replicas_in_sync
+        self.loss_tracker.update_state(loss * tf.cast(replicas, loss.dtype), sample_weight=n)
+
+    def _accumulate(self, data):
+        model = self.model
+        x, y, sample_weight = tf.keras.utils.unpack_x_y_sample_weight(data)
+        sample_weight = self._sample_weight(y, sample_weight)
+        n = tf.cast(tf.shape(y)[0], tf.float32)
+        with tf.GradientTape() as tape:
+            y_pred = model(x, training=True)
+            loss = model.compute_loss(x=x, y=y, y_pred=y_pred, sample_weight=sample_weight,
+                                      training=True)
+            scaled = model.optimizer.scale_loss(loss)
+        # Each micro-batch's mean loss counts by its size, so the applied
+        # gradient is that of the mean loss over the whole effective batch
+        for accumulator, gradient in zip(self.gradients,
+                                         tape.gradient(scaled, model.trainable_variables)):
+            if gradient is not None:
+                accumulator.assign_add(tf.cast(gradient, accumulator.dtype) * n)
+        self.count.assign_add(n)
+        self._track_loss(loss, n)
+        model.compute_metrics(x, y, y_pred, sample_weight=sample_weight)
+
+    def _apply(self):
+        # apply_gradients all-reduces the replicas' gradients before the update
+        model = self.model
+        model.optimizer.apply_gradients(
+            [(accumulator / self.count, variable)
+             for accumulator, variable in zip(self.gradients, model.trainable_variables)])
+        for accumulator in self.gradients:
+            accumulator.assign(tf.zeros_like(accumulator))
+        self.count.assign(0.0)
+
+    def _test(self, data):
+        model = self.model
+        x, y, sample_weight = tf.keras.utils.unpack_x_y_sample_weight(data)
+        y_pred = model(x, training=False)
+        loss = model.compute_loss(x=x, y=y, y_pred=y_pred, sample_weight=sample_weight,
+                                  training=False)
+        self._track_loss(loss, tf.cast(tf.shape(y)[0], tf.float32))
+        model.compute_metrics(x, y, y_pred, sample_weight=sample_weight)
+
+    def _moving_means(self):
+        return tf.distribute.get_replica_context().all_reduce(
+            tf.distribute.ReduceOp.MEAN, [tf.identity(v) for v in self.moving])
+
+    def _results(self):
+        results = dict(self.model.get_metrics_result())
+        results['loss'] = self.loss_tracker.result()
+        return results
+
+    def build(self, data):
+        # Optimizer and metric variables are created eagerly, outside the
+        # tf.functions, from one forward pass on the first micro-batch
+        model = self.model
+        x, y, sample_weight = tf.keras.utils.unpack_x_y_sample_weight(data)
+        with self.strategy.scope():
+            model.optimizer.build(model.trainable_variables)
+            model.compute_metrics(x, y, model(x, training=False),
+                                  sample_weight=self._sample_weight(y, sample_weight))
+        self.reset_metrics()
+
+    def sync_moving_statistics(self):
+        # Averaged across replicas, so that all of them hold the same model
+        if self.strategy.num_replicas_in_sync == 1 or not self.moving:
+            return
+        for variable, mean in zip(self.moving, self.moving_means()):
+            variable.assign(self.strategy.experimental_local_results(mean)[0])
+
+    def distribute(self, dataset):
+        # Under several replicas each batch of the (per-worker) dataset goes
+        # to one replica whole
+        if self.strategy.num_replicas_in_sync == 1:
+            return dataset
+        return self.strategy.distribute_datasets_from_function(lambda context: dataset)
+
+    def evaluate(self, dataset):
+        self.reset_metrics()
+        for data in dataset:
+            self.test(data)
+        return self.logs()
+
+    def reset_metrics(self):
+        self.loss_tracker.reset_state()
+        self.model.reset_metrics()
+
+    def logs(self):
+        # One call, so that under several workers the metrics are all-reduced
+        # together rather than one eager collective per variable
+        return {name: float(value) for name, value in self.results().items()}
+
+
+def _state_attributes(callback):
+    for kind, attributes in CALLBACK_STATE:
+        if isinstance(callback, kind):
+            return attributes
+    return ()
+
+
+class _CallbackState(tf.train.experimental.PythonState):
+    """The CALLBACK_STATE of a run's callbacks, pickled into its checkpoints."""
+
+    def __init__(self, callbacks):
+        self.callbacks = [callback for callback in callbacks if _state_attributes(callback)]
+        self.restored = None
+
+    def serialize(self):
+        return pickle.dumps([(type(callback).__name__,
+                              {name: getattr(callback, name, None)
+                               for name in _state_attributes(callback)})
+                             for callback in self.callbacks])
+
+    def deserialize(self, string_value):
+        # Held until apply(), since on_train_begin would reset it
+        self.restored = pickle.loads(string_value)
+
+    def apply(self):
+        if self.restored is None:
+            return
+        if [name for name, _ in self.restored] != [type(c).__name__ for c in self.callbacks]:
+            raise ValueError('The checkpoint was saved with other callbacks: '
+                             f'{[name for name, _ in self.restored]}')
+        for callback, (_, state) in zip(self.callbacks, self.restored):
+            for name, value in state.items():
+                setattr(callback, name, value)
+        self.restored = None
+
+
+def fit_accumulated(model, train, epochs=1, accumulation_steps=1, validation_data=None,
+                    class_weight=None, callbacks=(), initial_epoch=0, jit_compile=None,
+                    verbose=1, checkpoint_dir=None, checkpoint_every=None, max_to_keep=3):
+    """
+    Train a compiled model with gradients accumulated over micro-batches.
+
+    Args:
+        model (keras.Model): Compiled model (optimizer, loss, metrics)
+        train (tf.data.Dataset): Micro-batches of (x, y) or (x, y, sample_weight);
+            the effective batch is accumulation_steps of them. Under a
+            multi-replica strategy this is the worker's own shard and every
+            batch goes to one replica, so the effective batch is also
+            multiplied by the replica count
+        epochs (int): Index of the last epoch, as in fit()
+        accumulation_steps (int): Micro-batches per optimizer update; the
+            last update of an epoch may have fewer
+        validation_data (tf.data.Dataset): Evaluated after every epoch; under
+            several workers, each one's shard of it
+        class_weight (dict): Class index to loss weight, as in fit()
+        callbacks (Sequence): Keras callbacks
+        initial_epoch (int): Epoch to start from, as in fit()
+        jit_compile (bool): XLA-compile the steps; None follows model.jit_compile
+        verbose (int): 0 silent, 1 progress bar, 2 one line per epoch
+        checkpoint_dir (str): Save resumable checkpoints here, and resume from
+            the latest one if there is one; `train` must have a known length
+        checkpoint_every (int): Also checkpoint every this many updates
+            within an epoch; None checkpoints at epoch ends only
+        max_to_keep (int): Checkpoints kept, older ones are deleted
+
+    Returns:
+        keras.callbacks.History: Per-epoch logs, with val_* entries
+    """
+    replicas = model.distribute_strategy.num_replicas_in_sync
+    if checkpoint_dir is not None and replicas > 1:
+        raise ValueError('Resumable training runs on one replica')
+    micro_batches = int(train.cardinality())
+    if micro_batches == tf.data.INFINITE_CARDINALITY:
+        raise ValueError('fit_accumulated needs a finite training dataset; epochs end with it')
+    if checkpoint_dir is not None and micro_batches < 0:
+        raise ValueError('Resumable training needs a training dataset of known length')
+    steps = math.ceil(micro_batches / accumulation_steps) if micro_batches > 0 else None
+
+    engine = _Accumulator(model, class_weight, jit_compile)
+    engine.build(next(iter(train)))
+    distributed = engine.distribute(train)
+    if validation_data is not None and replicas > 1:
+        validation_data = engine.distribute(validation_data)
+    callbacks = tf.keras.callbacks.CallbackList(
+        list(callbacks), add_history=True, add_progbar=verbose != 0, model=model,
+        verbose=verbose, epochs=epochs, steps=steps)
+
+    history = next(callback for callback in callbacks.callbacks
+                   if isinstance(callback, tf.keras.callbacks.History))
+    manager = iterator = callback_state = None
+    resume_step = 0
+    if checkpoint_dir is not None:
+        # One iterator across all epochs, so its position is part of the state
+        iterator = iter(train.repeat())
+        position = {'epoch': tf.Variable(initial_epoch, dtype=tf.int64),
+                    'step': tf.Variable(0, dtype=tf.int64)}
+        callback_state = _CallbackState(callbacks.callbacks)
+        # Variable lists rather than the model: its object graph leaves out
+        # the dropout seed generators
+        checkpoint = tf.train.Checkpoint(
+            model=list(model.variables), optimizer=list(model.optimizer.variables),
+            metrics=list(model.metrics_variables) + list(engine.loss_tracker.variables),
+            iterator=iterator, callbacks=callback_state, **position)
+        manager = tf.train.CheckpointManager(checkpoint, checkpoint_dir, max_to_keep)
+        if manager.latest_checkpoint:
+            checkpoint.restore(manager.latest_checkpoint).assert_consumed()
+            initial_epoch, resume_step = int(position['epoch']), int(position['step'])
+            print(f'Resuming from {manager.latest_checkpoint} at epoch {initial_epoch + 1}, '
+                  f'update {resume_step}')
+
+        def save(epoch, step):
+            position['epoch'].assign(epoch)
+            position['step'].assign(step)
+            manager.save()
+
+    model.stop_training = False
+    callbacks.on_train_begin()
+    if callback_state is not None:
+        callback_state.apply()
+    logs = {}
+    for epoch in range(initial_epoch, epochs):
+        if not resume_step:
+            # A resumed epoch keeps the metric totals of its first updates
+            engine.reset_metrics()
+        callbacks.on_epoch_begin(epoch)
+        step, resume_step = resume_step, 0
+        if iterator is None:
+            batches = iter(distributed)
+        else:
+            batches = (next(iterator) for _ in range(step * accumulation_steps, micro_batches))
+        for index, data in enumerate(batches, step * accumulation_steps):
+            if index % accumulation_steps == 0:
+                callbacks.on_train_batch_begin(step)
+            engine.accumulate(data)
+            if index % accumulation_steps == accumulation_steps - 1:
+                engine.apply()
+                callbacks.on_train_batch_end(step, engine.logs())
+                step += 1
+                if manager is not None and checkpoint_every and step % checkpoint_every == 0:
+                    # Between updates, where the accumulators are empty
+                    save(epoch, step)
+            if model.stop_training:
+                break
+        if engine.count.numpy() > 0:
+            # Leftover micro-batches at the end of the epoch
+            engine.apply()
+            callbacks.on_train_batch_end(step, engine.logs())
+        logs = engine.logs()
+        engine.sync_moving_statistics()
+        if validation_data is not None:
+            # model.evaluate() cannot run under a MultiWorkerMirroredStrategy
+            val_logs = (model.evaluate(validation_data, verbose=0, return_dict=True)
+                        if replicas == 1 else engine.evaluate(validation_data))
+            logs.update({f'val_{name}': value for name, value in val_logs.items()})
+        callbacks.on_epoch_end(epoch, logs)
+        if manager is not None:
+            # A stopped run stays stopped when it is started again
+            save(epochs if model.stop_training else epoch + 1, 0)
+        if model.stop_training:
+            break
+    callbacks.on_train_end(logs)
+    return history
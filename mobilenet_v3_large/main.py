@@ -12,9 +12,9 @@
 
 # 1. Import needed libraries
 import os
+import sys
 from PIL import Image
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 # ---------------------------------------
@@ -23,17 +23,36 @@ from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_class_weight
 # ---------------------------------------
 import tensorflow as tf
-from tensorflow.keras.models import Sequential, Model
-from tensorflow.keras.layers import BatchNormalization, Dense, Dropout, Conv2D, concatenate, Multiply, GlobalMaxPooling2D, GlobalAveragePooling2D, Reshape, Layer
 from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from tensorflow.keras.applications import MobileNetV3Large
-from tensorflow.keras import Input
-from tensorflow.keras.callbacks import ModelCheckpoint, ReduceLROnPlateau
+from tensorflow.keras.callbacks import ReduceLROnPlateau
+# ---------------------------------------
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.manifest import load_dataset_df
+from common.asnet import AS_Net
+from common.augmentation import BatchAugmentation
+from common.data_pipeline import flow_from_split
+from common.decode import read_image
+from common.distributed import cluster_strategy, is_chief, local_model, shard_split, worker_info, worker_path
+from common.distillation import Distiller, load_teacher
+from common.encoders import ENCODERS
+from common.feature_store import FullModelCheckpoint, build_feature_store, flow_from_feature_store
+from common.hashing import audit_splits, drop_flagged
+from common.materialize import encode_labels, materialize_images
+from common.precision import set_precision
+from common.progressive import fit_progressive, resize_schedule
+from common.training import fit_accumulated
 # ---------------------------------------
 import warnings
 warnings.filterwarnings("ignore")
 
+# Multi-worker CPU training (common/distributed.py): given a cluster spec -
+# CLUSTER_SPEC, the path of a TF_CONFIG-style JSON file, or the TF_CONFIG
+# variable tools/launch_local.py sets - every worker process joins one
+# MultiWorkerMirroredStrategy and trains on its own shard of the data
+CLUSTER_SPEC = None
+cluster = cluster_strategy(CLUSTER_SPEC)
+MULTI_WORKER = cluster is not None
+
 # Detect and initialize the TPU
 try:
     tpu = tf.distribute.cluster_resolver.TPUClusterResolver()
@@ -42,7 +61,11 @@ except ValueError:
     tpu = None
     print("No TPU detected. Running on CPU/GPU")
 
-if tpu:
+if MULTI_WORKER:
+    tpu_strategy = cluster
+    worker, workers = worker_info(tpu_strategy)
+    print(f"Worker {worker + 1} of {workers}")
+elif tpu:
     tf.config.experimental_connect_to_cluster(tpu)
     tf.tpu.experimental.initialize_tpu_system(tpu)
     tpu_strategy = tf.distribute.experimental.TPUStrategy(tpu)
@@ -56,20 +79,12 @@ print("REPLICAS: ", tpu_strategy.num_replicas_in_sync)
 
 ## 2.1 Load Data
 def test_df(ts_path):
-    classes, class_paths = zip(*[(label, os.path.join(ts_path, label, image))
-                                 for label in os.listdir(ts_path) if os.path.isdir(os.path.join(ts_path, label))
-                                 for image in os.listdir(os.path.join(ts_path, label))])
-
-    ts_df = pd.DataFrame({'Class Path': class_paths, 'Class': classes})
-    return ts_df
+    # Served from the persistent manifest; only changed class folders are rescanned
+    return load_dataset_df(ts_path)
 
 def train_df(tr_path):
-    classes, class_paths = zip(*[(label, os.path.join(tr_path, label, image))
-                                 for label in os.listdir(tr_path) if os.path.isdir(os.path.join(tr_path, label))
-                                 for image in os.listdir(os.path.join(tr_path, label))])
-
-    tr_df = pd.DataFrame({'Class Path': class_paths, 'Class': classes})
-    return tr_df
+    # Served from the persistent manifest; only changed class folders are rescanned
+    return load_dataset_df(tr_path)
 
 tr_df = train_df('/kaggle/input/brain-tumor-mri-dataset/Training')
 ts_df = test_df('/kaggle/input/brain-tumor-mri-dataset/Testing')
@@ -98,32 +113,37 @@ plt.show()
 ## 2.2 Split data into train, test, valid
 valid_df, ts_df = train_test_split(ts_df, train_size=0.5, random_state=20, stratify=ts_df['Class'])
 
+# Flag corrupt, duplicated and leaked images before they reach a model;
+# corrupt files are dropped, duplicates and leaks only reported
+audit = audit_splits({'train': tr_df, 'valid': valid_df, 'test': ts_df})
+tr_df, valid_df, ts_df = (drop_flagged(df, audit) for df in (tr_df, valid_df, ts_df))
+
 ## 2.3 Data preprocessing
 BATCH_SIZE = 32 * tpu_strategy.num_replicas_in_sync  # Scales with TPU cores
 IMAGE_SIZE = (224, 224) # MobileNetV3 default size is 224x224, keeping it the same
 
-def prepare_data(tr_df, ts_df):
-    def process_image(file_path):
-        img = Image.open(file_path)
-        # Convert grayscale to RGB if needed
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        img = img.resize(IMAGE_SIZE)
-        return np.array(img)
+def prepare_data(tr_df, ts_df, memmap_dir=None):
+    # Images are decoded by one process per core, chunk by chunk, into shared uint8 buffers
+    # (streamed to .npy files under memmap_dir if given); scaling to [0, 1]
+    # happens per batch in the input pipeline, e.g. flow_from_arrays(X, y)
+    def memmap_path(name):
+        return os.path.join(memmap_dir, name) if memmap_dir else None
 
-    # Convert DataFrame to numpy arrays
-    X = np.array([process_image(f) for f in tr_df['Class Path']], dtype=np.float32) / 255.0
-    y = pd.get_dummies(tr_df['Class']).values
+    X = materialize_images(tr_df['Class Path'], IMAGE_SIZE, memmap_path=memmap_path('X.npy'),
+                           resample=Image.BICUBIC)
+    y, class_indices = encode_labels(tr_df['Class'])
 
-    X_test = np.array([process_image(f) for f in ts_df['Class Path']], dtype=np.float32) / 255.0
-    y_test = pd.get_dummies(ts_df['Class']).values
+    X_test = materialize_images(ts_df['Class Path'], IMAGE_SIZE, memmap_path=memmap_path('X_test.npy'),
+                                resample=Image.BICUBIC)
+    y_test, _ = encode_labels(ts_df['Class'], class_indices)
 
     return X, y, X_test, y_test
 
 
 def get_augmentation():
-    return ImageDataGenerator(
-        rescale=1/255,
+    # Same ranges as the former ImageDataGenerator, applied per batch on the graph;
+    # the loaders rescale to [0, 1] afterwards
+    return BatchAugmentation(
         brightness_range=(0.9, 1.1),
         rotation_range=15,
         width_shift_range=0.1,
@@ -136,20 +156,38 @@ def get_augmentation():
 
 _gen = get_augmentation()
 
-ts_gen = ImageDataGenerator(rescale=1/255)
-
+# Storage the loaders read from:
+#   'records' - sequential TFRecord shards, exported once per split
+#   'cache'   - pre-decoded uint8 rows, memory-mapped per split and IMAGE_SIZE
+#   'files'   - one image file read per sample
+DATA_SOURCE = 'records'
+
+# Under a cluster every worker loads its own shard of the training and
+# validation splits, in batches of one replica (see fit_accumulated); the
+# chief evaluates the whole splits after training
+train_split, valid_split, LOADER_BATCH_SIZE = (tr_df, 'train'), (valid_df, 'valid'), BATCH_SIZE
+if MULTI_WORKER:
+    train_split = shard_split(tr_df, 'train', tpu_strategy)
+    valid_split = shard_split(valid_df, 'valid', tpu_strategy, even=False)
+    LOADER_BATCH_SIZE = BATCH_SIZE // tpu_strategy.num_replicas_in_sync
+
+tr_gen = flow_from_split(*train_split, source=DATA_SOURCE,
+                         batch_size=LOADER_BATCH_SIZE, target_size=IMAGE_SIZE,
+                         augmentation=_gen)
+
+# Validation is decoded once into memory and never augmented, so the
+# val_* metrics the callbacks watch are the same images every epoch
+valid_gen = flow_from_split(*valid_split, source='memory',
+                            batch_size=LOADER_BATCH_SIZE, target_size=IMAGE_SIZE,
+                            shuffle=False, class_indices=tr_gen.class_indices)
+
+# Under a cluster only the chief loads the test split, after training (end
+# of section 4), so workers sharing a cache never export the same split
+if not MULTI_WORKER:
+    ts_gen = flow_from_split(ts_df, 'test', source=DATA_SOURCE,
+                             batch_size=BATCH_SIZE, target_size=IMAGE_SIZE,
+                             shuffle=False)
 
-tr_gen = _gen.flow_from_dataframe(tr_df, x_col='Class Path',
-                                 y_col='Class', batch_size=BATCH_SIZE,
-                                 target_size=IMAGE_SIZE)
-
-valid_gen = _gen.flow_from_dataframe(valid_df, x_col='Class Path',
-                                    y_col='Class', batch_size=BATCH_SIZE,
-                                    target_size=IMAGE_SIZE)
-
-ts_gen = ts_gen.flow_from_dataframe(ts_df, x_col='Class Path',
-                                   y_col='Class', batch_size=BATCH_SIZE,
-                                   target_size=IMAGE_SIZE, shuffle=False)
 
 ## 2.4 Getting samples from data
 # Get the class dictionary and classes list
@@ -157,7 +195,7 @@ class_dict = tr_gen.class_indices
 classes = list(class_dict.keys())
 
 # Get a batch of images
-images, labels = next(ts_gen)
+images, labels = next(iter(valid_gen if MULTI_WORKER else ts_gen))
 
 # Calculate grid dimensions based on number of images
 n_images = len(images)
@@ -179,156 +217,96 @@ plt.show()
 
 
 # 3. Building Deep Learning Model
-class SAM(Model):
-    def __init__(self, filters):
-        super(SAM, self).__init__()
-        self.filters = filters
-        self.conv1 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        self.conv2 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        self.conv3 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        self.conv4 = Conv2D(self.filters // 4, 1,
-                            activation='relu', kernel_initializer='he_normal')
-        self.W1 = Conv2D(self.filters // 4, 1,
-                         activation='sigmoid', kernel_initializer='he_normal')
-        self.W2 = Conv2D(self.filters // 4, 1,
-                         activation='sigmoid', kernel_initializer='he_normal')
-
-    def call(self, inputs):
-        out1 = self.conv3(self.conv2(self.conv1(inputs)))
-        out2 = self.conv4(inputs)
-
-        pool1 = GlobalAveragePooling2D()(out2)
-        pool1 = Reshape((1, 1, self.filters // 4))(pool1)
-        merge1 = self.W1(pool1)
-
-        pool2 = GlobalMaxPooling2D()(out2)
-        pool2 = Reshape((1, 1, self.filters // 4))(pool2)
-        merge2 = self.W2(pool2)
-
-        out3 = merge1 + merge2
-        y = Multiply()([out1, out3]) + out2
-        return y
-
-
-class CAM(Model):
-    def __init__(self, filters, reduction_ratio=16):
-        super(CAM, self).__init__()
-        self.filters = filters
-        self.conv1 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        self.conv2 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        self.conv3 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        self.conv4 = Conv2D(self.filters // 4, 1,
-                            activation='relu', kernel_initializer='he_normal')
-        self.gpool = GlobalAveragePooling2D()
-        self.fc1 = Dense(self.filters // (4 * reduction_ratio),
-                         activation='relu', use_bias=False)
-        self.fc2 = Dense(self.filters // 4,
-                         activation='sigmoid', use_bias=False)
-
-    def call(self, inputs):
-        out1 = self.conv3(self.conv2(self.conv1(inputs)))
-        out2 = self.conv4(inputs)
-        out3 = self.fc2(self.fc1(self.gpool(out2)))
-        out3 = Reshape((1, 1, self.filters // 4))(out3)
-        y = Multiply()([out1, out3]) + out2
-        return y
-
-
-class ResizeLayer(Layer):
-    def __init__(self, target_height, target_width, **kwargs):
-        super(ResizeLayer, self).__init__(**kwargs)
-        self.target_height = target_height
-        self.target_width = target_width
-
-    def call(self, inputs):
-        return tf.image.resize(inputs, (self.target_height, self.target_width))
-
-
-def adjust_feature_map(x, target_shape):
-    _, h, w, _ = target_shape
-    current_h, current_w = x.shape[1:3]
-    if current_h != h or current_w != w:
-        resize_layer = ResizeLayer(h, w)
-        return resize_layer(x)
-    return x
-
-
-# AS_Net with MobileNetV3 encoder
-def AS_Net(encoder='mobilenetv3', input_size=(224, 224, 3), fine_tune_at=None, reg_factor=0.0005):  # Reduced reg_factor # Changed input size here to 224x224
-    inputs = Input(input_size)
-    print(f'CURRENT ENCODER: {encoder}')
-
-    if encoder == 'mobilenetv3':
-        # Load MobileNetV3Large with ImageNet weights
-        ENCODER = MobileNetV3Large(weights='imagenet', include_top=False, input_shape=input_size) # Changed model to MobileNetV3Large
-        ENCODER.summary() # Print the summary to inspect layer names
-
-        # Freeze all layers initially
-        ENCODER.trainable = False
-
-        # Optionally, unfreeze layers for fine-tuning from a certain layer
-        if fine_tune_at is not None:
-            for layer in ENCODER.layers[:fine_tune_at]:
-                layer.trainable = False
-            for layer in ENCODER.layers[fine_tune_at:]:
-                layer.trainable = True
-
-        # Selected output layers from MobileNetV3Large - Adjusted based on MobileNetV3Large architecture
-        layer_names = [
-            'expanded_conv_depthwise',   # block_2 - relatively early features
-            'expanded_conv_1_depthwise', # block_5 - mid-level features
-            'expanded_conv_5_depthwise', # block_11 - deeper features
-            'expanded_conv_10_depthwise', # block_14 - even deeper
-            'conv_1'                      # last conv layer before pooling # changed from 'Conv_1' to 'conv_1' (lowercase 'c')
-        ]
-        output_layers = [ENCODER.get_layer(name).output for name in layer_names]
-
-
-    else:
-        raise ValueError("Unsupported encoder type. Only 'mobilenetv3' is supported in this case.")
+# The attention blocks and AS_Net are in common/asnet.py, shared with
+# efficientnet_v2; importing it registers their layers, so
+# best_model.keras reloads without custom_objects
 
-    outputs = [Model(inputs=ENCODER.inputs, outputs=layer)(inputs)
-               for layer in output_layers]
+# Encoder of the registry in common/encoders.py, and the layers it taps
+ENCODER_NAME = 'mobilenetv3'
+ENCODER_LAYERS = ENCODERS[ENCODER_NAME]['layers']
 
-    # Adjust and merge feature maps
-    merged = outputs[-1]
-    for i in range(len(outputs) - 2, -1, -1):
-        adjusted = adjust_feature_map(outputs[i], merged.shape)
-        merged = concatenate([merged, adjusted], axis=-1)
 
-    # Apply SAM and CAM, scale filters dynamically based on merged feature size
-    filters = merged.shape[-1]
-    SAM1 = SAM(filters=filters)(merged)
-    CAM1 = CAM(filters=filters)(merged)
-
-    # Combine SAM and CAM outputs
-    combined = concatenate([SAM1, CAM1], axis=-1)
-
-    # Simplify the final layers
-    final_layers = Sequential([
-        Conv2D(128, 3, activation='relu', padding='same'),
-        BatchNormalization(),
-        GlobalAveragePooling2D(),
-        Dense(256, activation='relu'),
-        Dropout(0.3),
-        Dense(4, activation='softmax')
-    ])
-
-    output = final_layers(combined)
+# Create and compile the model
+# None keeps the whole encoder frozen, which lets section 4 train the head
+# from stored encoder features
+FINE_TUNE_AT = None
+# True XLA-compiles the train/eval steps (the attention blocks are
+# static-shaped; see benchmarks/xla.py); None leaves it to Keras' 'auto',
+# which keeps XLA off on CPU-only machines
+JIT_COMPILE = None
+# One conv trunk shared by the SAM and CAM branches instead of one each
+# (about half the head FLOPs; see benchmarks/attention.py)
+FUSED_ATTENTION = False
+# Factorized 3x3 convs in SAM/CAM: 'spatial' (3x1 then 1x3 conv through
+# FACTORIZATION_RANK channels) or 'depthwise' (depthwise conv with that depth
+# multiplier, then 1x1); None keeps full convs. See common/layers.py;
+# tools/factorize.py converts a trained checkpoint instead
+FACTORIZATION = None
+FACTORIZATION_RANK = None
+# Channels each tapped map is projected to (1x1 conv, after anti-aliased
+# pooling) before the merge; None merges the raw resized maps. See
+# benchmarks/projection.py
+PROJECTION_WIDTH = None
+# Gradient accumulation (common/training.py): ACCUMULATION_STEPS loader
+# batches of BATCH_SIZE make one optimizer update, so the effective batch is
+# BATCH_SIZE * ACCUMULATION_STEPS at the activation memory of one BATCH_SIZE
+# batch; None trains with fit(). See benchmarks/accumulation.py
+ACCUMULATION_STEPS = None
+# Preemption-safe training (common/training.py): with a CHECKPOINT_DIR,
+# training runs through fit_accumulated, which checkpoints the model,
+# optimizer, callbacks and loader position every CHECKPOINT_EVERY updates and
+# at every epoch end; running the script again resumes from the latest one,
+# mid-epoch if need be. See tools/resume_check.py
+CHECKPOINT_DIR = None
+CHECKPOINT_EVERY = 100
+# Keras dtype policy: 'float32', 'mixed_bfloat16' (CPUs with BF16/AMX, TPUs)
+# or 'mixed_float16' (GPUs, with automatic loss scaling); see common/precision.py
+PRECISION = 'float32'
+set_precision(PRECISION)
+# Distill a trained teacher checkpoint into this model, e.g. the VGG16
+# AS_Net's '../vgg16/best_model.keras'; None trains on hard labels only. The
+# teacher always sees the student's augmented input: with the encoder frozen
+# its probabilities are stored with every feature variant, with FINE_TUNE_AT
+# set it runs on every training batch (common/distillation.py)
+TEACHER_MODEL = None
+TEACHER_SCRIPT = 'vgg16'
+DISTILL_TEMPERATURE = 4.0
+DISTILL_ALPHA = 0.5  # Weight of the hard-label loss; the rest goes to the teacher
+
+
+def compile_model(compiled):
+    compiled.compile(
+        optimizer=Adam(learning_rate=lr_schedule),
+        loss='categorical_crossentropy',
+        jit_compile=compiled.jit_compile,
+        metrics=[
+            'accuracy',
+            tf.keras.metrics.Precision(name='precision'),
+            tf.keras.metrics.Recall(name='recall'),
+            tf.keras.metrics.AUC(name='auc')
+        ]
+    )
 
-    model = Model(inputs=inputs, outputs=output)
-    return model
 
-# Create and compile the model
 # Add to model compilation
 with tpu_strategy.scope():
-    model = AS_Net(encoder='mobilenetv3', fine_tune_at=None) # Changed encoder to mobilenetv3 and removed fine_tune_at for now
+    model = AS_Net(encoder=ENCODER_NAME, fine_tune_at=FINE_TUNE_AT, jit_compile=JIT_COMPILE,
+                   fused_attention=FUSED_ATTENTION, projection_width=PROJECTION_WIDTH,
+                   factorization=FACTORIZATION, factorization_rank=FACTORIZATION_RANK) # Changed encoder to mobilenetv3 and removed fine_tune_at for now
+    head = model.get_layer('head')
+    # The model trains through the Distiller when there is a teacher
+    # (section 4): the head on stored teacher probabilities, the whole model
+    # with the teacher run online
+    teacher = distiller = None
+    if TEACHER_MODEL is not None:
+        teacher = load_teacher(TEACHER_SCRIPT, TEACHER_MODEL)
+        if FINE_TUNE_AT is None:
+            distiller = Distiller(head, temperature=DISTILL_TEMPERATURE, alpha=DISTILL_ALPHA,
+                                  saved_model=model)
+        else:
+            distiller = Distiller(model, temperature=DISTILL_TEMPERATURE, alpha=DISTILL_ALPHA,
+                                  teacher=teacher)
+        distiller.jit_compile = distiller.student.jit_compile
 
     # Use learning rate warmup and decay
     initial_learning_rate = 1e-4
@@ -337,25 +315,19 @@ with tpu_strategy.scope():
 
     lr_schedule = tf.keras.optimizers.schedules.CosineDecayRestarts(
         initial_learning_rate,
-        first_decay_steps=warmup_epochs * len(tr_gen),
+        # In optimizer updates, ACCUMULATION_STEPS batches each
+        first_decay_steps=warmup_epochs * len(tr_gen) // (ACCUMULATION_STEPS or 1),
         t_mul=2.0,
         m_mul=0.9,
         alpha=1e-6
     )
 
-    optimizer = Adam(learning_rate=lr_schedule)
-
-    # Add weighted metrics
-    model.compile(
-        optimizer=optimizer,
-        loss='categorical_crossentropy',
-        metrics=[
-            'accuracy',
-            tf.keras.metrics.Precision(name='precision'),
-            tf.keras.metrics.Recall(name='recall'),
-            tf.keras.metrics.AUC(name='auc')
-        ]
-    )
+    # Add weighted metrics; the head (and its distiller) is compiled on its
+    # own as well, for training from stored features
+    for compiled in (model, head, distiller):
+        if compiled is None:
+            continue
+        compile_model(compiled)
 
 model.summary()
 
@@ -367,7 +339,7 @@ num_epochs = 35
 
 # Add TensorBoard callback
 tensorboard_callback = tf.keras.callbacks.TensorBoard(
-    log_dir='logs', histogram_freq=1, write_graph=True, profile_batch=0)
+    log_dir=worker_path('logs', tpu_strategy), histogram_freq=1, write_graph=True, profile_batch=0)
 
 early_stopping = tf.keras.callbacks.EarlyStopping(
     monitor='val_loss', patience=3, restore_best_weights=True)
@@ -390,32 +362,126 @@ def get_class_weights(y):
     )
     return dict(enumerate(class_weights))
 
-# Calculate balanced class weights
+# Calculate balanced class weights, over the whole training split
+train_classes = tr_df['Class'].map(tr_gen.class_indices).to_numpy()
 class_weights = compute_class_weight(
     'balanced',
-    classes=np.unique(tr_gen.classes),
-    y=tr_gen.classes
+    classes=np.unique(train_classes),
+    y=train_classes
 )
 class_weight_dict = dict(enumerate(class_weights))
 
-# Use in training
-hist = model.fit(
-    tr_gen,
-    epochs=num_epochs,
-    validation_data=valid_gen,
-    shuffle=True,
-    class_weight=class_weight_dict,  # Use computed class weights
-    callbacks=[
-        early_stopping,
-        tensorboard_callback,
-        ModelCheckpoint(
-            'best_model.keras',
-            monitor='val_loss',
-            save_best_only=True,
-            mode='min'
-        )
-    ]
-)
+# Head-only training from stored features: with the encoder frozen its
+# outputs never change, so they are computed once per image (FEATURE_VARIANTS
+# augmented copies for training) and every epoch only runs SAM/CAM and the
+# classifier. The head shares its weights with `model`, which section 5 uses
+USE_FEATURE_STORE = FINE_TUNE_AT is None
+FEATURE_VARIANTS = 4
+
+if USE_FEATURE_STORE:
+    features = model.get_layer('features')
+    tr_store = build_feature_store(features, *train_split, ENCODER_NAME, ENCODER_LAYERS,
+                                   augmentation=_gen, variants=FEATURE_VARIANTS,
+                                   class_indices=tr_gen.class_indices, teacher=teacher)
+    valid_store = build_feature_store(features, *valid_split, ENCODER_NAME, ENCODER_LAYERS,
+                                      class_indices=tr_gen.class_indices)
+    fit_model = head
+    fit_data = flow_from_feature_store(tr_store, batch_size=LOADER_BATCH_SIZE,
+                                       soft_targets=teacher is not None)
+    fit_valid = flow_from_feature_store(valid_store, batch_size=LOADER_BATCH_SIZE, shuffle=False)
+else:
+    fit_model, fit_data, fit_valid = model, tr_gen, valid_gen
+
+# Distillation: the model learns from the teacher's probabilities as well
+# as the labels; checkpoints still hold the plain image model
+if distiller is not None:
+    fit_model = distiller
+
+# Progressive resizing (common/progressive.py): the first epochs train at
+# PROGRESSIVE_START_SIZE and the size steps up to IMAGE_SIZE over
+# PROGRESSIVE_STAGES sizes, with one pre-built model per size sharing the
+# weights; None trains at IMAGE_SIZE throughout. It trains the whole model
+# on images, so it needs FINE_TUNE_AT set. The callbacks run in the final
+# stage. See benchmarks/progressive.py for the wall-clock comparison
+PROGRESSIVE_START_SIZE = None
+PROGRESSIVE_STAGES = 3
+
+callbacks = [
+    early_stopping,
+    tensorboard_callback,
+    # Always the full image model, also while only the head is fitted
+    FullModelCheckpoint(
+        model,
+        worker_path('best_model.keras', tpu_strategy),
+        monitor='val_loss',
+        save_best_only=True,
+        mode='min'
+    )
+]
+
+if ACCUMULATION_STEPS is not None or CHECKPOINT_DIR is not None or MULTI_WORKER:
+    if PROGRESSIVE_START_SIZE is not None:
+        raise ValueError('PROGRESSIVE_START_SIZE cannot be combined with ACCUMULATION_STEPS, '
+                         'CHECKPOINT_DIR or a cluster')
+    hist = fit_accumulated(
+        fit_model,
+        fit_data,
+        epochs=num_epochs,
+        accumulation_steps=ACCUMULATION_STEPS or 1,
+        validation_data=fit_valid,
+        class_weight=class_weight_dict,
+        callbacks=callbacks,
+        checkpoint_dir=CHECKPOINT_DIR,
+        checkpoint_every=CHECKPOINT_EVERY
+    )
+elif PROGRESSIVE_START_SIZE is None:
+    # Use in training
+    hist = fit_model.fit(
+        fit_data,
+        epochs=num_epochs,
+        validation_data=fit_valid,
+        shuffle=True,
+        class_weight=class_weight_dict,  # Use computed class weights
+        callbacks=callbacks
+    )
+else:
+    if fit_model is not model:
+        raise ValueError('Progressive resizing trains on images; set FINE_TUNE_AT and no TEACHER_MODEL')
+
+    def build_at_size(size):
+        # Same model for a smaller input; the final size is `model` itself
+        if size == IMAGE_SIZE[0]:
+            return model
+        with tpu_strategy.scope():
+            sized = AS_Net(encoder=ENCODER_NAME, input_size=(size, size, 3),
+                           fine_tune_at=FINE_TUNE_AT, jit_compile=JIT_COMPILE,
+                           fused_attention=FUSED_ATTENTION, projection_width=PROJECTION_WIDTH,
+                           factorization=FACTORIZATION, factorization_rank=FACTORIZATION_RANK)
+            compile_model(sized)
+        return sized
+
+    schedule = resize_schedule(IMAGE_SIZE[0], num_epochs, PROGRESSIVE_START_SIZE,
+                               PROGRESSIVE_STAGES)
+    model, hist = fit_progressive(build_at_size, schedule, fit_data, validation_data=fit_valid,
+                                  shuffle=True, class_weight=class_weight_dict,
+                                  callbacks=callbacks)
+
+if MULTI_WORKER:
+    # The evaluation below runs once, on the chief, with a single-process
+    # copy of the trained model and the whole splits rather than its
+    # shards; the other workers are done
+    if not is_chief(tpu_strategy):
+        sys.exit(0)
+    model = local_model(model)
+    tr_gen = flow_from_split(tr_df, 'train', source=DATA_SOURCE,
+                             batch_size=BATCH_SIZE, target_size=IMAGE_SIZE,
+                             augmentation=_gen)
+    valid_gen = flow_from_split(valid_df, 'valid', source='memory',
+                                batch_size=BATCH_SIZE, target_size=IMAGE_SIZE,
+                                shuffle=False, class_indices=tr_gen.class_indices)
+    ts_gen = flow_from_split(ts_df, 'test', source=DATA_SOURCE,
+                             batch_size=BATCH_SIZE, target_size=IMAGE_SIZE,
+                             shuffle=False)
 
 hist.history.keys()
 
@@ -571,26 +637,18 @@ weighted avg       0.75      0.76      0.74       656
 
 ## 5.2 Testing
 def predict_with_tta(model, img_path, num_augmentations=5):
-    img = Image.open(img_path)
-    resized_img = img.resize((IMAGE_SIZE)) # Use IMAGE_SIZE here
-    img_array = np.asarray(resized_img)
+    # Decodes at a reduced JPEG scale before the final (bicubic) resize
+    img_array = read_image(img_path, IMAGE_SIZE, Image.BICUBIC)
 
-    # Create augmented versions
-    predictions = []
+    # Augment all copies as one batch and predict them with the original
     aug = get_augmentation()
-
-    # Original prediction
-    base_pred = model.predict(np.expand_dims(img_array, 0)/255.0)
-    predictions.append(base_pred)
-
-    # Augmented predictions
-    for _ in range(num_augmentations):
-        aug_img = aug.random_transform(img_array)
-        aug_pred = model.predict(np.expand_dims(aug_img, 0)/255.0)
-        predictions.append(aug_pred)
+    copies = np.repeat(np.expand_dims(img_array, 0), num_augmentations, axis=0)
+    aug_imgs = aug(copies).numpy()
+    batch = np.concatenate([np.expand_dims(img_array, 0), aug_imgs]) / 255.0
+    predictions = model.predict(batch)
 
     # Average predictions
-    return np.mean(predictions, axis=0)
+    return np.mean(predictions, axis=0, keepdims=True)
 
 def predict(img_path):
     import numpy as np
@@ -598,8 +656,7 @@ def predict(img_path):
     from PIL import Image
     label = list(class_dict.keys())
     plt.figure(figsize=(12, 12))
-    img = Image.open(img_path)
-    resized_img = img.resize((IMAGE_SIZE)) # Use IMAGE_SIZE here
+    resized_img = read_image(img_path, IMAGE_SIZE, Image.BICUBIC)
 
     # Use TTA for prediction
     predictions = predict_with_tta(model, img_path)
@@ -0,0 +1,160 @@
+# tools/export_tflite.py
+#
+# Full-integer (int8) TFLite export of a trained model for CPU-only inference
+# nodes. The script's own layers (SAM/CAM/SynergyModule/ResizeLayer, ...) are
+# registered by importing its block module (common/blocks.py), so
+# best_model.keras reloads as saved.
+# Activations are calibrated on a class-stratified sample of the training
+# split. The held-out test split, rebuilt exactly as the scripts build ts_df,
+# is then run through both the float Keras model and the int8 interpreter, one
+# image at a time, to report the accuracy delta, file sizes and per-image
+# latency. The exit status is 1 when accuracy drops by more than --max-drop.
+#
+#   python tools/export_tflite.py --script vgg16 --model best_model.keras
+#   python tools/export_tflite.py --script mobilenet_v3_large --model best_model.keras \
+#       --calibration-size 500 --max-drop 0.005 --threads 4
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from sklearn.model_selection import train_test_split
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.blocks import SCRIPTS, custom_objects  # noqa: E402
+from common.evaluation import predict_per_image, split_dataset  # noqa: E402
+from common.materialize import encode_labels, materialize_images  # noqa: E402
+
+
+def float32_model(model):
+    # A model trained under a mixed-precision policy is rebuilt in float32
+    # (its variables are float32 already) so the converter sees float ops only.
+    # Nested models report float32 themselves, so the layer configs decide
+    def strip(config):
+        if isinstance(config, dict):
+            if config.get('class_name') == 'DTypePolicy':
+                return dict(config, config=dict(config['config'], name='float32'))
+            return {key: strip(value) for key, value in config.items()}
+        if isinstance(config, list):
+            return [strip(value) for value in config]
+        return config
+
+    config = model.get_config()
+    stripped = strip(config)
+    if stripped == config:
+        return model
+    rebuilt = model.__class__.from_config(stripped)
+    rebuilt.set_weights(model.get_weights())
+    return rebuilt
+
+
+def convert_int8(model, images, rescale):
+    """
+    Convert a Keras model to a full-integer TFLite flatbuffer.
+
+    Args:
+        model (keras.Model): Float32 model with a fixed input size
+        images (np.ndarray): uint8 calibration images, (N, H, W, 3)
+        rescale (float): Factor the model's inputs are scaled by in training
+
+    Returns:
+        bytes: TFLite model with uint8 input and output
+    """
+    def representative_dataset():
+        for image in images:
+            yield [image[None].astype(np.float32) * rescale]
+
+    with tempfile.TemporaryDirectory() as saved_model:
+        # Keras 3 models convert through a SavedModel with a batch-1 signature
+        model.export(saved_model, format='tf_saved_model', verbose=False,
+                     input_signature=[tf.TensorSpec((1,) + images.shape[1:], tf.float32)])
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+        return converter.convert()
+
+
+def run_tflite(content, images, rescale, threads):
+    interpreter = tf.lite.Interpreter(model_content=content, num_threads=threads)
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()[0]
+    output_index = interpreter.get_output_details()[0]['index']
+    scale, zero_point = input_details['quantization']
+    predictions, elapsed = [], 0.0
+    for image in images:
+        # Quantize as the float model sees the image: pixels * rescale
+        x = np.round(image[None].astype(np.float32) * rescale / scale + zero_point)
+        x = np.clip(x, 0, 255).astype(np.uint8)
+        start = time.perf_counter()
+        interpreter.set_tensor(input_details['index'], x)
+        interpreter.invoke()
+        predictions.append(np.argmax(interpreter.get_tensor(output_index)))
+        elapsed += time.perf_counter() - start
+    return np.asarray(predictions), elapsed / len(images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a trained model to int8 TFLite and check its accuracy.')
+    parser.add_argument('--script', required=True, choices=SCRIPTS,
+                        help='Script the model was trained with; its layers are registered before loading')
+    parser.add_argument('--model', default='best_model.keras')
+    parser.add_argument('--output', help='Defaults to the model path with .int8.tflite')
+    parser.add_argument('--data-dir', default='/brain-tumor-mri-dataset',
+                        help='Dataset root with Training/ and Testing/')
+    parser.add_argument('--calibration-size', type=int, default=200)
+    parser.add_argument('--rescale', type=float, default=1 / 255)
+    parser.add_argument('--max-drop', type=float, default=0.01,
+                        help='Largest accepted test accuracy drop of the int8 model')
+    parser.add_argument('--threads', type=int, default=1, help='TFLite interpreter threads')
+    args = parser.parse_args()
+
+    model = float32_model(tf.keras.models.load_model(args.model, compile=False,
+                                                     custom_objects=custom_objects(args.script)))
+    image_size = tuple(model.input_shape[1:3])
+
+    tr_df, _, ts_df = split_dataset(args.data_dir)
+    calibration_df, _ = train_test_split(tr_df, train_size=min(args.calibration_size, len(tr_df) - 1),
+                                         random_state=0, stratify=tr_df['Class'])
+    calibration = materialize_images(calibration_df['Class Path'], image_size,
+                                     resample=Image.BICUBIC, verbose=False)
+    _, class_indices = encode_labels(tr_df['Class'])
+    test_images = materialize_images(ts_df['Class Path'], image_size, resample=Image.BICUBIC,
+                                     verbose=False)
+    test_labels = np.argmax(encode_labels(ts_df['Class'], class_indices)[0], axis=-1)
+
+    content = convert_int8(model, calibration, args.rescale)
+    output = args.output or os.path.splitext(args.model)[0] + '.int8.tflite'
+    with open(output, 'wb') as f:
+        f.write(content)
+
+    float_pred, float_latency = predict_per_image(model, test_images, args.rescale)
+    int8_pred, int8_latency = run_tflite(content, test_images, args.rescale, args.threads)
+    float_acc = np.mean(float_pred == test_labels)
+    int8_acc = np.mean(int8_pred == test_labels)
+    float_size, int8_size = os.path.getsize(args.model), len(content)
+
+    print(f'{args.script}: calibrated on {len(calibration)} training images, '
+          f'tested on {len(test_images)} held-out images')
+    print(f'float32 keras  {float_acc:.4f} accuracy  {float_size / 2**20:8.1f} MiB  '
+          f'{float_latency * 1000:7.1f} ms/image')
+    print(f'int8 tflite    {int8_acc:.4f} accuracy  {int8_size / 2**20:8.1f} MiB  '
+          f'{int8_latency * 1000:7.1f} ms/image')
+    print(f'delta          {int8_acc - float_acc:+.4f} accuracy  {float_size / int8_size:7.1f}x smaller  '
+          f'{float_latency / int8_latency:7.2f}x faster  '
+          f'({np.mean(int8_pred == float_pred):.4f} agreement)')
+    print(f'Wrote {output}')
+    if float_acc - int8_acc > args.max_drop:
+        print(f'Accuracy drop {float_acc - int8_acc:.4f} exceeds --max-drop {args.max_drop}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# tools/factorize.py
+#
+# Post-training low-rank compression of a trained AS_Net checkpoint: the full
+# 3x3 convs of SAM/CAM (conv1-conv3 of each trunk) and of the SynergyModule
+# are replaced by FactorizedConv2D layers (common/layers.py) whose factors
+# come from a truncated SVD of the trained kernels, so the converted model
+# starts close to the original instead of from scratch. Every other weight
+# is copied as it is. Each rank is recovered by brief fine-tuning on the
+# training split and scored on the held-out test split (accuracy, batch-1
+# latency, FLOPs), like tools/prune.py. Training with FACTORIZATION set in a
+# script builds the same layers from scratch.
+#
+#   python tools/factorize.py --script vgg16 --model best_model.keras
+#   python tools/factorize.py --script mobilenet_v3_large --model best_model.keras \
+#       --factorization depthwise --ranks 1 2 4
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.blocks import SCRIPTS, custom_objects  # noqa: E402
+from common.evaluation import fine_tune, print_tradeoff, recovery_data, score  # noqa: E402
+from common.layers import FACTORIZATIONS  # noqa: E402
+from common.surgery import named_layers, rebuild  # noqa: E402
+
+DEFAULT_RANKS = {'spatial': [16, 32, 64], 'depthwise': [1, 2]}
+
+
+def _full_convs(layer):
+    # The full 3x3 convs of an attention block that FactorizedConv2D replaces
+    kind = type(layer).__name__
+    if kind == 'SynergyModule':
+        return ['conv']
+    trunk_owner = 'sam.' if kind == 'FusedAttention' else ''
+    trunk = layer.sam if kind == 'FusedAttention' else layer
+    if kind in ('SAM', 'CAM', 'FusedAttention') and trunk.has_trunk:
+        return [trunk_owner + name for name in ('conv1', 'conv2', 'conv3')]
+    return []
+
+
+def _sublayer(layer, dotted):
+    for name in dotted.split('.'):
+        layer = getattr(layer, name)
+    return layer
+
+
+def factorize(model, factorization, rank):
+    """
+    Rebuild `model` with factorized attention convs initialized from its kernels.
+
+    Args:
+        model (keras.Model): Loaded AS_Net checkpoint with full convs
+        factorization (str): One of FACTORIZATIONS
+        rank (int): Rank (spatial) or depth multiplier (depthwise) of every
+            factorized conv
+
+    Returns:
+        keras.Model: Factorized model
+    """
+    targets = {path: _full_convs(layer) for path, layer in named_layers(model)
+               if _full_convs(layer) and not getattr(layer, 'factorization', None)}
+    if not targets:
+        raise ValueError('The model has no full SAM/CAM/SynergyModule convs to factorize')
+
+    def edit(configs):
+        for path in targets:
+            configs[path]['config'].update(factorization=factorization, rank=rank)
+
+    factorized = rebuild(model, edit)
+    old_layers = dict(named_layers(model))
+    for path, layer in named_layers(factorized):
+        if isinstance(layer, tf.keras.Model) or not layer.weights:
+            continue
+        old = old_layers[path]
+        if path not in targets:
+            layer.set_weights(old.get_weights())
+            continue
+        # The factorized convs are set by SVD, everything else in order
+        old_convs = [_sublayer(old, name) for name in targets[path]]
+        new_convs = [_sublayer(layer, name) for name in targets[path]]
+        replaced = {id(w) for conv in old_convs + new_convs for w in conv.weights}
+        for new, weights in zip([w for w in layer.weights if id(w) not in replaced],
+                                [w for w in old.weights if id(w) not in replaced]):
+            new.assign(weights)
+        for old_conv, new_conv in zip(old_convs, new_convs):
+            new_conv.load_kernel(old_conv.kernel.numpy(),
+                                 old_conv.bias.numpy() if old_conv.use_bias else None)
+    return factorized
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Factorize the AS_Net attention convs of a trained model.')
+    parser.add_argument('--script', required=True, choices=SCRIPTS,
+                        help='Script the model was trained with; its layers are registered before loading')
+    parser.add_argument('--model', default='best_model.keras')
+    parser.add_argument('--output-dir', help='Where factorized models are saved, defaults to the model directory')
+    parser.add_argument('--data-dir', default='/brain-tumor-mri-dataset',
+                        help='Dataset root with Training/ and Testing/')
+    parser.add_argument('--factorization', default='spatial', choices=FACTORIZATIONS)
+    parser.add_argument('--ranks', type=int, nargs='+',
+                        help=f'Ranks / depth multipliers to try, default {DEFAULT_RANKS}')
+    parser.add_argument('--steps', type=int, default=200, help='Recovery fine-tuning steps')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--rescale', type=float, default=1 / 255)
+    args = parser.parse_args()
+
+    model = tf.keras.models.load_model(args.model, compile=False,
+                                       custom_objects=custom_objects(args.script))
+    image_size = tuple(model.input_shape[1:3])
+    train, test_images, test_labels = recovery_data(args.data_dir, image_size, args.batch_size,
+                                                    args.rescale)
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.model))
+    stem = os.path.splitext(os.path.basename(args.model))[0]
+    rows = [dict(score(model, test_images, test_labels, args.rescale), label='full convs',
+                 path=args.model)]
+    for rank in args.ranks or DEFAULT_RANKS[args.factorization]:
+        factorized = factorize(model, args.factorization, rank)
+        # Accuracy straight after the SVD shows how much the fine-tuning recovers
+        predictions = factorized.predict(test_images.astype(np.float32) * args.rescale,
+                                         batch_size=args.batch_size, verbose=0)
+        print(f'{args.factorization} {rank}: {np.mean(np.argmax(predictions, axis=-1) == test_labels):.4f} '
+              f'accuracy before fine-tuning')
+        factorized = fine_tune(factorized, train, args.steps, args.learning_rate)
+        path = os.path.join(output_dir, f'{stem}.{args.factorization}{rank}.keras')
+        factorized.save(path)
+        rows.append(dict(score(factorized, test_images, test_labels, args.rescale),
+                         label=f'{args.factorization} {rank}', path=path))
+
+    print(f'Factorized SAM/CAM/SynergyModule 3x3 convs, fine-tuned {args.steps} steps of '
+          f'{args.batch_size}, tested on {len(test_images)} held-out images (* = Pareto-optimal)')
+    print_tradeoff(rows)
+
+
+if __name__ == '__main__':
+    main()
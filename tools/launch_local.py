@@ -0,0 +1,60 @@
+# tools/launch_local.py
+#
+# Run a training script, or any command, as the N workers of a local
+# MultiWorkerMirroredStrategy cluster (common/distributed.py): every worker
+# process gets its TF_CONFIG on free local ports and an equal share of the
+# cores, and its output is printed prefixed with its index. When one worker
+# fails the others are stopped rather than left waiting in an all-reduce.
+#
+# On several machines, start the script on each with TF_CONFIG (or the
+# script's CLUSTER_SPEC) naming all of them instead.
+#
+#   python tools/launch_local.py --workers 4 vgg16/main.py
+#   python tools/launch_local.py --workers 2 --threads 8 -- python my_training.py --epochs 5
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.distributed import join, launch_local  # noqa: E402
+
+
+def relay(index, stream):
+    for line in stream:
+        print(f'[worker {index}] {line}', end='', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a command as the workers of a local cluster.')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int,
+                        help='Intra-op threads per worker, default the cores divided by the workers')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='Script or command each worker runs; a .py file runs with this Python')
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error('no command given')
+    if command[0].endswith('.py'):
+        command = [sys.executable] + command
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+    processes = launch_local(command, args.workers, threads, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, text=True)
+    relays = [threading.Thread(target=relay, args=(index, process.stdout))
+              for index, process in enumerate(processes)]
+    for thread in relays:
+        thread.start()
+    codes = join(processes)
+    for thread in relays:
+        thread.join()
+    print(f'{args.workers} workers with {threads} threads each exited with {codes}')
+    sys.exit(next((code for code in codes if code), 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+# tools/prune.py
+#
+# Structured channel pruning of a trained AS_Net checkpoint. Output channels
+# are ranked by the L1 norm of their filters (scaled by the following
+# BatchNormalization, where there is one) and the weakest ones are removed
+# physically: the layer configs are rewritten to the narrower widths, the
+# model is rebuilt from them and the surviving slices of every affected
+# kernel are copied over, so the pruned model is a smaller dense model, not
+# a masked one. Each pruned model is fine-tuned briefly on the training split
+# and scored on the held-out test split (accuracy, batch-1 latency, FLOPs),
+# which gives the latency/accuracy Pareto curve over the sparsity levels.
+#
+# Pruned channel groups:
+#   - the first two 3x3 convs of every SAM/CAM trunk (SAM/CAM(widths=...));
+#     conv3/conv4 stay at filters // 4, their outputs meet in the attention
+#     products, the residual and the merge after it
+#   - conv and dense layers of Sequential stacks such as final_layers
+#     (Conv2D(128), Dense(256)); the classifier is kept
+#   - with --encoder, the convs of plain conv/pool encoders (VGG16) except
+#     the last one, which feeds the head; they are unfrozen for fine-tuning.
+#     EfficientNet/MobileNet encoders (residuals, depthwise and SE blocks)
+#     are left as they are
+#
+#   python tools/prune.py --script vgg16 --model best_model.keras
+#   python tools/prune.py --script mobilenet_v3_large --model best_model.keras \
+#       --sparsities 0.25 0.5 0.75 0.875 --steps 300
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.blocks import SCRIPTS, custom_objects  # noqa: E402
+from common.evaluation import fine_tune, print_tradeoff, recovery_data, score  # noqa: E402
+from common.surgery import named_layers, rebuild  # noqa: E402
+
+ATTENTION_LAYERS = ('SAM', 'CAM', 'FusedAttention')
+WIDTH_KEYS = {'Conv2D': 'filters', 'Dense': 'units'}
+# Layers that keep the channel axis as it is between a pruned layer and the
+# layer consuming its channels
+PASSTHROUGH = ('BatchNormalization', 'Dropout', 'Activation', 'ReLU', 'MaxPooling2D',
+               'AveragePooling2D', 'GlobalAveragePooling2D', 'GlobalMaxPooling2D')
+ENCODER_LAYERS = ('InputLayer', 'Conv2D', 'MaxPooling2D')
+
+
+def _weight_index(layer, variable):
+    return [id(w) for w in layer.weights].index(id(variable))
+
+
+def _filter_norms(kernel):
+    kernel = np.abs(kernel.numpy())
+    return kernel.reshape(-1, kernel.shape[-1]).sum(axis=0)
+
+
+def _trunk_groups(path, layer):
+    # The trunk of a FusedAttention lives in its SAM
+    trunk = layer.sam if type(layer).__name__ == 'FusedAttention' else layer
+    # Factorized trunk convs (common/layers.py) have no single kernel to rank
+    if not trunk.has_trunk or trunk.factorization:
+        return []
+    groups = []
+    for position, (conv, consumer) in enumerate([(trunk.conv1, trunk.conv2),
+                                                 (trunk.conv2, trunk.conv3)]):
+        groups.append({
+            'name': f"{'/'.join(path)}/conv{position + 1}",
+            'importance': _filter_norms(conv.kernel),
+            'slices': [(path, _weight_index(layer, conv.kernel), 3),
+                       (path, _weight_index(layer, conv.bias), 0),
+                       (path, _weight_index(layer, consumer.kernel), 2)],
+            'edit': (path, 'widths', position),
+            'unfreeze': False,
+        })
+    return groups
+
+
+def _chain_groups(path, container, unfreeze):
+    # Layers of a Sequential (or plain conv/pool Functional) in call order;
+    # a conv/dense layer is prunable when the next weighted layer is the
+    # conv/dense consuming its channels
+    layers = [layer for layer in container.layers if type(layer).__name__ != 'InputLayer']
+    groups = []
+    for i, layer in enumerate(layers):
+        if type(layer).__name__ not in WIDTH_KEYS:
+            continue
+        layer_path = path + (layer.name,)
+        importance = _filter_norms(layer.kernel)
+        slices = [(layer_path, _weight_index(layer, layer.kernel), layer.kernel.ndim - 1)]
+        if layer.use_bias:
+            slices.append((layer_path, _weight_index(layer, layer.bias), 0))
+        for following in layers[i + 1:]:
+            kind = type(following).__name__
+            following_path = path + (following.name,)
+            if kind == 'BatchNormalization':
+                gamma = np.abs(following.gamma.numpy()) if following.scale else 1.0
+                importance = importance * gamma / np.sqrt(following.moving_variance.numpy()
+                                                          + following.epsilon)
+                slices += [(following_path, index, 0) for index in range(len(following.weights))]
+            elif kind in WIDTH_KEYS:
+                slices.append((following_path, _weight_index(following, following.kernel),
+                               following.kernel.ndim - 2))
+                groups.append({'name': '/'.join(layer_path), 'importance': importance,
+                               'slices': slices, 'edit': (layer_path, WIDTH_KEYS[type(layer).__name__], None),
+                               'unfreeze': unfreeze})
+                break
+            elif kind not in PASSTHROUGH:
+                break
+    return groups
+
+
+def prune_groups(model, encoder=False):
+    """
+    Channel groups of a model that can be pruned independently.
+
+    Args:
+        model (keras.Model): Loaded AS_Net checkpoint
+        encoder (bool): Include the convs of plain conv/pool encoders
+
+    Returns:
+        list: Group dicts with the layer 'name', per-channel 'importance',
+        the (layer path, weight index, axis) 'slices' its channels index,
+        the config 'edit' (layer path, key, list position) holding its width
+        and whether its layers are 'unfreeze'd for fine-tuning
+    """
+    groups = []
+    for path, layer in named_layers(model):
+        kind = type(layer).__name__
+        if kind in ATTENTION_LAYERS:
+            groups += _trunk_groups(path, layer)
+        elif kind == 'Sequential':
+            groups += _chain_groups(path, layer, unfreeze=False)
+        elif (encoder and isinstance(layer, tf.keras.Model)
+              and all(type(sub).__name__ in ENCODER_LAYERS for sub in layer.layers)):
+            groups += _chain_groups(path, layer, unfreeze=True)
+    return groups
+
+
+def prune(model, groups, sparsity):
+    """
+    Rebuild `model` with the least important `sparsity` of every group removed.
+
+    Args:
+        model (keras.Model): Loaded AS_Net checkpoint
+        groups (list): From prune_groups(model)
+        sparsity (float): Fraction of the channels of each group to remove
+
+    Returns:
+        keras.Model: Narrower model carrying the kept weights
+    """
+    slices, unfreeze, widths = {}, set(), []
+    for group in groups:
+        importance = group['importance']
+        keep_count = max(1, int(round(len(importance) * (1 - sparsity))))
+        keep = np.sort(np.argsort(-importance, kind='stable')[:keep_count])
+        widths.append((group['edit'], keep_count))
+        for layer_path, index, axis in group['slices']:
+            slices.setdefault(layer_path, []).append((index, axis, keep))
+            if group['unfreeze']:
+                unfreeze.add(layer_path)
+
+    def edit(configs):
+        for (path, key, position), width in widths:
+            if position is None:
+                configs[path]['config'][key] = width
+            else:
+                configs[path]['config'][key][position] = width
+
+    pruned = rebuild(model, edit)
+    old_layers = dict(named_layers(model))
+    for path, layer in named_layers(pruned):
+        if isinstance(layer, tf.keras.Model) or not layer.weights:
+            continue
+        weights = [w.numpy() for w in old_layers[path].weights]
+        for index, axis, keep in slices.get(path, []):
+            weights[index] = np.take(weights[index], keep, axis=axis)
+        layer.set_weights(weights)
+        if path in unfreeze:
+            layer.trainable = True
+    return pruned
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prune AS_Net channels and report the latency/accuracy trade-off.')
+    parser.add_argument('--script', required=True, choices=SCRIPTS,
+                        help='Script the model was trained with; its layers are registered before loading')
+    parser.add_argument('--model', default='best_model.keras')
+    parser.add_argument('--output-dir', help='Where pruned models are saved, defaults to the model directory')
+    parser.add_argument('--data-dir', default='/brain-tumor-mri-dataset',
+                        help='Dataset root with Training/ and Testing/')
+    parser.add_argument('--sparsities', type=float, nargs='+', default=[0.25, 0.5, 0.75])
+    parser.add_argument('--encoder', action='store_true',
+                        help='Also prune (and unfreeze) the convs of plain conv/pool encoders such as VGG16')
+    parser.add_argument('--steps', type=int, default=200, help='Fine-tuning steps after pruning')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--rescale', type=float, default=1 / 255)
+    args = parser.parse_args()
+
+    model = tf.keras.models.load_model(args.model, compile=False,
+                                       custom_objects=custom_objects(args.script))
+    image_size = tuple(model.input_shape[1:3])
+    groups = prune_groups(model, encoder=args.encoder)
+    print(f'{args.script}: {len(groups)} channel groups, '
+          f'{sum(len(group["importance"]) for group in groups)} channels')
+
+    train, test_images, test_labels = recovery_data(args.data_dir, image_size, args.batch_size,
+                                                    args.rescale)
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.model))
+    stem = os.path.splitext(os.path.basename(args.model))[0]
+    rows = [dict(score(model, test_images, test_labels, args.rescale),
+                 label='unpruned', path=args.model)]
+    for sparsity in args.sparsities:
+        pruned = fine_tune(prune(model, groups, sparsity), train, args.steps, args.learning_rate)
+        path = os.path.join(output_dir, f'{stem}.pruned{round(sparsity * 100)}.keras')
+        pruned.save(path)
+        rows.append(dict(score(pruned, test_images, test_labels, args.rescale),
+                         label=f'sparsity {sparsity:.3f}', path=path))
+
+    print(f'Fine-tuned {args.steps} steps of {args.batch_size} after pruning, '
+          f'tested on {len(test_images)} held-out images (* = Pareto-optimal)')
+    print_tradeoff(rows)
+
+
+if __name__ == '__main__':
+    main()
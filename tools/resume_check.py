@@ -0,0 +1,207 @@
+# tools/resume_check.py
+#
+# Kill-and-resume check of the resumable training in common/training.py: a
+# script's AS_Net is trained twice from the same seed, once straight through
+# and once SIGKILLed mid-epoch (as a preempted machine would be) and then
+# started again on the same checkpoint directory. The resumed run has to end
+# bit-identical to the uninterrupted one - every weight, every optimizer
+# variable and every History entry - which only holds if the checkpoints
+# carry the whole training state: model, optimizer, metric totals, callbacks
+# and the input pipeline's iterator. Exits non-zero when anything differs.
+#
+# Both runs use op determinism, a seeded, shuffled and augmented training
+# loader, dropout, class weights, EarlyStopping, ReduceLROnPlateau and
+# ModelCheckpoint, so each of those has to come back from the checkpoint.
+#
+#   python tools/resume_check.py --script mobilenet_v3_large
+#   python tools/resume_check.py --script vgg16 --source records --accumulation-steps 2
+#   python tools/resume_check.py --data-dir /tmp/small --weights none --image-size 96  # smoke test
+
+import argparse
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.augmentation import BatchAugmentation  # noqa: E402
+from common.blocks import AS_NET_SCRIPTS, as_net  # noqa: E402
+from common.data_pipeline import flow_from_split  # noqa: E402
+from common.evaluation import split_dataset  # noqa: E402
+from common.training import fit_accumulated  # noqa: E402
+
+
+class KillAt(tf.keras.callbacks.Callback):
+    """SIGKILL the process once `update` optimizer updates are done."""
+
+    def __init__(self, update):
+        super(KillAt, self).__init__()
+        self.update = update
+        self.updates = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.updates += 1
+        if self.updates == self.update:
+            os.kill(os.getpid(), signal.SIGKILL)
+
+
+def train(args):
+    # Child process: one (possibly resumed) run, final state saved to run_dir
+    tf.config.experimental.enable_op_determinism()
+    tf.keras.utils.set_random_seed(0)
+    build = as_net(args.script)
+    tr_df, valid_df, _ = split_dataset(args.data_dir)
+    target_size = (args.image_size, args.image_size)
+    augmentation = BatchAugmentation(rotation_range=10, width_shift_range=0.1,
+                                     height_shift_range=0.1, zoom_range=0.1, horizontal_flip=True,
+                                     seed=0)
+    train_data = flow_from_split(tr_df, 'train', source=args.source, target_size=target_size,
+                                 shuffle=True, seed=0, batch_size=args.batch_size,
+                                 augmentation=augmentation)
+    valid_data = flow_from_split(valid_df, 'valid', source='memory', target_size=target_size,
+                                 shuffle=False, batch_size=args.batch_size,
+                                 class_indices=train_data.class_indices)
+
+    model = build(input_size=target_size + (3,), fine_tune_at=args.fine_tune_at,
+                  weights=None if args.weights == 'none' else args.weights)
+    model.compile(optimizer=tf.keras.optimizers.Adam(1e-4), loss='categorical_crossentropy',
+                  metrics=['accuracy', tf.keras.metrics.Precision(name='precision'),
+                           tf.keras.metrics.Recall(name='recall'), tf.keras.metrics.AUC(name='auc')])
+    class_weight = dict(enumerate(len(tr_df) / (len(train_data.class_indices)
+                                                * np.bincount(train_data.classes))))
+    callbacks = [
+        tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=args.epochs,
+                                         restore_best_weights=True),
+        # patience=0 so the learning rate actually changes within a short run
+        tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=0),
+        tf.keras.callbacks.ModelCheckpoint(os.path.join(args.run_dir, 'best_model.keras'),
+                                           monitor='val_loss', save_best_only=True),
+    ]
+    if args.kill_at_update:
+        callbacks.append(KillAt(args.kill_at_update))
+    hist = fit_accumulated(model, train_data, epochs=args.epochs,
+                           accumulation_steps=args.accumulation_steps,
+                           validation_data=valid_data, class_weight=class_weight,
+                           callbacks=callbacks, verbose=2,
+                           checkpoint_dir=os.path.join(args.run_dir, 'checkpoints'),
+                           checkpoint_every=args.checkpoint_every)
+
+    state = {f'model/{v.path}': v.numpy() for v in model.variables}
+    state.update({f'optimizer/{v.path}': v.numpy() for v in model.optimizer.variables})
+    np.savez(os.path.join(args.run_dir, 'state.npz'), **state)
+    return {'history': {key: [float(value) for value in values]
+                        for key, values in hist.history.items()}}
+
+
+def compare(reference_dir, resumed_dir, reference, resumed):
+    """Names of the variables and History entries that differ between two runs."""
+    with np.load(os.path.join(reference_dir, 'state.npz')) as a, \
+            np.load(os.path.join(resumed_dir, 'state.npz')) as b:
+        if set(a.files) != set(b.files):
+            return sorted(set(a.files) ^ set(b.files))
+        differences = []
+        for name in a.files:
+            if not np.array_equal(a[name], b[name]):
+                gap = np.max(np.abs(a[name].astype(np.float64) - b[name].astype(np.float64)))
+                differences.append(f'{name} (max |difference| {gap:.3g})')
+        print(f'{len(a.files) - len(differences)}/{len(a.files)} model and optimizer '
+              f'variables bit-identical')
+    for key in sorted(set(reference['history']) | set(resumed['history'])):
+        if reference['history'].get(key) != resumed['history'].get(key):
+            differences.append(f'history[{key!r}]: {reference["history"].get(key)} '
+                               f'!= {resumed["history"].get(key)}')
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that a killed and resumed training run '
+                                                 'ends bit-identical to an uninterrupted one.')
+    parser.add_argument('--script', default='mobilenet_v3_large', choices=AS_NET_SCRIPTS)
+    parser.add_argument('--data-dir', default='/brain-tumor-mri-dataset',
+                        help='Dataset root with Training/ and Testing/')
+    parser.add_argument('--source', default='cache', choices=['records', 'cache', 'files'],
+                        help='Storage the training loader reads from')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--accumulation-steps', type=int, default=1)
+    parser.add_argument('--checkpoint-every', type=int, default=2,
+                        help='Updates between checkpoints within an epoch')
+    parser.add_argument('--kill-at', type=int,
+                        help='Update after which the run is killed; defaults to the middle of the last epoch')
+    parser.add_argument('--fine-tune-at', type=int,
+                        help='First trainable encoder layer; None keeps the encoder frozen')
+    parser.add_argument('--weights', default='imagenet', choices=['imagenet', 'none'],
+                        help="Encoder weights; 'none' skips the download, for smoke tests")
+    parser.add_argument('--run', choices=['reference', 'resumed'], help=argparse.SUPPRESS)
+    parser.add_argument('--run-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--kill-at-update', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(train(args)))
+        return
+
+    tr_df, _, _ = split_dataset(args.data_dir)
+    updates = math.ceil(math.ceil(len(tr_df) / args.batch_size) / args.accumulation_steps)
+    kill_at = args.kill_at or updates * (args.epochs - 1) + max(1, updates // 2 + 1)
+    if not 0 < kill_at < updates * args.epochs:
+        raise ValueError(f'--kill-at must be within the run\'s {updates * args.epochs} updates')
+
+    with tempfile.TemporaryDirectory(prefix='resume-') as root:
+        def launch(name, kill_at_update=None):
+            run_dir = os.path.join(root, name)
+            os.makedirs(run_dir, exist_ok=True)
+            command = [sys.executable, os.path.abspath(__file__), '--run', name,
+                       '--run-dir', run_dir, '--script', args.script, '--data-dir', args.data_dir,
+                       '--source', args.source, '--image-size', str(args.image_size),
+                       '--epochs', str(args.epochs), '--batch-size', str(args.batch_size),
+                       '--accumulation-steps', str(args.accumulation_steps),
+                       '--checkpoint-every', str(args.checkpoint_every), '--weights', args.weights]
+            if args.fine_tune_at is not None:
+                command += ['--fine-tune-at', str(args.fine_tune_at)]
+            if kill_at_update:
+                command += ['--kill-at-update', str(kill_at_update)]
+            return run_dir, subprocess.run(command, capture_output=True, text=True)
+
+        def result(name, process):
+            if process.returncode:
+                sys.exit(f'The {name} run failed (exit {process.returncode}):\n{process.stderr[-2000:]}')
+            return json.loads(process.stdout.strip().splitlines()[-1])
+
+        reference_dir, process = launch('reference')
+        reference = result('reference', process)
+        print(f'Reference: {args.epochs} epochs of {updates} updates without interruption')
+
+        resumed_dir, process = launch('resumed', kill_at)
+        if process.returncode != -signal.SIGKILL:
+            sys.exit(f'The run to be killed exited with {process.returncode} instead:\n'
+                     f'{process.stderr[-2000:]}')
+        latest = tf.train.latest_checkpoint(os.path.join(resumed_dir, 'checkpoints'))
+        print(f'Killed after update {kill_at} (epoch {(kill_at - 1) // updates + 1}, update '
+              f'{(kill_at - 1) % updates + 1}/{updates}); latest checkpoint '
+              f'{os.path.basename(latest) if latest else None}')
+        _, process = launch('resumed')
+        resumed = result('resumed', process)
+        resuming = [line for line in process.stdout.splitlines() if line.startswith('Resuming')]
+        if not resuming:
+            sys.exit('The restarted run did not resume from a checkpoint')
+        print(resuming[0])
+
+        differences = compare(reference_dir, resumed_dir, reference, resumed)
+    if differences:
+        print('The resumed run differs from the uninterrupted one:')
+        for difference in differences:
+            print(f'  {difference}')
+        sys.exit(1)
+    print('The resumed run is bit-identical to the uninterrupted one')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# tools/sweep.py
+#
+# Train AS_Net on several encoders of the registry (common/encoders.py) over
+# one decoded copy of the dataset and compare them in one table: parameters,
+# epoch time, validation/test accuracy and batch-1 inference latency.
+#
+# The train/valid/test splits are decoded once into uint8 .npy files under
+# --shm-dir (/dev/shm, i.e. RAM, where it exists) and every encoder's run
+# memory-maps them read-only, so neither JPEG decoding nor the decoded arrays
+# are repeated per encoder. Each encoder trains in its own process: the
+# precision policy and XLA state are global, so separate processes keep the
+# runs independent. --jobs > 1 trains that many encoders at once, splitting
+# the cores between them; --jobs 1 trains them back to back, which gives the
+# cleaner epoch times.
+#
+# All encoders get the head (SAM/CAM or SynergyModule and final layers) of
+# the --head script, frozen, without augmentation, at one image size, so the
+# table compares the encoders rather than the scripts' training recipes.
+#
+#   python tools/sweep.py --epochs 5
+#   python tools/sweep.py --encoders vgg16 mobilenetv3 --head vgg16 --jobs 2
+#   python tools/sweep.py --data-dir /tmp/small --weights none --epochs 1  # smoke test
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.blocks import as_net  # noqa: E402
+from common.data_pipeline import flow_from_arrays  # noqa: E402
+from common.encoders import ENCODERS  # noqa: E402
+from common.evaluation import predict_per_image, split_dataset  # noqa: E402
+from common.materialize import encode_labels, materialize_images  # noqa: E402
+
+HEADS = ('vgg16', 'efficientnet_v2', 'mobilenet_v3_large')
+SPLITS = ('train', 'valid', 'test')
+
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    """Wall-clock seconds of every training epoch."""
+
+    def on_train_begin(self, logs=None):
+        self.times = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.times.append(time.perf_counter() - self.start)
+
+
+def decode_splits(data_dir, image_size, cache_dir):
+    """
+    Decode the train/valid/test splits once into .npy files.
+
+    Args:
+        data_dir (str): Dataset root with Training/ and Testing/
+        image_size (tuple): (height, width) images are resized to
+        cache_dir (str): Directory the {split}_x.npy / {split}_y.npy files go to
+
+    Returns:
+        dict: Images per split
+    """
+    splits = dict(zip(SPLITS, split_dataset(data_dir)))
+    _, class_indices = encode_labels(splits['train']['Class'])
+    counts = {}
+    for split, df in splits.items():
+        materialize_images(df['Class Path'], image_size, resample=Image.BICUBIC,
+                           memmap_path=os.path.join(cache_dir, f'{split}_x.npy'))
+        np.save(os.path.join(cache_dir, f'{split}_y.npy'),
+                encode_labels(df['Class'], class_indices)[0])
+        counts[split] = len(df)
+    return counts
+
+
+def run_encoder(args):
+    # Child process: one encoder on the decoded splits, result as a dict
+    if args.threads:
+        tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+    tf.keras.utils.set_random_seed(0)
+    build = as_net(args.head)
+    data = {split: (np.load(os.path.join(args.run_dir, f'{split}_x.npy'), mmap_mode='r'),
+                    np.load(os.path.join(args.run_dir, f'{split}_y.npy')))
+            for split in SPLITS}
+    rescale = ENCODERS[args.run]['rescale']
+
+    model = build(encoder=args.run, input_size=data['train'][0].shape[1:],
+                  jit_compile=args.jit_compile,
+                  weights=None if args.weights == 'none' else args.weights)
+    model.compile(optimizer=tf.keras.optimizers.Adam(args.learning_rate),
+                  loss='categorical_crossentropy', metrics=['accuracy'],
+                  jit_compile=model.jit_compile)
+    train = flow_from_arrays(*data['train'], batch_size=args.batch_size, shuffle=True, seed=0,
+                             rescale=rescale)
+    valid = flow_from_arrays(*data['valid'], batch_size=args.batch_size, shuffle=False,
+                             rescale=rescale)
+    timer = EpochTimer()
+    history = model.fit(train, validation_data=valid, epochs=args.epochs, callbacks=[timer],
+                        verbose=2)
+
+    test_x, test_y = data['test']
+    test = flow_from_arrays(test_x, test_y, batch_size=args.batch_size, shuffle=False,
+                            rescale=rescale)
+    _, test_accuracy = model.evaluate(test, verbose=0)
+    predictions, latency = predict_per_image(model, test_x[:args.latency_images], rescale)
+    return {'encoder': args.run, 'params': model.count_params(),
+            'first_epoch': timer.times[0],
+            'epoch': float(np.mean(timer.times[1:] or timer.times)),
+            'val_accuracy': float(max(history.history['val_accuracy'])),
+            'test_accuracy': float(test_accuracy), 'latency': latency}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train AS_Net on several encoders over one decoded dataset.')
+    parser.add_argument('--encoders', nargs='+', choices=list(ENCODERS), default=list(ENCODERS))
+    parser.add_argument('--head', default='mobilenet_v3_large', choices=HEADS,
+                        help='Script whose AS_Net head is put on every encoder')
+    parser.add_argument('--data-dir', default='/brain-tumor-mri-dataset',
+                        help='Dataset root with Training/ and Testing/')
+    parser.add_argument('--image-size', type=int, default=224)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--learning-rate', type=float, default=1e-4)
+    parser.add_argument('--jit-compile', action='store_true')
+    parser.add_argument('--weights', default='imagenet', choices=['imagenet', 'none'],
+                        help="Encoder weights; 'none' skips the download, for smoke tests")
+    parser.add_argument('--jobs', type=int, default=1, help='Encoders trained at the same time')
+    parser.add_argument('--shm-dir', default='/dev/shm',
+                        help='Where the decoded splits live; a temporary directory if it does not exist')
+    parser.add_argument('--latency-images', type=int, default=100,
+                        help='Test images the batch-1 latency is measured on')
+    parser.add_argument('--run', choices=list(ENCODERS), help=argparse.SUPPRESS)
+    parser.add_argument('--run-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--threads', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_encoder(args)))
+        return
+
+    threads = max(1, (os.cpu_count() or 1) // args.jobs)
+    shm_dir = args.shm_dir if os.path.isdir(args.shm_dir) else None
+    with tempfile.TemporaryDirectory(prefix='sweep-', dir=shm_dir) as cache_dir:
+        start = time.perf_counter()
+        counts = decode_splits(args.data_dir, (args.image_size, args.image_size), cache_dir)
+        print(f'Decoded {counts} once into {cache_dir} in {time.perf_counter() - start:.1f}s')
+
+        def train(encoder):
+            command = [sys.executable, os.path.abspath(__file__), '--run', encoder,
+                       '--run-dir', cache_dir, '--threads', str(threads), '--head', args.head,
+                       '--epochs', str(args.epochs), '--batch-size', str(args.batch_size),
+                       '--learning-rate', str(args.learning_rate), '--weights', args.weights,
+                       '--latency-images', str(args.latency_images)]
+            if args.jit_compile:
+                command.append('--jit-compile')
+            process = subprocess.run(command, capture_output=True, text=True)
+            if process.returncode:
+                print(f'{encoder} failed:\n{process.stderr[-2000:]}')
+                return None
+            print(f'{encoder} done')
+            return json.loads(process.stdout.strip().splitlines()[-1])
+
+        with ThreadPoolExecutor(args.jobs) as pool:
+            results = [result for result in pool.map(train, args.encoders) if result]
+
+    print(f'{args.head} head, {args.image_size}px, {args.epochs} epochs of batch {args.batch_size}, '
+          f'{args.jobs} at a time with {threads} threads each, latency on '
+          f'{min(args.latency_images, counts["test"])} test images at batch 1')
+    print(f'{"encoder":<18}{"params":>9}{"1st epoch":>11}{"epoch":>9}'
+          f'{"val acc":>9}{"test acc":>10}{"ms/image":>10}')
+    for result in results:
+        print(f'{result["encoder"]:<18}{result["params"] / 1e6:8.2f}M'
+              f'{result["first_epoch"]:10.1f}s{result["epoch"]:8.1f}s'
+              f'{result["val_accuracy"]:9.4f}{result["test_accuracy"]:10.4f}'
+              f'{result["latency"] * 1000:10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -7,13 +7,13 @@
 
 # ---------- Basic Python imports ----------
 import os
+import sys
 import time
 import warnings
 # ---------- Image Processing ----------
 from PIL import Image
 # ---------- Data Analysis & Visualization ----------
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 # ---------- Machine Learning ----------
@@ -22,30 +22,42 @@ from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_class_weight
 # ---------- Deep Learning & TensorFlow ----------
 import tensorflow as tf
-from tensorflow.keras.models import Sequential, Model
-from tensorflow.keras.layers import (
-    BatchNormalization,
-    Dense,
-    Dropout,
-    Conv2D,
-    Multiply,
-    GlobalAveragePooling2D,
-    Reshape,
-    Layer
-)
 from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from tensorflow.keras.applications import VGG16
-from tensorflow.keras import Input
 from tensorflow.keras.callbacks import ModelCheckpoint, ReduceLROnPlateau
+# ---------- Shared helpers ----------
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.manifest import load_dataset_df  # noqa: E402
+from common.asnet_vgg16 import AS_Net  # noqa: E402
+from common.augmentation import BatchAugmentation  # noqa: E402
+from common.data_pipeline import flow_from_split  # noqa: E402
+from common.decode import read_image  # noqa: E402
+from common.distributed import (  # noqa: E402
+    cluster_strategy, is_chief, local_model, shard_split, worker_info, worker_path
+)
+from common.hashing import audit_splits, drop_flagged  # noqa: E402
+from common.materialize import encode_labels, materialize_images  # noqa: E402
+from common.precision import set_precision  # noqa: E402
+from common.progressive import fit_progressive, resize_schedule  # noqa: E402
+from common.training import fit_accumulated  # noqa: E402
 # ---------- Settings ----------
 warnings.filterwarnings("ignore")
 
 
+# Multi-worker CPU training (common/distributed.py): given a cluster spec -
+# CLUSTER_SPEC, the path of a TF_CONFIG-style JSON file, or the TF_CONFIG
+# variable tools/launch_local.py sets - every worker process joins one
+# MultiWorkerMirroredStrategy and trains on its own shard of the data
+CLUSTER_SPEC = None
+strategy = cluster_strategy(CLUSTER_SPEC)
+MULTI_WORKER = strategy is not None
+
 # GPU/CPU detection
 print("Checking available devices...")
 gpus = tf.config.list_physical_devices('GPU')
-if gpus:
+if MULTI_WORKER:
+    worker, workers = worker_info(strategy)
+    print(f"Worker {worker + 1} of {workers}")
+elif gpus:
     try:
         # Currently, memory growth needs to be the same across GPUs
         for gpu in gpus:
@@ -83,11 +95,8 @@ def create_dataset_df(path):
     Returns:
         pd.DataFrame: DataFrame with columns 'Class Path' and 'Class'
     """
-    classes, class_paths = zip(*[(label, os.path.join(path, label, image))
-                                 for label in os.listdir(path) if os.path.isdir(os.path.join(path, label))
-                                 for image in os.listdir(os.path.join(path, label))])
-
-    return pd.DataFrame({'Class Path': class_paths, 'Class': classes})
+    # Served from the persistent manifest; only changed class folders are rescanned
+    return load_dataset_df(path)
 
 # /kaggle/input/
 
@@ -127,6 +136,11 @@ plt.show()
 valid_df, ts_df = train_test_split(
     ts_df, train_size=0.5, random_state=20, stratify=ts_df['Class'])
 
+# Flag corrupt, duplicated and leaked images before they reach a model;
+# corrupt files are dropped, duplicates and leaks only reported
+audit = audit_splits({'train': tr_df, 'valid': valid_df, 'test': ts_df})
+tr_df, valid_df, ts_df = (drop_flagged(df, audit) for df in (tr_df, valid_df, ts_df))
+
 valid_df
 
 
@@ -137,30 +151,28 @@ BATCH_SIZE = 32 * strategy.num_replicas_in_sync
 IMAGE_SIZE = (224, 224)
 
 
-def prepare_data(tr_df, ts_df):
-    def process_image(file_path):
-        img = Image.open(file_path)
-        # Convert grayscale to RGB if needed
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        img = img.resize(IMAGE_SIZE)
-        return np.array(img)
+def prepare_data(tr_df, ts_df, memmap_dir=None):
+    # Images are decoded by one process per core, chunk by chunk, into shared uint8 buffers
+    # (streamed to .npy files under memmap_dir if given); scaling to [0, 1]
+    # happens per batch in the input pipeline, e.g. flow_from_arrays(X, y)
+    def memmap_path(name):
+        return os.path.join(memmap_dir, name) if memmap_dir else None
 
-    # Convert DataFrame to numpy arrays
-    X = np.array([process_image(f)
-                 for f in tr_df['Class Path']], dtype=np.float32) / 255.0
-    y = pd.get_dummies(tr_df['Class']).values
+    X = materialize_images(tr_df['Class Path'], IMAGE_SIZE, memmap_path=memmap_path('X.npy'),
+                           resample=Image.BICUBIC)
+    y, class_indices = encode_labels(tr_df['Class'])
 
-    X_test = np.array([process_image(f)
-                      for f in ts_df['Class Path']], dtype=np.float32) / 255.0
-    y_test = pd.get_dummies(ts_df['Class']).values
+    X_test = materialize_images(ts_df['Class Path'], IMAGE_SIZE, memmap_path=memmap_path('X_test.npy'),
+                                resample=Image.BICUBIC)
+    y_test, _ = encode_labels(ts_df['Class'], class_indices)
 
     return X, y, X_test, y_test
 
 
 def get_augmentation():
-    return ImageDataGenerator(
-        rescale=1/255,
+    # Same ranges as the former ImageDataGenerator, applied per batch on the graph;
+    # the loaders rescale to [0, 1] afterwards
+    return BatchAugmentation(
         brightness_range=(0.9, 1.1),
         rotation_range=15,
         width_shift_range=0.1,
@@ -174,20 +186,38 @@ def get_augmentation():
 
 _gen = get_augmentation()
 
-ts_gen = ImageDataGenerator(rescale=1/255)
 
+# Storage the loaders read from:
+#   'records' - sequential TFRecord shards, exported once per split
+#   'cache'   - pre-decoded uint8 rows, memory-mapped per split and IMAGE_SIZE
+#   'files'   - one image file read per sample
+DATA_SOURCE = 'records'
 
-tr_gen = _gen.flow_from_dataframe(tr_df, x_col='Class Path',
-                                  y_col='Class', batch_size=BATCH_SIZE,
-                                  target_size=IMAGE_SIZE)
+# Under a cluster every worker loads its own shard of the training and
+# validation splits, in batches of one replica (see fit_accumulated); the
+# chief evaluates the whole splits after training
+train_split, valid_split, LOADER_BATCH_SIZE = (tr_df, 'train'), (valid_df, 'valid'), BATCH_SIZE
+if MULTI_WORKER:
+    train_split = shard_split(tr_df, 'train', strategy)
+    valid_split = shard_split(valid_df, 'valid', strategy, even=False)
+    LOADER_BATCH_SIZE = BATCH_SIZE // strategy.num_replicas_in_sync
 
-valid_gen = _gen.flow_from_dataframe(valid_df, x_col='Class Path',
-                                     y_col='Class', batch_size=BATCH_SIZE,
-                                     target_size=IMAGE_SIZE)
+tr_gen = flow_from_split(*train_split, source=DATA_SOURCE,
+                         batch_size=LOADER_BATCH_SIZE, target_size=IMAGE_SIZE,
+                         augmentation=_gen)
 
-ts_gen = ts_gen.flow_from_dataframe(ts_df, x_col='Class Path',
-                                    y_col='Class', batch_size=BATCH_SIZE,
-                                    target_size=IMAGE_SIZE, shuffle=False)
+# Validation is decoded once into memory and never augmented, so the
+# val_* metrics the callbacks watch are the same images every epoch
+valid_gen = flow_from_split(*valid_split, source='memory',
+                            batch_size=LOADER_BATCH_SIZE, target_size=IMAGE_SIZE,
+                            shuffle=False, class_indices=tr_gen.class_indices)
+
+# Under a cluster only the chief loads the test split, after training (end
+# of section 4), so workers sharing a cache never export the same split
+if not MULTI_WORKER:
+    ts_gen = flow_from_split(ts_df, 'test', source=DATA_SOURCE,
+                             batch_size=BATCH_SIZE, target_size=IMAGE_SIZE,
+                             shuffle=False)
 
 
 # 2.4 Getting samples from data
@@ -198,7 +228,7 @@ class_dict = tr_gen.class_indices
 classes = list(class_dict.keys())
 
 # Get a batch of images
-images, labels = next(ts_gen)
+images, labels = next(iter(valid_gen if MULTI_WORKER else ts_gen))
 
 # Calculate grid dimensions based on number of images
 n_images = len(images)
@@ -223,235 +253,70 @@ plt.show()
 # 3. Building Deep Learning Model
 # ------------------------------
 
-class SAM(Model):
-    def __init__(self, filters):
-        super(SAM, self).__init__()
-        self.filters = filters
-        # Three sequential 3x3 convs as specified
-        self.conv1 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        self.conv2 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        self.conv3 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        # Dimension reduction conv
-        self.conv4 = Conv2D(self.filters // 4, 1,
-                            activation='relu', kernel_initializer='he_normal')
-        # Attention branch convs
-        self.W1 = Conv2D(1, 1, activation='sigmoid',
-                         kernel_initializer='he_normal')
-        self.W2 = Conv2D(1, 1, activation='sigmoid',
-                         kernel_initializer='he_normal')
-
-    def call(self, inputs):
-        # Sequential convolutions
-        out1 = self.conv3(self.conv2(self.conv1(inputs)))
-        # Dimension reduction
-        out2 = self.conv4(inputs)
-
-        # 2x2 max pooling branch
-        pool1 = tf.keras.layers.MaxPool2D(pool_size=(2, 2))(out2)
-        # Bilinear upsampling to original size
-        upsample1 = tf.image.resize(pool1, size=tf.shape(out2)[
-                                    1:3], method='bilinear')
-        # Apply 1x1 conv with sigmoid
-        attention1 = self.W1(upsample1)
-
-        # 4x4 max pooling branch
-        pool2 = tf.keras.layers.MaxPool2D(pool_size=(4, 4))(out2)
-        # Bilinear upsampling to original size
-        upsample2 = tf.image.resize(pool2, size=tf.shape(out2)[
-                                    1:3], method='bilinear')
-        # Apply 1x1 conv with sigmoid
-        attention2 = self.W2(upsample2)
-
-        # Sum the two attention maps
-        attention_sum = attention1 + attention2
-
-        # Apply attention to features via element-wise multiplication
-        attended_features = Multiply()([out1, attention_sum])
-
-        # Add to dimension-reduced input (residual connection)
-        y = attended_features + out2
-        return y
-
-
-class CAM(Model):
-    def __init__(self, filters, reduction_ratio=16):
-        super(CAM, self).__init__()
-        self.filters = filters
-        # Conv block to process input features
-        self.conv1 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        self.conv2 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        self.conv3 = Conv2D(self.filters // 4, 3, activation='relu',
-                            padding='same', kernel_initializer='he_normal')
-        # Dimension reduction conv
-        self.conv4 = Conv2D(self.filters // 4, 1,
-                            activation='relu', kernel_initializer='he_normal')
-        # Squeeze-and-Excitation components
-        self.gpool = GlobalAveragePooling2D()
-        self.fc1 = Dense(self.filters // (4 * reduction_ratio),
-                         activation='relu', use_bias=False)
-        self.fc2 = Dense(self.filters // 4,
-                         activation='sigmoid', use_bias=False)
-
-    def call(self, inputs):
-        # Process input through conv block
-        out1 = self.conv3(self.conv2(self.conv1(inputs)))
-        # Dimension reduction
-        out2 = self.conv4(inputs)
-
-        # Squeeze-and-Excitation: squeeze spatial dimensions
-        channel_attention = self.gpool(out2)
-        # Dimension reduction in channel-wise fully connected layer
-        channel_attention = self.fc1(channel_attention)
-        # Dimension increase with sigmoid activation
-        channel_attention = self.fc2(channel_attention)
-        # Reshape to proper dimensions for broadcasting
-        channel_attention = Reshape(
-            (1, 1, self.filters // 4))(channel_attention)
-
-        # Apply channel attention via element-wise multiplication
-        recalibrated = Multiply()([out1, channel_attention])
-
-        # Add residual connection with dimension-reduced input
-        y = recalibrated + out2
-        return y
-
-
-class SynergyModule(Model):
-    def __init__(self, filters):
-        super(SynergyModule, self).__init__()
-        self.filters = filters
-        # Trainable scaling parameters
-        self.alpha = tf.Variable(
-            0.5, trainable=True, dtype=tf.float32, name="alpha")
-        self.beta = tf.Variable(0.5, trainable=True,
-                                dtype=tf.float32, name="beta")
-        # Integration components
-        self.conv = Conv2D(filters, 3, padding='same',
-                           kernel_initializer='he_normal')
-        self.bn = BatchNormalization()
-
-    def call(self, inputs):
-        # Unpack inputs (spatial and channel attention outputs)
-        spatial_features, channel_features = inputs
-
-        # Scale each pathway with trainable parameters
-        scaled_spatial = tf.multiply(spatial_features, self.alpha)
-        scaled_channel = tf.multiply(channel_features, self.beta)
-
-        # Sum the scaled features
-        combined = scaled_spatial + scaled_channel
-
-        # Apply convolution and batch normalization
-        output = self.conv(combined)
-        output = self.bn(output)
-
-        return output
-
-
-class ResizeLayer(Layer):
-    def __init__(self, target_height, target_width, **kwargs):
-        super(ResizeLayer, self).__init__(**kwargs)
-        self.target_height = target_height
-        self.target_width = target_width
-
-    def call(self, inputs):
-        return tf.image.resize(inputs, (self.target_height, self.target_width))
-
-
-def adjust_feature_map(x, target_shape):
-    _, h, w, _ = target_shape
-    current_h, current_w = x.shape[1:3]
-    if current_h != h or current_w != w:
-        resize_layer = ResizeLayer(h, w)
-        return resize_layer(x)
-    return x
-
-
-# AS_Net with VGG16 encoder
-def AS_Net(encoder='vgg16', input_size=(IMAGE_SIZE[0], IMAGE_SIZE[1], 3), fine_tune_at=None):
-    inputs = Input(input_size)
-    print(f'CURRENT ENCODER: {encoder}')
-
-    if encoder == 'vgg16':
-        # Load VGG16 with ImageNet weights
-        ENCODER = VGG16(weights='imagenet', include_top=False,
-                        input_shape=input_size)
-
-        # Freeze all layers initially
-        ENCODER.trainable = False
-
-        # Optionally, unfreeze layers for fine-tuning from a certain layer
-        if fine_tune_at is not None:
-            for layer in ENCODER.layers[:fine_tune_at]:
-                layer.trainable = False
-            for layer in ENCODER.layers[fine_tune_at:]:
-                layer.trainable = True
-
-        # Selected output layers (you can experiment with different indices)
-        layer_indices = [2, 5, 9, 13, 17]
-    else:
-        raise ValueError(
-            "Unsupported encoder type. Only 'vgg16' is supported in this case.")
-
-    # Get the output layers dynamically
-    output_layers = [ENCODER.get_layer(index=i).output for i in layer_indices]
-    encoder_outputs = [Model(inputs=ENCODER.inputs, outputs=layer)(inputs)
-                       for layer in output_layers]
-
-    # Get the final encoder output that will be processed by the attention paths
-    final_encoder_output = encoder_outputs[-1]
-    filters = final_encoder_output.shape[-1]
-
-    # Create two parallel attention paths
-    # Spatial Attention Path
-    SAM_output = SAM(filters=filters)(final_encoder_output)
-
-    # Channel Attention Path
-    CAM_output = CAM(filters=filters)(final_encoder_output)
-
-    # Apply Synergy Module to combine attention outputs
-    synergy_output = SynergyModule(filters=filters)([SAM_output, CAM_output])
-
-    # Simplify the final layers
-    final_layers = Sequential([
-        Conv2D(128, 3, activation='relu', padding='same'),
-        BatchNormalization(),
-        GlobalAveragePooling2D(),
-        Dense(256, activation='relu'),
-        Dropout(0.3),
-        Dense(4, activation='softmax')
-    ])
-
-    output = final_layers(synergy_output)
-
-    model = Model(inputs=inputs, outputs=output)
-    return model
+# The attention blocks and AS_Net are in common/asnet_vgg16.py; importing it
+# registers their layers, so best_model.keras reloads without custom_objects
 
 
 # Create and compile the model
-with strategy.scope():
-    model = AS_Net(encoder='vgg16', fine_tune_at=12)
-
-    # Simplified learning rate setup
-    initial_learning_rate = 1e-4
-
-    optimizer = Adam(learning_rate=initial_learning_rate)
-
-    model.compile(
-        optimizer=optimizer,
-        loss='categorical_crossentropy',
-        metrics=[
-            'accuracy',
-            tf.keras.metrics.Precision(name='precision'),
-            tf.keras.metrics.Recall(name='recall'),
-            tf.keras.metrics.AUC(name='auc')
-        ]
-    )
+# True XLA-compiles the train/eval steps (the attention blocks are
+# static-shaped; see benchmarks/xla.py); None leaves it to Keras' 'auto',
+# which keeps XLA off on CPU-only machines
+JIT_COMPILE = None
+# One conv trunk shared by the SAM and CAM branches instead of one each
+# (about half the head FLOPs; see benchmarks/attention.py)
+FUSED_ATTENTION = False
+# Factorized 3x3 convs in SAM/CAM and the SynergyModule: 'spatial' (3x1 then
+# 1x3 conv through FACTORIZATION_RANK channels) or 'depthwise' (depthwise
+# conv with that depth multiplier, then 1x1); None keeps full convs. See
+# common/layers.py; tools/factorize.py converts a trained checkpoint instead
+FACTORIZATION = None
+FACTORIZATION_RANK = None
+# Gradient accumulation (common/training.py): ACCUMULATION_STEPS loader
+# batches of BATCH_SIZE make one optimizer update, so the effective batch is
+# BATCH_SIZE * ACCUMULATION_STEPS at the activation memory of one BATCH_SIZE
+# batch; None trains with fit(). See benchmarks/accumulation.py
+ACCUMULATION_STEPS = None
+# Preemption-safe training (common/training.py): with a CHECKPOINT_DIR,
+# training runs through fit_accumulated, which checkpoints the model,
+# optimizer, callbacks and loader position every CHECKPOINT_EVERY updates and
+# at every epoch end; running the script again resumes from the latest one,
+# mid-epoch if need be. See tools/resume_check.py
+CHECKPOINT_DIR = None
+CHECKPOINT_EVERY = 100
+# Keras dtype policy: 'float32', 'mixed_bfloat16' (CPUs with BF16/AMX, TPUs)
+# or 'mixed_float16' (GPUs, with automatic loss scaling); see common/precision.py
+PRECISION = 'float32'
+set_precision(PRECISION)
+
+# Simplified learning rate setup
+initial_learning_rate = 1e-4
+
+
+def build_model(image_size=IMAGE_SIZE):
+    # Also builds the smaller-input models of progressive resizing (section 4)
+    with strategy.scope():
+        model = AS_Net(encoder='vgg16', input_size=(image_size[0], image_size[1], 3),
+                       fine_tune_at=12, jit_compile=JIT_COMPILE,
+                       fused_attention=FUSED_ATTENTION, factorization=FACTORIZATION,
+                       factorization_rank=FACTORIZATION_RANK)
+
+        optimizer = Adam(learning_rate=initial_learning_rate)
+
+        model.compile(
+            optimizer=optimizer,
+            loss='categorical_crossentropy',
+            jit_compile=model.jit_compile,
+            metrics=[
+                'accuracy',
+                tf.keras.metrics.Precision(name='precision'),
+                tf.keras.metrics.Recall(name='recall'),
+                tf.keras.metrics.AUC(name='auc')
+            ]
+        )
+    return model
+
+
+model = build_model()
 
 model.summary()
 
@@ -469,7 +334,7 @@ num_epochs = 35
 
 # Callbacks
 tensorboard_callback = tf.keras.callbacks.TensorBoard(
-    log_dir='logs',
+    log_dir=worker_path('logs', strategy),
     histogram_freq=1,
     write_graph=True,
     profile_batch=0
@@ -490,7 +355,7 @@ reduce_lr = ReduceLROnPlateau(
 )
 
 checkpoint = ModelCheckpoint(
-    'best_model.keras',
+    worker_path('best_model.keras', strategy),
     monitor='val_loss',
     save_best_only=True,
     mode='min'
@@ -507,29 +372,85 @@ def get_class_weights(y):
     return dict(enumerate(class_weights))
 
 
-# Calculate balanced class weights
+# Calculate balanced class weights, over the whole training split
+train_classes = tr_df['Class'].map(tr_gen.class_indices).to_numpy()
 class_weights = compute_class_weight(
     'balanced',
-    classes=np.unique(tr_gen.classes),
-    y=tr_gen.classes
+    classes=np.unique(train_classes),
+    y=train_classes
 )
 
 class_weight_dict = dict(enumerate(class_weights))
 
-# Use in training
-hist = model.fit(
-    tr_gen,
-    epochs=num_epochs,
-    validation_data=valid_gen,
-    shuffle=True,
-    class_weight=class_weight_dict,  # Use computed class weights
-    callbacks=[
-        early_stopping,
-        tensorboard_callback,
-        reduce_lr,
-        checkpoint
-    ]
-)
+# Progressive resizing (common/progressive.py): the first epochs train at
+# PROGRESSIVE_START_SIZE and the size steps up to IMAGE_SIZE over
+# PROGRESSIVE_STAGES sizes, with one pre-built model per size sharing the
+# weights; None trains at IMAGE_SIZE throughout. The callbacks run in the
+# final stage. See benchmarks/progressive.py for the wall-clock comparison
+PROGRESSIVE_START_SIZE = None
+PROGRESSIVE_STAGES = 3
+
+callbacks = [
+    early_stopping,
+    tensorboard_callback,
+    reduce_lr,
+    checkpoint
+]
+
+if ACCUMULATION_STEPS is not None or CHECKPOINT_DIR is not None or MULTI_WORKER:
+    if PROGRESSIVE_START_SIZE is not None:
+        raise ValueError('PROGRESSIVE_START_SIZE cannot be combined with ACCUMULATION_STEPS, '
+                         'CHECKPOINT_DIR or a cluster')
+    hist = fit_accumulated(
+        model,
+        tr_gen,
+        epochs=num_epochs,
+        accumulation_steps=ACCUMULATION_STEPS or 1,
+        validation_data=valid_gen,
+        class_weight=class_weight_dict,
+        callbacks=callbacks,
+        checkpoint_dir=CHECKPOINT_DIR,
+        checkpoint_every=CHECKPOINT_EVERY
+    )
+elif PROGRESSIVE_START_SIZE is None:
+    # Use in training
+    hist = model.fit(
+        tr_gen,
+        epochs=num_epochs,
+        validation_data=valid_gen,
+        shuffle=True,
+        class_weight=class_weight_dict,  # Use computed class weights
+        callbacks=callbacks
+    )
+else:
+    schedule = resize_schedule(IMAGE_SIZE[0], num_epochs, PROGRESSIVE_START_SIZE,
+                               PROGRESSIVE_STAGES)
+    model, hist = fit_progressive(
+        lambda size: model if size == IMAGE_SIZE[0] else build_model((size, size)),
+        schedule,
+        tr_gen,
+        validation_data=valid_gen,
+        shuffle=True,
+        class_weight=class_weight_dict,
+        callbacks=callbacks
+    )
+
+if MULTI_WORKER:
+    # The evaluation below runs once, on the chief, with a single-process
+    # copy of the trained model and the whole splits rather than its
+    # shards; the other workers are done
+    if not is_chief(strategy):
+        sys.exit(0)
+    model = local_model(model)
+    tr_gen = flow_from_split(tr_df, 'train', source=DATA_SOURCE,
+                             batch_size=BATCH_SIZE, target_size=IMAGE_SIZE,
+                             augmentation=_gen)
+    valid_gen = flow_from_split(valid_df, 'valid', source='memory',
+                                batch_size=BATCH_SIZE, target_size=IMAGE_SIZE,
+                                shuffle=False, class_indices=tr_gen.class_indices)
+    ts_gen = flow_from_split(ts_df, 'test', source=DATA_SOURCE,
+                             batch_size=BATCH_SIZE, target_size=IMAGE_SIZE,
+                             shuffle=False)
 
 
 """
@@ -731,33 +652,24 @@ weighted avg       0.99      0.99      0.99       656
 # ------------------------------
 
 def predict_with_tta(model, img_path, num_augmentations=5):
-    img = Image.open(img_path)
-    resized_img = img.resize(IMAGE_SIZE)
-    img_array = np.asarray(resized_img)
+    # Decodes at a reduced JPEG scale before the final (bicubic) resize
+    img_array = read_image(img_path, IMAGE_SIZE, Image.BICUBIC)
 
-    # Create augmented versions
-    predictions = []
+    # Augment all copies as one batch and predict them with the original
     aug = get_augmentation()
-
-    # Original prediction
-    base_pred = model.predict(np.expand_dims(img_array, 0)/255.0)
-    predictions.append(base_pred)
-
-    # Augmented predictions
-    for _ in range(num_augmentations):
-        aug_img = aug.random_transform(img_array)
-        aug_pred = model.predict(np.expand_dims(aug_img, 0)/255.0)
-        predictions.append(aug_pred)
+    copies = np.repeat(np.expand_dims(img_array, 0), num_augmentations, axis=0)
+    aug_imgs = aug(copies).numpy()
+    batch = np.concatenate([np.expand_dims(img_array, 0), aug_imgs]) / 255.0
+    predictions = model.predict(batch)
 
     # Average predictions
-    return np.mean(predictions, axis=0)
+    return np.mean(predictions, axis=0, keepdims=True)
 
 
 def predict(img_path):
     label = list(class_dict.keys())
     plt.figure(figsize=(12, 12))
-    img = Image.open(img_path)
-    resized_img = img.resize(IMAGE_SIZE)
+    resized_img = read_image(img_path, IMAGE_SIZE, Image.BICUBIC)
 
     # Use TTA for prediction
     predictions = predict_with_tta(model, img_path)